@@ -28,12 +28,14 @@ import glob
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from scipy.signal import find_peaks, butter, filtfilt, resample
+from scipy.signal import find_peaks, butter, filtfilt
 from scipy.ndimage import gaussian_filter1d
-from sklearn.model_selection import train_test_split
 import warnings
 warnings.filterwarnings('ignore')
 
+from bidmc_cache import load_all_subjects_cached
+import profiling
+
 # Configurações
 plt.rcParams['figure.figsize'] = (14, 4)
 plt.rcParams['figure.dpi'] = 100
@@ -48,6 +50,11 @@ STRIDE = WINDOW_SIZE // 2   # 50% overlap
 MIMIC_DIR = '/home/douglas/Documentos/Projects/PPG/pulse-analytics/analytics/datasets/ MIMIC II'
 ESP32_DIR = '/home/douglas/Documentos/Projects/PPG/pulse-analytics/analytics/datasets'
 
+# Tempo/memória por etapa (carga, labels, janelas, épocas, validação, inferência)
+PROFILE = False  # ⬅️ Ative para gerar profile/profile_trace.json e profile/profile.prom
+if PROFILE:
+    profiling.enable(trace_memory=False)  # trace_memory=True: pico de alocações (mais lento)
+
 print(f"✅ Configurações:")
 print(f"   - Janela: {WINDOW_SEC}s = {WINDOW_SIZE} samples @ {FS}Hz")
 print(f"   - Dataset: {MIMIC_DIR}")
@@ -78,13 +85,20 @@ def load_bidmc_record(filepath):
     return ppg, ecg, FS
 
 
-def load_all_subjects(mimic_dir):
+@profiling.profiled('load')
+def load_all_subjects(mimic_dir, use_cache=True):
     """
     Carrega todos os 53 sujeitos do BIDMC.
     
+    Com use_cache=True os CSVs são convertidos uma única vez para .npy
+    (ver bidmc_cache.py) e os sinais são abertos com memory-map.
+    
     Returns:
         subjects: Lista de dicts com 'id', 'ppg', 'ecg'
     """
+    if use_cache:
+        return load_all_subjects_cached(mimic_dir)
+    
     pattern = os.path.join(mimic_dir, 'bidmc_*_Signals.csv')
     files = sorted(glob.glob(pattern))
     
@@ -145,85 +159,19 @@ plt.show()
 # ## 3. Detectando Picos e Criando Labels
 
 # %%
-def detect_ecg_r_peaks(ecg, fs, min_distance_sec=0.4):
-    """
-    Detecta picos R no ECG usando derivada + threshold.
-    """
-    # Filtro passa-banda para QRS (5-25 Hz)
-    nyq = fs / 2
-    b, a = butter(2, [5/nyq, 25/nyq], btype='band')
-    ecg_filt = filtfilt(b, a, ecg)
-    
-    # Elevar ao quadrado
-    ecg_sq = ecg_filt ** 2
-    
-    # Suavizar
-    ecg_smooth = gaussian_filter1d(ecg_sq, sigma=fs * 0.02)
-    
-    # Detectar picos
-    min_dist = int(min_distance_sec * fs)
-    threshold = np.percentile(ecg_smooth, 70)
-    peaks, _ = find_peaks(ecg_smooth, distance=min_dist, height=threshold)
-    
-    return peaks
-
-
-def transfer_peaks_to_ppg(ecg_peaks, ppg, fs, ptt_range=(0.15, 0.35)):
-    """
-    Transfere picos R do ECG para picos sistólicos do PPG.
-    O Pulse Transit Time (PTT) é tipicamente 150-350ms.
-    """
-    ppg_peaks = []
-    ptt_min = int(ptt_range[0] * fs)
-    ptt_max = int(ptt_range[1] * fs)
-    
-    for ecg_peak in ecg_peaks:
-        search_start = ecg_peak + ptt_min
-        search_end = ecg_peak + ptt_max
-        
-        if search_end >= len(ppg):
-            continue
-        
-        # Máximo local na janela
-        window = ppg[search_start:search_end]
-        local_max = np.argmax(window)
-        ppg_peaks.append(search_start + local_max)
-    
-    return np.array(ppg_peaks)
-
-
-def create_labels_for_subject(subject):
-    """
-    Cria labels binários para um sujeito.
-    """
-    ppg = subject['ppg']
-    ecg = subject['ecg']
-    fs = subject['fs']
-    
-    # Detectar picos R no ECG
-    ecg_peaks = detect_ecg_r_peaks(ecg, fs)
-    
-    # Transferir para PPG
-    ppg_peaks = transfer_peaks_to_ppg(ecg_peaks, ppg, fs)
-    
-    # Criar array de labels
-    labels = np.zeros(len(ppg))
-    for peak in ppg_peaks:
-        # Marcar região ±3 amostras (±24ms @ 125Hz)
-        for offset in range(-3, 4):
-            if 0 <= peak + offset < len(labels):
-                labels[peak + offset] = 1
-    
-    return ppg_peaks, labels
+from labeling import label_all_subjects
 
+# Janela de PTT (ECG → PPG) e meia-largura dos labels (±3 amostras = ±24ms @ 125Hz)
+PTT_RANGE = (0.15, 0.35)
+LABEL_RADIUS = 3
 
-# Processar todos os sujeitos
+# Processar todos os sujeitos (picos R em paralelo no Jupyter, cache em disco).
+# Como script (`python 01_...py`) roda em série: sem guarda de __main__, os
+# workers "spawn" reexecutariam o notebook inteiro (ver labeling.spawn_pool_safe)
 print("🔍 Detectando picos para todos os sujeitos...")
-for subj in subjects:
-    ppg_peaks, labels = create_labels_for_subject(subj)
-    subj['peaks'] = ppg_peaks
-    subj['labels'] = labels
-    
+label_all_subjects(subjects, ptt_range=PTT_RANGE, label_radius=LABEL_RADIUS,
+                   cache_dir=os.path.join(MIMIC_DIR, '.label_cache'))
+
 print(f"✅ Processados {len(subjects)} sujeitos")
 
 # Estatísticas de picos
@@ -261,82 +209,24 @@ plt.show()
 # ## 4. Criando Dataset de Janelas
 
 # %%
-def create_windows(ppg, labels, window_size, stride):
-    """
-    Cria janelas de PPG com labels correspondentes.
-    """
-    X, y = [], []
-    
-    # Normalizar PPG (Z-score por janela)
-    for start in range(0, len(ppg) - window_size, stride):
-        window_ppg = ppg[start:start + window_size].copy()
-        window_labels = labels[start:start + window_size].copy()
-        
-        # Z-score normalização
-        mean = np.mean(window_ppg)
-        std = np.std(window_ppg) + 1e-8
-        window_ppg = (window_ppg - mean) / std
-        
-        # Só incluir janelas com pelo menos 1 pico completo
-        if np.sum(window_labels) > 0:
-            X.append(window_ppg)
-            y.append(window_labels)
-    
-    return np.array(X), np.array(y)
+# Dataset sob demanda: janelas fatiadas dos sinais memory-mapped e alvos
+# gerados a partir dos picos esparsos (nada de X/y densos em memória)
+from peak_dataset import PeakWindowDataset, split_dataset
 
+# Sujeitos de teste ficam fora do treino e da validação (avaliação por
+# batimento e quantização avaliam só neles)
+N_TEST_SUBJECTS = 5
+train_subjects, test_subjects = subjects[:-N_TEST_SUBJECTS], subjects[-N_TEST_SUBJECTS:]
+print(f"🧪 Sujeitos de teste (fora do treino): {[s['id'] for s in test_subjects]}")
 
-def prepare_dataset_loso(subjects, test_subject_id, window_size, stride):
-    """
-    Prepara dataset para validação Leave-One-Subject-Out.
-    
-    Args:
-        subjects: Lista de todos os sujeitos
-        test_subject_id: ID do sujeito para teste
-        
-    Returns:
-        X_train, y_train, X_test, y_test
-    """
-    X_train, y_train = [], []
-    X_test, y_test = [], []
-    
-    for subj in subjects:
-        X_subj, y_subj = create_windows(
-            subj['ppg'], subj['labels'], window_size, stride
-        )
-        
-        if subj['id'] == test_subject_id:
-            X_test.append(X_subj)
-            y_test.append(y_subj)
-        else:
-            X_train.append(X_subj)
-            y_train.append(y_subj)
-    
-    X_train = np.concatenate(X_train, axis=0)
-    y_train = np.concatenate(y_train, axis=0)
-    X_test = np.concatenate(X_test, axis=0) if X_test else np.array([])
-    y_test = np.concatenate(y_test, axis=0) if y_test else np.array([])
-    
-    return X_train, y_train, X_test, y_test
-
-
-# Criar dataset completo primeiro (para treinamento rápido)
 print("📦 Criando janelas de treinamento...")
-all_X, all_y = [], []
-for subj in subjects:
-    X_subj, y_subj = create_windows(subj['ppg'], subj['labels'], WINDOW_SIZE, STRIDE)
-    all_X.append(X_subj)
-    all_y.append(y_subj)
-
-X_all = np.concatenate(all_X, axis=0)
-y_all = np.concatenate(all_y, axis=0)
-
-print(f"✅ Dataset total: {X_all.shape[0]} janelas de {X_all.shape[1]} amostras")
+with profiling.stage('window'):
+    dataset = PeakWindowDataset(train_subjects, WINDOW_SIZE, STRIDE, label_radius=LABEL_RADIUS)
+print(f"✅ Dataset total: {len(dataset)} janelas de {WINDOW_SIZE} amostras")
 
 # Split treino/validação (por agora, simples)
-X_train, X_val, y_train, y_val = train_test_split(
-    X_all, y_all, test_size=0.15, random_state=42
-)
-print(f"🔀 Treino: {len(X_train)} | Validação: {len(X_val)}")
+train_ds, val_ds = split_dataset(dataset, val_fraction=0.15, seed=42)
+print(f"🔀 Treino: {len(train_ds)} | Validação: {len(val_ds)}")
 
 # %% [markdown]
 # ## 5. Modelo Performer (Transformer com Atenção Linear)
@@ -348,192 +238,11 @@ print(f"🔀 Treino: {len(X_train)} | Validação: {len(X_val)}")
 
 # %%
 import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from torch.utils.data import DataLoader, TensorDataset
-import math
 
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-print(f"🖥️ Dispositivo: {device}")
-
-
-class PositionalEncoding(nn.Module):
-    """Codificação posicional sinusoidal."""
-    
-    def __init__(self, d_model, max_len=1000):
-        super().__init__()
-        pe = torch.zeros(max_len, d_model)
-        position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
-        div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
-        pe[:, 0::2] = torch.sin(position * div_term)
-        pe[:, 1::2] = torch.cos(position * div_term)
-        self.register_buffer('pe', pe.unsqueeze(0))
-    
-    def forward(self, x):
-        return x + self.pe[:, :x.size(1)]
+# Modelo em módulo separado (importável pelos processos do LOSO paralelo)
+from performer import PPGPeakPerformer, train_performer, device
 
-
-class PerformerAttention(nn.Module):
-    """
-    Atenção Linear usando FAVOR+ (aproximação do softmax).
-    
-    Complexidade: O(n) ao invés de O(n²)
-    """
-    
-    def __init__(self, d_model, n_heads=4, n_features=64):
-        super().__init__()
-        self.d_model = d_model
-        self.n_heads = n_heads
-        self.head_dim = d_model // n_heads
-        self.n_features = n_features
-        
-        self.q_proj = nn.Linear(d_model, d_model)
-        self.k_proj = nn.Linear(d_model, d_model)
-        self.v_proj = nn.Linear(d_model, d_model)
-        self.out_proj = nn.Linear(d_model, d_model)
-        
-        # Random features para aproximação do kernel
-        self.register_buffer(
-            'random_features',
-            torch.randn(n_heads, self.head_dim, n_features) / math.sqrt(n_features)
-        )
-    
-    def _feature_map(self, x):
-        """Mapa de features positivas para aproximar exp(q·k)."""
-        # x: (batch, heads, seq, head_dim)
-        # random_features: (heads, head_dim, n_features)
-        
-        # Projeção random
-        x_proj = torch.einsum('bhsd,hdf->bhsf', x, self.random_features)
-        
-        # Softmax positivo (aproximação)
-        return F.softplus(x_proj)
-    
-    def forward(self, x):
-        batch, seq_len, _ = x.shape
-        
-        # Projeções Q, K, V
-        q = self.q_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
-        k = self.k_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
-        v = self.v_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
-        
-        # Feature maps
-        q_prime = self._feature_map(q)  # (batch, heads, seq, n_features)
-        k_prime = self._feature_map(k)
-        
-        # Atenção linear: O(n*d*m) onde m = n_features
-        # kv = k_prime^T @ v
-        kv = torch.einsum('bhsf,bhsd->bhfd', k_prime, v)  # (batch, heads, n_features, head_dim)
-        
-        # Denominador para normalização
-        k_sum = k_prime.sum(dim=2, keepdim=True)  # (batch, heads, 1, n_features)
-        
-        # Numerador
-        qkv = torch.einsum('bhsf,bhfd->bhsd', q_prime, kv)  # (batch, heads, seq, head_dim)
-        
-        # Denominador por posição
-        denom = torch.einsum('bhsf,bhof->bhs', q_prime, k_sum) + 1e-8
-        
-        # Output normalizado
-        out = qkv / denom.unsqueeze(-1)
-        
-        # Reshape e projeção final
-        out = out.transpose(1, 2).contiguous().view(batch, seq_len, self.d_model)
-        return self.out_proj(out)
-
-
-class PerformerBlock(nn.Module):
-    """Bloco Transformer com Performer Attention."""
-    
-    def __init__(self, d_model, n_heads=4, ff_dim=256, dropout=0.1):
-        super().__init__()
-        self.attention = PerformerAttention(d_model, n_heads)
-        self.norm1 = nn.LayerNorm(d_model)
-        self.norm2 = nn.LayerNorm(d_model)
-        
-        self.ff = nn.Sequential(
-            nn.Linear(d_model, ff_dim),
-            nn.GELU(),
-            nn.Dropout(dropout),
-            nn.Linear(ff_dim, d_model),
-            nn.Dropout(dropout)
-        )
-        self.dropout = nn.Dropout(dropout)
-    
-    def forward(self, x):
-        # Self-attention com residual
-        attn_out = self.attention(self.norm1(x))
-        x = x + self.dropout(attn_out)
-        
-        # Feed-forward com residual
-        ff_out = self.ff(self.norm2(x))
-        x = x + ff_out
-        
-        return x
-
-
-class PPGPeakPerformer(nn.Module):
-    """
-    Modelo Performer para detecção de picos em PPG.
-    
-    Arquitetura:
-    - Embedding 1D (Conv)
-    - Positional Encoding
-    - N x Performer Blocks
-    - Decoder (Conv 1D)
-    """
-    
-    def __init__(self, window_size=500, d_model=64, n_heads=4, n_layers=4, dropout=0.1):
-        super().__init__()
-        
-        # Embedding: 1D signal -> d_model features
-        self.embedding = nn.Sequential(
-            nn.Conv1d(1, d_model // 2, kernel_size=7, padding=3),
-            nn.BatchNorm1d(d_model // 2),
-            nn.GELU(),
-            nn.Conv1d(d_model // 2, d_model, kernel_size=5, padding=2),
-            nn.BatchNorm1d(d_model),
-            nn.GELU()
-        )
-        
-        self.pos_encoding = PositionalEncoding(d_model, max_len=window_size)
-        
-        # Performer blocks
-        self.transformer = nn.ModuleList([
-            PerformerBlock(d_model, n_heads, ff_dim=d_model * 4, dropout=dropout)
-            for _ in range(n_layers)
-        ])
-        
-        # Decoder
-        self.decoder = nn.Sequential(
-            nn.Conv1d(d_model, d_model // 2, kernel_size=5, padding=2),
-            nn.BatchNorm1d(d_model // 2),
-            nn.GELU(),
-            nn.Conv1d(d_model // 2, 1, kernel_size=3, padding=1),
-            nn.Sigmoid()
-        )
-    
-    def forward(self, x):
-        # x: (batch, window_size)
-        batch, seq_len = x.shape
-        
-        # Embedding
-        x = x.unsqueeze(1)  # (batch, 1, seq_len)
-        x = self.embedding(x)  # (batch, d_model, seq_len)
-        x = x.transpose(1, 2)  # (batch, seq_len, d_model)
-        
-        # Positional encoding
-        x = self.pos_encoding(x)
-        
-        # Transformer blocks
-        for block in self.transformer:
-            x = block(x)
-        
-        # Decoder
-        x = x.transpose(1, 2)  # (batch, d_model, seq_len)
-        x = self.decoder(x)  # (batch, 1, seq_len)
-        
-        return x.squeeze(1)  # (batch, seq_len)
+print(f"🖥️ Dispositivo: {device}")
 
 
 # Criar modelo
@@ -552,90 +261,55 @@ print(f"🏗️ Modelo Performer criado: {n_params:,} parâmetros")
 # ## 6. Treinamento
 
 # %%
-def train_performer(model, X_train, y_train, X_val, y_val, 
-                   epochs=50, batch_size=64, lr=1e-3):
-    """
-    Treina o modelo Performer.
-    """
-    # Tensors
-    X_train_t = torch.FloatTensor(X_train)
-    y_train_t = torch.FloatTensor(y_train)
-    X_val_t = torch.FloatTensor(X_val).to(device)
-    y_val_t = torch.FloatTensor(y_val).to(device)
-    
-    # DataLoader
-    train_ds = TensorDataset(X_train_t, y_train_t)
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)
-    
-    # Loss e optimizer
-    # Usar Focal Loss para lidar com desbalanceamento (poucos 1s, muitos 0s)
-    criterion = nn.BCELoss()
-    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=0.01)
-    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
-    
-    history = {'train_loss': [], 'val_loss': [], 'val_f1': []}
-    best_val_loss = float('inf')
-    
-    for epoch in range(epochs):
-        model.train()
-        train_losses = []
-        
-        for X_batch, y_batch in train_loader:
-            X_batch = X_batch.to(device)
-            y_batch = y_batch.to(device)
-            
-            optimizer.zero_grad()
-            y_pred = model(X_batch)
-            loss = criterion(y_pred, y_batch)
-            loss.backward()
-            
-            # Gradient clipping
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-            
-            optimizer.step()
-            train_losses.append(loss.item())
-        
-        scheduler.step()
-        
-        # Validação
-        model.eval()
-        with torch.no_grad():
-            y_val_pred = model(X_val_t)
-            val_loss = criterion(y_val_pred, y_val_t).item()
-            
-            # F1 Score aproximado
-            y_pred_bin = (y_val_pred > 0.5).float()
-            tp = (y_pred_bin * y_val_t).sum()
-            fp = (y_pred_bin * (1 - y_val_t)).sum()
-            fn = ((1 - y_pred_bin) * y_val_t).sum()
-            precision = tp / (tp + fp + 1e-8)
-            recall = tp / (tp + fn + 1e-8)
-            f1 = 2 * precision * recall / (precision + recall + 1e-8)
-        
-        train_loss = np.mean(train_losses)
-        history['train_loss'].append(train_loss)
-        history['val_loss'].append(val_loss)
-        history['val_f1'].append(f1.item())
-        
-        # Log
-        if (epoch + 1) % 10 == 0:
-            print(f"Epoch {epoch+1:3d}/{epochs} | "
-                  f"Train: {train_loss:.4f} | Val: {val_loss:.4f} | F1: {f1:.4f}")
-        
-        # Early save
-        if val_loss < best_val_loss:
-            best_val_loss = val_loss
-            torch.save(model.state_dict(), 'best_performer.pth')
-    
-    # Carregar melhor modelo
-    model.load_state_dict(torch.load('best_performer.pth'))
+# Treinar
+print("🚀 Iniciando treinamento do Performer...")
+NUM_WORKERS = 2  # processos gerando janelas em paralelo
+
+# Modo rápido em CPU (opt-in): bf16 autocast, torch.compile e threads.
+# Use compare_training_modes (abaixo) para escolher a configuração.
+TRAIN_MODE = {}  # ex.: {'precision': 'bf16', 'num_threads': os.cpu_count()}
+
+history = train_performer(model, train_ds, None, val_ds, None, epochs=50,
+                          num_workers=NUM_WORKERS, **TRAIN_MODE)
+print(f"⚡ {np.median(history['windows_per_sec']):.0f} janelas/s por época")
+
+# %%
+# Comparar modos (fp32 vs bf16 vs torch.compile): velocidade e paridade de loss
+COMPARE_MODES = False  # ⬅️ Ative para medir
+
+if COMPARE_MODES:
+    from performer import compare_training_modes
     
-    return history
+    modes_df = pd.DataFrame(compare_training_modes(
+        lambda: PPGPeakPerformer(window_size=WINDOW_SIZE, d_model=64, n_heads=4, n_layers=4),
+        train_ds, None, val_ds, None, epochs=3, num_workers=NUM_WORKERS
+    ))
+    print(modes_df.to_string(index=False))
 
+# %% [markdown]
+# ### Validação LOSO Completa (53 folds)
+# 
+# Cada fold treina um modelo do zero em um processo separado. Os resultados
+# ficam em `loso_checkpoints/fold_<id>/`: rodar de novo pula os folds já
+# concluídos e retoma os interrompidos. Roda via `python -m loso_runner`
+# (carrega e rotula os sujeitos lá): os workers "spawn" não reexecutam este
+# notebook quando ele roda como script.
 
-# Treinar
-print("🚀 Iniciando treinamento do Performer...")
-history = train_performer(model, X_train, y_train, X_val, y_val, epochs=50)
+# %%
+RUN_LOSO = False  # ⬅️ Ative para rodar os 53 folds
+
+if RUN_LOSO:
+    from loso_runner import run_loso_cli
+    
+    loso_results = run_loso_cli(
+        MIMIC_DIR,
+        'loso_checkpoints',
+        ptt_range=PTT_RANGE,
+        label_radius=LABEL_RADIUS,
+        threads_per_worker=2,
+        epochs=50
+    )
+    print(loso_results.to_string())
 
 # %% [markdown]
 # ### Curvas de Aprendizado
@@ -651,23 +325,47 @@ axes[0].set_title('📉 Loss')
 axes[0].legend()
 axes[0].grid(True, alpha=0.3)
 
-axes[1].plot(history['val_f1'], color='green')
+axes[1].plot(history['val_f1'], color='green', label='F1')
+axes[1].plot(history['val_sensitivity'], color='tab:blue', alpha=0.6, label='Sensibilidade')
+axes[1].plot(history['val_ppv'], color='tab:orange', alpha=0.6, label='PPV')
 axes[1].set_xlabel('Época')
-axes[1].set_ylabel('F1 Score')
-axes[1].set_title('🎯 F1 Score na Validação')
+axes[1].set_ylabel('Score (por batimento, ±50 ms)')
+axes[1].set_title('🎯 Detecção de Picos na Validação')
+axes[1].legend()
 axes[1].grid(True, alpha=0.3)
 
 plt.tight_layout()
 plt.show()
 
+# %% [markdown]
+# ### Avaliação por Batimento (sinal inteiro)
+#
+# Picos do modelo no sinal inteiro de cada sujeito casados com os picos de
+# referência (tolerância de 50 ms): sensibilidade, PPV, erro de instante e
+# erro de RR/HRV por sujeito, nos sujeitos de teste (fora do treino e da
+# validação). Para a variação entre sujeitos use o LOSO.
+
+# %%
+from inference import predict_signal
+from peak_evaluation import evaluate_subjects, peaks_from_probs
+
+eval_subjects = test_subjects
+pred_peaks = {s['id']: peaks_from_probs(predict_signal(model, s['ppg'], WINDOW_SIZE, device=device), FS)
+              for s in eval_subjects}
+beat_df, beat_summary = evaluate_subjects(pred_peaks, eval_subjects, fs=FS)
+print(beat_df[['subject_id', 'sensitivity', 'ppv', 'f1', 'timing_mae_ms', 'rr_mae_ms']].to_string())
+
 # %% [markdown]
 # ## 7. Avaliação Visual
 
 # %%
 # Predição em algumas janelas de validação
+X_val = np.stack([val_ds[i][0].numpy() for i in range(8)])
+y_val = np.stack([val_ds[i][1].numpy() for i in range(8)])
+
 model.eval()
 with torch.no_grad():
-    X_sample = torch.FloatTensor(X_val[:8]).to(device)
+    X_sample = torch.from_numpy(X_val).to(device)
     y_pred = model(X_sample).cpu().numpy()
 
 fig, axes = plt.subplots(4, 2, figsize=(14, 12))
@@ -697,13 +395,24 @@ plt.show()
 # Carregue um arquivo do seu ESP32, decime para 125Hz, e rode o modelo.
 
 # %%
-def load_esp32_and_predict(model, filepath, original_fs=757, target_fs=125):
+from inference import predict_session, predict_signal
+from resampling import resample_rational
+
+
+def load_esp32_and_predict(model, filepath, original_fs=None, target_fs=125, single_pass=False):
     """
     Carrega dados do ESP32, decima, e prediz picos.
+
+    `model`: nn.Module ou backend de `inference_backends` (ex.: ONNX Runtime).
+    `single_pass`: sessão inteira numa chamada (modelo `length_agnostic`).
+    `original_fs` padrão: coluna `sampling_rate_hz` do CSV, se existir,
+    senão 757 Hz (taxa efetiva medida no v8).
     """
     # Carregar dados
     try:
         df = pd.read_csv(filepath)
+        if original_fs is None:
+            original_fs = df['sampling_rate_hz'].iloc[0] if 'sampling_rate_hz' in df.columns else 757
         if 'ir_waveform' in df.columns:
             ppg = df['ir_waveform'].values
         elif 'IR' in df.columns:
@@ -714,41 +423,23 @@ def load_esp32_and_predict(model, filepath, original_fs=757, target_fs=125):
     except Exception as e:
         print(f"⚠️ Erro ao carregar: {e}")
         print("   Usando dado sintético do BIDMC para demonstração...")
-        ppg = subjects[10]['ppg'][:original_fs * 30]  # 30 segundos
         original_fs = 125  # Já está em 125Hz
+        ppg = subjects[10]['ppg'][:original_fs * 30]  # 30 segundos
     
-    # Decimar se necessário
+    # Decimar se necessário (polifásico, filtro em cache por par de taxas)
     if original_fs != target_fs:
-        n_samples = int(len(ppg) * target_fs / original_fs)
-        ppg_resampled = resample(ppg, n_samples)
+        ppg_resampled = resample_rational(ppg, original_fs, target_fs)
         print(f"📉 Decimado para {target_fs}Hz: {len(ppg_resampled)} amostras")
     else:
         ppg_resampled = ppg
     
-    # Predição com janelas sobrepostas
-    window_size = WINDOW_SIZE
-    stride = window_size // 4
-    
-    predictions = np.zeros(len(ppg_resampled))
-    counts = np.zeros(len(ppg_resampled))
-    
-    model.eval()
-    with torch.no_grad():
-        for start in range(0, len(ppg_resampled) - window_size, stride):
-            window = ppg_resampled[start:start + window_size]
-            
-            # Normalizar
-            window_norm = (window - np.mean(window)) / (np.std(window) + 1e-8)
-            
-            # Predizer
-            window_t = torch.FloatTensor(window_norm).unsqueeze(0).to(device)
-            pred = model(window_t).cpu().numpy().squeeze()
-            
-            predictions[start:start + window_size] += pred
-            counts[start:start + window_size] += 1
-    
-    # Média das predições sobrepostas
-    predictions = predictions / np.maximum(counts, 1)
+    if single_pass:
+        predictions = predict_session(model, ppg_resampled, device=device)
+    else:
+        # Predição com janelas sobrepostas (em lote, ver inference.py)
+        window_size = WINDOW_SIZE
+        stride = window_size // 4
+        predictions = predict_signal(model, ppg_resampled, window_size, stride, device=device)
     
     # Encontrar picos
     peaks, _ = find_peaks(predictions, height=0.5, distance=int(0.4 * target_fs))
@@ -761,12 +452,13 @@ esp32_path = os.path.join(ESP32_DIR, 'sample.csv')  # Ajuste para seu arquivo
 
 ppg_esp32, probs, detected_peaks = load_esp32_and_predict(model, esp32_path)
 
-# Calcular HR
+# Calcular HR/HRV
+from hrv import hrv_from_peaks
+
 if len(detected_peaks) > 1:
-    rr = np.diff(detected_peaks) / FS * 1000  # ms
-    hr = 60000 / np.mean(rr)
-    sdnn = np.std(rr)
-    print(f"\n❤️ HR: {hr:.1f} BPM | SDNN: {sdnn:.1f} ms | {len(detected_peaks)} picos")
+    esp32_hrv = hrv_from_peaks([detected_peaks], FS, frequency=False).iloc[0]
+    print(f"\n❤️ HR: {esp32_hrv['hr_mean_bpm']:.1f} BPM | SDNN: {esp32_hrv['sdnn_ms']:.1f} ms | "
+          f"RMSSD: {esp32_hrv['rmssd_ms']:.1f} ms | {len(detected_peaks)} picos")
 
 # %% [markdown]
 # ### Visualização da Inferência
@@ -797,6 +489,84 @@ axes[1].grid(True, alpha=0.3)
 plt.tight_layout()
 plt.show()
 
+# %% [markdown]
+# ### Modelo Causal para Streaming ao Vivo
+#
+# Ao vivo, o modelo bidirecional precisa rodar janelas sobrepostas (stride =
+# janela/4 → 4× computação redundante). A variante causal carrega o estado
+# da atenção linear entre blocos: cada amostra é processada uma única vez,
+# com atraso fixo de `lookahead` amostras (25 = 200 ms).
+
+# %%
+TRAIN_CAUSAL = False  # ⬅️ Ative para treinar e testar o modo streaming
+
+if TRAIN_CAUSAL:
+    from performer import check_chunk_invariance, stream_signal
+    
+    causal_model = PPGPeakPerformer(
+        window_size=WINDOW_SIZE, d_model=64, n_heads=4, n_layers=4,
+        causal=True, lookahead=25
+    ).to(device)
+    causal_history = train_performer(causal_model, train_ds, None, val_ds, None, epochs=50,
+                                     checkpoint_path='best_performer_causal.pth',
+                                     num_workers=NUM_WORKERS, **TRAIN_MODE)
+    
+    # Saída do stream não pode depender do tamanho dos blocos (1 amostra × sinal inteiro)
+    drift = check_chunk_invariance(causal_model, test_subjects[0]['ppg'][:30 * FS],
+                                   window_size=WINDOW_SIZE, device=device)
+    print(f"🔁 Invariância a blocos: maior diferença {max(drift.values()):.1e}")
+    
+    # Treino em janelas com Z-score próprio × stream com normalização móvel:
+    # mesmas métricas por batimento nos sujeitos de teste, para ver a diferença
+    causal_windowed = {s['id']: peaks_from_probs(predict_signal(causal_model, s['ppg'], WINDOW_SIZE,
+                                                                device=device), FS)
+                       for s in test_subjects}
+    causal_streamed = {s['id']: peaks_from_probs(stream_signal(causal_model, s['ppg'], FS, WINDOW_SIZE,
+                                                               device=device), FS)
+                       for s in test_subjects}
+    print("🪟 Causal em janelas:")
+    _, causal_windowed_summary = evaluate_subjects(causal_windowed, test_subjects, fs=FS)
+    print("📡 Causal em stream (blocos de 1 s):")
+    _, causal_stream_summary = evaluate_subjects(causal_streamed, test_subjects, fs=FS)
+    print(f"   ΔF1 stream − janelas: {causal_stream_summary['f1'] - causal_windowed_summary['f1']:+.3f}")
+    
+    # Stream em blocos de 1 s (125 amostras)
+    probs_stream = stream_signal(causal_model, ppg_esp32, FS, WINDOW_SIZE, device=device)
+    peaks_stream, _ = find_peaks(probs_stream, height=0.5, distance=int(0.4 * FS))
+    print(f"📡 Streaming: {len(peaks_stream)} picos | janelas sobrepostas: {len(detected_peaks)} picos")
+
+# %% [markdown]
+# ### Sessão Inteira numa Passada (comprimento livre)
+#
+# Com codificação posicional extensível e treino em recortes de 2-16 s, o
+# modelo roda na sessão inteira numa única chamada, sem janelas de 4 s nem
+# média das sobreposições. Comparação de latência e F1 com o modo em janelas.
+
+# %%
+TRAIN_LENGTH_AGNOSTIC = False  # ⬅️ Ative para treinar e comparar
+
+if TRAIN_LENGTH_AGNOSTIC:
+    from inference import benchmark_inference
+    from peak_dataset import RandomCropCollate
+    
+    CROP_MAX = 2000  # 16 s
+    long_ds = PeakWindowDataset(train_subjects, CROP_MAX, CROP_MAX // 4, label_radius=LABEL_RADIUS)
+    long_train_ds, _ = split_dataset(long_ds, val_fraction=0.15, seed=42)
+    
+    la_model = PPGPeakPerformer(
+        window_size=WINDOW_SIZE, d_model=64, n_heads=4, n_layers=4, length_agnostic=True
+    ).to(device)
+    la_history = train_performer(la_model, long_train_ds, None, val_ds, None, epochs=50,
+                                 batch_size=16, checkpoint_path='best_performer_session.pth',
+                                 collate_fn=RandomCropCollate(250, CROP_MAX),
+                                 num_workers=NUM_WORKERS, **TRAIN_MODE)
+    
+    session_bench = benchmark_inference({
+        'janelas': lambda s: predict_signal(model, s, WINDOW_SIZE, device=device),
+        'janelas (livre)': lambda s: predict_signal(la_model, s, WINDOW_SIZE, device=device),
+        'sessão (livre)': lambda s: predict_session(la_model, s, device=device),
+    }, test_subjects, fs=FS)
+
 # %% [markdown]
 # ## 9. Salvar Modelo Final
 
@@ -816,6 +586,63 @@ torch.save({
 
 print(f"💾 Modelo salvo em: {save_path}")
 
+# %% [markdown]
+# ### Exportar para ONNX
+#
+# Eixos dinâmicos de batch e sequência (até `WINDOW_SIZE`), com checagem de
+# paridade ONNX Runtime × torch. O backend ONNX Runtime roda a inferência
+# sem importar torch. Requer `onnx` e `onnxruntime`.
+
+# %%
+EXPORT_ONNX = False  # ⬅️ Ative para exportar e comparar com o torch
+
+if EXPORT_ONNX:
+    from inference_backends import benchmark_backends, export_onnx, load_backend
+    
+    onnx_path = save_path.replace('.pth', '.onnx')
+    export_onnx(model, onnx_path, window_size=WINDOW_SIZE)
+    
+    ort_backend = load_backend(onnx_path)
+    _, probs_ort, peaks_ort = load_esp32_and_predict(ort_backend, esp32_path)
+    print(f"🔁 Diferença máx. torch × ONNX: {np.abs(probs_ort - probs).max():.2e} | "
+          f"picos iguais: {np.array_equal(peaks_ort, detected_peaks)}")
+    
+    for r in benchmark_backends({'torch': load_backend(save_path), 'onnxruntime': ort_backend},
+                                window_size=WINDOW_SIZE):
+        print(f"   {r['backend']:12s} batch {r['batch_size']:3d}: {r['ms_per_window']:.2f} ms/janela")
+
+# %% [markdown]
+# ### Quantização int8 (CPU)
+#
+# Dinâmica (torch e ONNX Runtime) e estática calibrada em janelas BIDMC do
+# treino. O relatório compara F1 por pico (tolerância de 50 ms), latência e
+# tamanho contra o fp32 nos sujeitos de teste (fora do treino). Qualquer
+# arquivo gerado pode ser carregado com `load_backend` (ex.: para
+# `load_esp32_and_predict`). Requer `onnx` e `onnxruntime`.
+
+# %%
+QUANTIZE = False  # ⬅️ Ative para gerar e comparar as variantes int8
+
+if QUANTIZE:
+    from quantization import build_quantized_variants, quantization_report
+    
+    quant_dir = os.path.join(os.path.dirname(save_path), 'quantized')
+    quant_paths = build_quantized_variants(model, quant_dir, train_ds, n_calibration=512)
+    quant_report = quantization_report(quant_paths, test_subjects, fs=FS, window_size=WINDOW_SIZE)
+
+# %% [markdown]
+# ### Perfil de Tempo e Memória por Etapa
+#
+# Com `PROFILE = True` (seção 1): o trace abre no chrome://tracing ou em
+# ui.perfetto.dev; o `.prom` segue o formato de exposição do Prometheus.
+# Em jobs sem notebook: `PPG_PROFILE=1 PPG_PROFILE_DIR=profile/ python ...`.
+
+# %%
+if profiling.is_enabled():
+    profiling.print_summary()
+    trace_path, prom_path = profiling.export('profile')
+    print(f"💾 Perfil salvo: {trace_path} | {prom_path}")
+
 # %% [markdown]
 # ## 🎓 Resumo
 # 
@@ -829,8 +656,9 @@ print(f"💾 Modelo salvo em: {save_path}")
 # | **6. Inferência** | Predição com overlap → find_peaks → RR intervals |
 # 
 # ### Próximos Passos
-# - [ ] Validação LOSO completa (53 folds)
+# - [x] Validação LOSO completa (53 folds) → `loso_runner.run_loso`
 # - [ ] Fine-tuning com seus dados ESP32
-# - [ ] Exportar para ONNX / TensorFlow Lite
+# - [x] Exportar para ONNX → `inference_backends.export_onnx`
+# - [ ] TensorFlow Lite
 # - [ ] Deploy no ESP32 (Micro)
 
@@ -33,7 +33,11 @@ from matplotlib.widgets import Button
 from scipy.signal import find_peaks
 from sqlalchemy import create_engine
 import os
-from datetime import datetime
+
+from annotation_store import AnnotationStore
+from session_repository import SessionRepository
+from signal_conditioning import unwrap_modular
+from hrv import hrv_from_peaks
 
 # Configuração do Supabase
 USER = 'postgres'
@@ -41,9 +45,11 @@ PASSWORD = '_xs#hiUAWeN6LMK'
 HOST = 'db.pthfxmypcxqjfstqwokf.supabase.co'
 PORT = '5432'
 DBNAME = 'postgres'
+ANNOTATIONS_DB = './annotations/annotations.sqlite'  # anotações versionadas (annotation_store.py)
 
 url_conexao = f'postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}'
 engine = create_engine(url_conexao)
+session_repo = SessionRepository(engine)
 
 print("✅ Conexão configurada!")
 
@@ -51,9 +57,8 @@ print("✅ Conexão configurada!")
 # ## 2. Carregar Sessões do Supabase
 
 # %%
-# Carregar todas as sessões
-query = "SELECT * FROM hrv_sessions ORDER BY created_at DESC"
-df = pd.read_sql(query, engine)
+# Carregar metadados das sessões (waveforms são buscados sob demanda)
+df = session_repo.list_sessions()
 
 print(f"📊 {len(df)} sessões encontradas")
 print("\nÚltimas 10 sessões:")
@@ -67,13 +72,14 @@ df[['id', 'created_at', 'device_id', 'user_name', 'sampling_rate_hz']].head(10)
 SESSAO_INDEX = 0  # Altere aqui para anotar outra sessão
 
 sessao = df.iloc[SESSAO_INDEX]
+ir_raw = session_repo.get_waveform(sessao['id'])
 print(f"📝 Sessão selecionada:")
 print(f"   ID: {sessao['id']}")
 print(f"   Device: {sessao['device_id']}")
 print(f"   User: {sessao['user_name']}")
 print(f"   Created: {sessao['created_at']}")
 print(f"   Sampling Rate: {sessao['sampling_rate_hz']} Hz")
-print(f"   IR samples: {len(sessao['ir_waveform'])}")
+print(f"   IR samples: {len(ir_raw)}")
 
 # %% [markdown]
 # ## 4. Preprocessamento do Sinal
@@ -82,11 +88,11 @@ print(f"   IR samples: {len(sessao['ir_waveform'])}")
 def preprocess_ppg(signal):
     """
     Preprocessa o sinal PPG:
-    1. Converte para numpy array
+    1. Desfaz o wraparound de 16 bits (uint16 do firmware v9)
     2. Normaliza (0 a 1)
     3. Inverte (picos sistólicos para cima)
     """
-    signal = np.array(signal)
+    signal = unwrap_modular(signal)
     
     # Normalizar
     sig_min = np.min(signal)
@@ -99,7 +105,7 @@ def preprocess_ppg(signal):
     return sig_inverted
 
 # Preprocessar
-ir_signal = preprocess_ppg(sessao['ir_waveform'])
+ir_signal = preprocess_ppg(ir_raw)
 sampling_rate = sessao['sampling_rate_hz']
 
 print(f"✅ Sinal preprocessado: {len(ir_signal)} amostras")
@@ -143,8 +149,7 @@ print(f"🔍 {len(peaks_auto)} picos detectados automaticamente")
 
 # Calcular HR médio
 if len(peaks_auto) > 1:
-    rr_intervals = np.diff(peaks_auto) / sampling_rate * 1000  # em ms
-    hr_mean = 60000 / np.mean(rr_intervals)
+    hr_mean = hrv_from_peaks([peaks_auto], sampling_rate, frequency=False)['hr_mean_bpm'][0]
     print(f"❤️ HR médio estimado: {hr_mean:.1f} BPM")
 
 # %% [markdown]
@@ -344,44 +349,24 @@ print(f"   Picos finais: {len(peaks_final)}")
 
 # Calcular métricas
 if len(peaks_final) > 1:
-    rr_intervals = np.diff(peaks_final) / sampling_rate * 1000  # em ms
-    hr_mean = 60000 / np.mean(rr_intervals)
-    hr_std = np.std(60000 / rr_intervals)
-    print(f"   HR médio: {hr_mean:.1f} ± {hr_std:.1f} BPM")
-    print(f"   SDNN: {np.std(rr_intervals):.1f} ms")
+    metrics = hrv_from_peaks([peaks_final], sampling_rate, frequency=False).iloc[0]
+    print(f"   HR médio: {metrics['hr_mean_bpm']:.1f} ± {metrics['hr_std_bpm']:.1f} BPM")
+    print(f"   SDNN: {metrics['sdnn_ms']:.1f} ms | RMSSD: {metrics['rmssd_ms']:.1f} ms")
 
 # %%
-# Salvar anotações em CSV
-def save_annotations(session_id, peaks, signal, sampling_rate, output_dir='./annotations'):
+# Salvar anotações (SQLite versionado, ver annotation_store.py)
+def save_annotations(session_id, peaks, signal, sampling_rate, store_path=ANNOTATIONS_DB):
     """
-    Salva as anotações de picos em CSV
+    Salva uma nova versão das anotações de picos (AnnotationStore)
     """
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Criar DataFrame com anotações
-    df_annotations = pd.DataFrame({
-        'peak_index': peaks,
-        'peak_time_s': peaks / sampling_rate,
-        'peak_value': signal[peaks]
-    })
-    
-    # Calcular RR intervals
-    if len(peaks) > 1:
-        rr_intervals = np.diff(peaks) / sampling_rate * 1000
-        df_annotations['rr_interval_ms'] = np.concatenate([[np.nan], rr_intervals])
-    
-    # Nome do arquivo
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'{output_dir}/peaks_{session_id[:8]}_{timestamp}.csv'
-    
-    # Salvar
-    df_annotations.to_csv(filename, index=False)
-    print(f"✅ Anotações salvas em: {filename}")
-    
-    return filename
+    peaks = np.asarray(peaks, dtype=int)
+    version = AnnotationStore(store_path).save(session_id, peaks, sampling_rate,
+                                               peak_values=signal[peaks])
+    print(f"✅ Anotações salvas: versão {version} em {store_path}")
+    return version
 
 # Salvar
-output_file = save_annotations(
+output_version = save_annotations(
     session_id=str(sessao['id']),
     peaks=peaks_final,
     signal=ir_signal,
@@ -29,7 +29,11 @@ from plotly.subplots import make_subplots
 from scipy.signal import find_peaks
 from sqlalchemy import create_engine
 import os
-from datetime import datetime
+
+from annotation_store import AnnotationStore
+from session_repository import SessionRepository
+from signal_conditioning import unwrap_modular
+from hrv import hrv_from_peaks, hrv_table
 
 # Configurar renderer do Plotly para Jupyter
 pio.renderers.default = "notebook"
@@ -40,9 +44,11 @@ PASSWORD = '_xs#hiUAWeN6LMK'
 HOST = 'db.pthfxmypcxqjfstqwokf.supabase.co'
 PORT = '5432'
 DBNAME = 'postgres'
+ANNOTATIONS_DB = './annotations/annotations.sqlite'  # anotações versionadas (annotation_store.py)
 
 url_conexao = f'postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}'
 engine = create_engine(url_conexao)
+session_repo = SessionRepository(engine)
 
 print("✅ Conexão configurada!")
 
@@ -50,8 +56,8 @@ print("✅ Conexão configurada!")
 # ## 3. Carregar Sessões do Supabase
 
 # %%
-query = "SELECT * FROM hrv_sessions ORDER BY created_at DESC"
-df = pd.read_sql(query, engine)
+# Apenas metadados; waveforms são buscados sob demanda
+df = session_repo.list_sessions()
 
 print(f"📊 {len(df)} sessões encontradas")
 print("\nÚltimas 10 sessões:")
@@ -65,28 +71,29 @@ df[['id', 'created_at', 'device_id', 'user_name', 'sampling_rate_hz']].head(10)
 SESSAO_INDEX = 0  # ⬅️ ALTERE AQUI
 
 sessao = df.iloc[SESSAO_INDEX]
+ir_raw = session_repo.get_waveform(sessao['id'])
 print(f"📝 Sessão selecionada:")
 print(f"   ID: {sessao['id']}")
 print(f"   Device: {sessao['device_id']}")
 print(f"   User: {sessao['user_name']}")
 print(f"   Created: {sessao['created_at']}")
 print(f"   Sampling Rate: {sessao['sampling_rate_hz']} Hz")
-print(f"   IR samples: {len(sessao['ir_waveform'])}")
+print(f"   IR samples: {len(ir_raw)}")
 
 # %% [markdown]
 # ## 5. Preprocessamento
 
 # %%
 def preprocess_ppg(signal):
-    """Normaliza e inverte o sinal PPG"""
-    signal = np.array(signal)
+    """Desfaz o wraparound de 16 bits, normaliza e inverte o sinal PPG"""
+    signal = unwrap_modular(signal)
     sig_min = np.min(signal)
     sig_max = np.max(signal)
     sig_norm = (signal - sig_min) / (sig_max - sig_min)
     sig_inverted = 1.0 - sig_norm
     return sig_inverted
 
-ir_signal = preprocess_ppg(sessao['ir_waveform'])
+ir_signal = preprocess_ppg(ir_raw)
 sampling_rate = sessao['sampling_rate_hz']
 
 print(f"✅ Sinal preprocessado: {len(ir_signal)} amostras")
@@ -106,8 +113,7 @@ peaks_auto = detect_peaks_auto(ir_signal, sampling_rate)
 print(f"🔍 {len(peaks_auto)} picos detectados automaticamente")
 
 if len(peaks_auto) > 1:
-    rr_intervals = np.diff(peaks_auto) / sampling_rate * 1000
-    hr_mean = 60000 / np.mean(rr_intervals)
+    hr_mean = hrv_from_peaks([peaks_auto], sampling_rate, frequency=False)['hr_mean_bpm'][0]
     print(f"❤️ HR médio estimado: {hr_mean:.1f} BPM")
 
 # %% [markdown]
@@ -251,30 +257,16 @@ print(f"\n📊 Total de picos: {len(peaks_final)}")
 # ## 10. Salvar Anotações
 
 # %%
-def save_annotations(session_id, peaks, signal, sampling_rate, output_dir='./annotations'):
-    """Salva anotações em CSV"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    df_annotations = pd.DataFrame({
-        'peak_index': peaks,
-        'peak_time_s': peaks / sampling_rate,
-        'peak_value': signal[peaks]
-    })
-    
-    if len(peaks) > 1:
-        rr_intervals = np.diff(peaks) / sampling_rate * 1000
-        df_annotations['rr_interval_ms'] = np.concatenate([[np.nan], rr_intervals])
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'{output_dir}/peaks_{session_id[:8]}_{timestamp}.csv'
-    
-    df_annotations.to_csv(filename, index=False)
-    print(f"✅ Anotações salvas em: {filename}")
-    
-    return filename
+def save_annotations(session_id, peaks, signal, sampling_rate, store_path=ANNOTATIONS_DB):
+    """Salva uma nova versão das anotações (AnnotationStore)"""
+    peaks = np.asarray(peaks, dtype=int)
+    version = AnnotationStore(store_path).save(session_id, peaks, sampling_rate,
+                                               peak_values=signal[peaks])
+    print(f"✅ Anotações salvas: versão {version} em {store_path}")
+    return version
 
 # Salvar
-output_file = save_annotations(
+output_version = save_annotations(
     session_id=str(sessao['id']),
     peaks=peaks_final,
     signal=ir_signal,
@@ -292,15 +284,26 @@ print(f"   Picos automáticos: {len(peaks_auto)}")
 print(f"   Picos finais: {len(peaks_final)}")
 
 if len(peaks_final) > 1:
-    rr_intervals = np.diff(peaks_final) / sampling_rate * 1000
-    hr_mean = 60000 / np.mean(rr_intervals)
-    hr_std = np.std(60000 / rr_intervals)
-    sdnn = np.std(rr_intervals)
-    rmssd = np.sqrt(np.mean(np.diff(rr_intervals)**2))
+    metrics = hrv_from_peaks([peaks_final], sampling_rate).iloc[0]
     
     print(f"\n❤️ Métricas HRV:")
-    print(f"   HR médio: {hr_mean:.1f} ± {hr_std:.1f} BPM")
-    print(f"   SDNN: {sdnn:.1f} ms")
-    print(f"   RMSSD: {rmssd:.1f} ms")
+    print(f"   HR médio: {metrics['hr_mean_bpm']:.1f} ± {metrics['hr_std_bpm']:.1f} BPM")
+    print(f"   SDNN: {metrics['sdnn_ms']:.1f} ms")
+    print(f"   RMSSD: {metrics['rmssd_ms']:.1f} ms")
+    print(f"   pNN50: {metrics['pnn50']:.1f} %")
+    print(f"   LF/HF: {metrics['lf_hf']:.2f}")
 
-print(f"\n💾 Arquivo salvo: {output_file}")
+print(f"\n💾 Versão salva: {output_version} ({ANNOTATIONS_DB})")
+
+# %% [markdown]
+# ## 12. HRV de Todas as Sessões
+# 
+# RR gravados pelo dispositivo (`rrr_intervals_ms`) de todas as sessões numa
+# única chamada: domínio do tempo e LF/HF (Lomb-Scargle) em lote.
+
+# %%
+df_rr = session_repo.list_sessions(columns=['id', 'created_at', 'user_name', 'rrr_intervals_ms'])
+hrv_all = hrv_table(df_rr)
+hrv_all.insert(1, 'user_name', df_rr['user_name'].to_numpy())
+print(hrv_all[['id', 'user_name', 'n_rr', 'hr_mean_bpm', 'sdnn_ms', 'rmssd_ms', 'pnn50', 'lf_hf']]
+      .round(2).to_string())
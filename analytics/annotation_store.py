@@ -0,0 +1,271 @@
+"""
+Armazenamento das anotações de picos em SQLite, com histórico de versões.
+
+Antes, cada "Salvar" gravava um `annotations/peaks_<id8>_<timestamp>.csv`
+novo: achar a anotação mais recente de cada sessão exigia listar e ler
+todos os CSVs (e o id ficava truncado em 8 caracteres). Aqui:
+
+- `annotations`: uma linha por versão salva (sessão, versão, instante,
+  taxa de amostragem), com os índices dos picos num BLOB int32 e os
+  valores do sinal nos picos num BLOB float32
+- `latest_annotations`: índice sessão → versão mais recente (por
+  `created_at`), atualizado na mesma transação do `save`
+
+Ler a última versão de todas as sessões (treino) é uma única consulta com
+JOIN; cada BLOB vira um array com `np.frombuffer`, sem cópia nem parsing.
+
+Uso:
+    store = AnnotationStore('annotations/annotations.sqlite')
+    version = store.save(session_id, peaks, fs, peak_values=signal[peaks])
+    peaks = store.load_latest()                # {session_id: int32 array}
+    store.history(session_id)                  # versões de uma sessão
+    store.import_csv_dir('annotations/', df_sessions['id'])  # CSVs antigos
+"""
+
+import glob
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PATH = './annotations/annotations.sqlite'
+PEAK_DTYPE = np.dtype('<i4')
+VALUE_DTYPE = np.dtype('<f4')
+MAX_SQL_PARAMS = 900  # abaixo do limite de variáveis de SQLites antigos
+CSV_PATTERN = re.compile(r'peaks_([0-9a-fA-F-]+)_(\d{8}_\d{6})\.csv$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    sampling_rate_hz REAL,
+    n_peaks INTEGER NOT NULL,
+    peaks BLOB NOT NULL,
+    peak_values BLOB,
+    author TEXT,
+    source TEXT,
+    UNIQUE (session_id, version)
+);
+CREATE TABLE IF NOT EXISTS latest_annotations (
+    session_id TEXT PRIMARY KEY,
+    annotation_id INTEGER NOT NULL REFERENCES annotations(id)
+);
+CREATE INDEX IF NOT EXISTS annotations_source ON annotations(source);
+"""
+
+_META_COLUMNS = 'a.session_id, a.version, a.created_at, a.sampling_rate_hz, a.n_peaks, a.author, a.source'
+
+
+def decode_peaks(blob):
+    """BLOB → array int32 (somente leitura, sem cópia)."""
+    return np.frombuffer(blob, dtype=PEAK_DTYPE)
+
+
+class AnnotationStore:
+    """
+    Anotações de picos por sessão, versionadas.
+
+    Args:
+        path: Arquivo SQLite (criado se não existir)
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')  # leitores não bloqueiam o app
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Uma conexão por operação (o app Dash chama de várias threads),
+        # fechada ao sair do `with`; transações explícitas em `save`
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def save(self, session_id, peaks, sampling_rate=None, peak_values=None, author=None,
+             source=None, created_at=None):
+        """
+        Grava uma nova versão das anotações de uma sessão.
+
+        Args:
+            peaks: Índices dos picos (amostras)
+            peak_values: Valor do sinal em cada pico (mesma ordem de
+                `peaks`), opcional
+            source: Origem (ex.: nome do CSV importado)
+
+        Returns:
+            Número da versão gravada (1, 2, ...)
+        """
+        session_id = str(session_id)
+        peaks = np.asarray(peaks, dtype=np.int64).ravel()
+        values = None
+        if peak_values is not None:
+            values = np.asarray(peak_values, dtype=VALUE_DTYPE).ravel()
+            if len(values) != len(peaks):
+                raise ValueError("peak_values deve ter um valor por pico")
+        peaks, first = np.unique(peaks, return_index=True)  # ordenados, sem repetição
+        blob = peaks.astype(PEAK_DTYPE).tobytes()
+        if values is not None:
+            values = values[first].tobytes()
+        created_at = created_at or datetime.now().isoformat(timespec='seconds')
+
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM annotations WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()[0]
+                cursor = conn.execute(
+                    "INSERT INTO annotations (session_id, version, created_at, sampling_rate_hz, "
+                    "n_peaks, peaks, peak_values, author, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, version, created_at,
+                     None if sampling_rate is None else float(sampling_rate),
+                     len(peaks), blob, values, author, source),
+                )
+                # CSVs antigos importados depois não tomam o lugar de uma versão mais nova
+                conn.execute(
+                    "INSERT INTO latest_annotations (session_id, annotation_id) VALUES (?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET annotation_id = excluded.annotation_id "
+                    "WHERE (SELECT created_at FROM annotations "
+                    "       WHERE id = latest_annotations.annotation_id) <= ?",
+                    (session_id, cursor.lastrowid, created_at),
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return version
+
+    def get(self, session_id, version=None):
+        """
+        Uma versão (padrão: a mais recente) de uma sessão.
+
+        Returns:
+            Dict com os metadados, 'peaks' (int32) e 'peak_values' (float32
+            ou None), ou None se a sessão não tiver anotação
+        """
+        if version is None:
+            query = (f"SELECT {_META_COLUMNS}, a.peaks, a.peak_values FROM latest_annotations l "
+                     f"JOIN annotations a ON a.id = l.annotation_id WHERE l.session_id = ?")
+            params = (str(session_id),)
+        else:
+            query = (f"SELECT {_META_COLUMNS}, a.peaks, a.peak_values FROM annotations a "
+                     f"WHERE a.session_id = ? AND a.version = ?")
+            params = (str(session_id), int(version))
+        with self._connect() as conn:
+            row = conn.execute(query, params).fetchone()
+        if row is None:
+            return None
+        keys = ['session_id', 'version', 'created_at', 'sampling_rate_hz', 'n_peaks', 'author', 'source']
+        out = dict(zip(keys, row[:-2]))
+        out['peaks'] = decode_peaks(row[-2])
+        out['peak_values'] = None if row[-1] is None else np.frombuffer(row[-1], dtype=VALUE_DTYPE)
+        return out
+
+    def latest_peaks(self, session_id):
+        """Picos da versão mais recente (int32) ou None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT a.peaks FROM latest_annotations l JOIN annotations a ON a.id = l.annotation_id "
+                "WHERE l.session_id = ?", (str(session_id),),
+            ).fetchone()
+        return None if row is None else decode_peaks(row[0])
+
+    def load_latest(self, session_ids=None):
+        """
+        Picos da versão mais recente de cada sessão (uma consulta).
+
+        Args:
+            session_ids: Restringe a estas sessões (None = todas)
+
+        Returns:
+            Dict session_id → array int32
+        """
+        query = ("SELECT l.session_id, a.peaks FROM latest_annotations l "
+                 "JOIN annotations a ON a.id = l.annotation_id")
+        with self._connect() as conn:
+            if session_ids is None:
+                rows = conn.execute(query).fetchall()
+            else:
+                ids = [str(s) for s in session_ids]
+                rows = []
+                for i in range(0, len(ids), MAX_SQL_PARAMS):
+                    chunk = ids[i:i + MAX_SQL_PARAMS]
+                    rows += conn.execute(f"{query} WHERE l.session_id IN ({', '.join('?' * len(chunk))})",
+                                         chunk).fetchall()
+        return {sid: decode_peaks(blob) for sid, blob in rows}
+
+    def latest_table(self):
+        """Metadados da versão mais recente de cada sessão (sem os picos)."""
+        query = (f"SELECT {_META_COLUMNS} FROM latest_annotations l "
+                 f"JOIN annotations a ON a.id = l.annotation_id ORDER BY a.session_id")
+        with self._connect() as conn:
+            return pd.read_sql_query(query, conn)
+
+    def history(self, session_id):
+        """Todas as versões de uma sessão (metadados), da mais antiga à mais nova."""
+        query = (f"SELECT {_META_COLUMNS} FROM annotations a WHERE a.session_id = ? "
+                 f"ORDER BY a.created_at, a.version")
+        with self._connect() as conn:
+            return pd.read_sql_query(query, conn, params=(str(session_id),))
+
+    def import_csv_dir(self, directory, session_ids=None, verbose=True):
+        """
+        Importa os CSVs `peaks_<id8>_<timestamp>.csv` antigos como versões.
+
+        Os arquivos entram em ordem de timestamp (cada um vira uma versão);
+        os já importados (mesmo nome em `source`) são pulados.
+
+        Args:
+            session_ids: Ids completos das sessões, para resolver o prefixo
+                de 8 caracteres do nome do arquivo (sem eles, o prefixo vira
+                o session_id)
+
+        Returns:
+            Número de arquivos importados
+        """
+        by_prefix = {}
+        for sid in session_ids if session_ids is not None else []:
+            by_prefix.setdefault(str(sid)[:8], []).append(str(sid))
+
+        files = []
+        for path in glob.glob(os.path.join(directory, 'peaks_*.csv')):
+            match = CSV_PATTERN.search(os.path.basename(path))
+            if match:
+                files.append((match.group(2), match.group(1), path))
+
+        with self._connect() as conn:
+            done = {r[0] for r in conn.execute("SELECT source FROM annotations WHERE source IS NOT NULL")}
+
+        imported = 0
+        for timestamp, prefix, path in sorted(files):
+            name = os.path.basename(path)
+            if name in done:
+                continue
+            candidates = by_prefix.get(prefix, [prefix])
+            if len(candidates) > 1:
+                if verbose:
+                    print(f"⚠️ {name}: prefixo ambíguo ({len(candidates)} sessões), ignorado")
+                continue
+
+            df = pd.read_csv(path)
+            peaks = df['peak_index'].to_numpy(dtype=np.int64)
+            fs = None
+            timed = (df['peak_time_s'] > 0).to_numpy() if 'peak_time_s' in df else np.zeros(0, bool)
+            if timed.any():
+                fs = float(np.median(peaks[timed] / df['peak_time_s'].to_numpy()[timed]))
+            values = df['peak_value'].to_numpy() if 'peak_value' in df else None
+            created_at = datetime.strptime(timestamp, '%Y%m%d_%H%M%S').isoformat()
+            self.save(candidates[0], peaks, fs, values, source=name, created_at=created_at)
+            imported += 1
+
+        if verbose:
+            print(f"✅ {imported} CSVs importados para {self.path}")
+        return imported
+
@@ -0,0 +1,240 @@
+"""
+Reconstrução de sessões contínuas a partir de `hrv_batches` (schema v9).
+
+A view `hrv_sessions_complete` só agrega contagens. Aqui os lotes de várias
+sessões são buscados em uma única consulta, ordenados por `batch_number`, e
+montados em buffers NumPy pré-alocados:
+
+1. Layout (vetorizado sobre os lotes): `start_millis` de cada lote é
+   comparado com o `end_millis` do anterior. Um salto maior que a tolerância
+   vira lacuna (amostras perdidas); um recuo vira sobreposição (as amostras
+   repetidas do início do lote são descartadas). Lotes com menos amostras
+   que `sample_count` também deixam lacuna no fim.
+2. Cópia: cada lote é copiado direto para a sua posição no buffer final.
+3. Lacunas são preenchidas repetindo a última amostra válida e marcadas em
+   `gap_mask` (True = amostra inventada).
+
+Uso:
+    sessions = reassemble_sessions(engine, ['5ee41813-...', '465a40c8-...'])
+    s = sessions['5ee41813-...']
+    ir, gap = s['signals']['ir_waveform'], s['gap_mask']
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from session_repository import BINARY_SUFFIX, SessionRepository, decode_waveform
+
+BATCH_CHANNELS = ('ir_waveform', 'red_waveform')
+BATCH_META_COLUMNS = [
+    'session_uuid', 'batch_number', 'start_millis', 'end_millis',
+    'sample_count', 'sampling_rate_hz', 'device_id', 'user_name', 'created_at',
+]
+
+
+def fetch_batches(engine, session_uuids, channels=BATCH_CHANNELS, table='hrv_batches'):
+    """
+    Busca os lotes de várias sessões em uma única consulta.
+
+    Returns:
+        DataFrame com BATCH_META_COLUMNS + uma coluna por canal (arrays
+        numpy), ordenado por session_uuid e batch_number
+    """
+    session_uuids = [str(u) for u in session_uuids]
+    if not session_uuids:
+        return pd.DataFrame(columns=BATCH_META_COLUMNS + list(channels))
+
+    binary = SessionRepository(engine, table=table).binary_columns
+    select = []
+    for channel in channels:
+        if channel + BINARY_SUFFIX in binary:
+            select.append(f"{channel}{BINARY_SUFFIX} AS {channel}_b")
+            select.append(f"CASE WHEN {channel}{BINARY_SUFFIX} IS NULL THEN {channel}::text END AS {channel}_t")
+        else:
+            select.append(f"NULL AS {channel}_b")
+            select.append(f"{channel}::text AS {channel}_t")
+
+    query = text(
+        f"SELECT {', '.join(BATCH_META_COLUMNS)}, {', '.join(select)} FROM {table} "
+        f"WHERE session_uuid IN :uuids ORDER BY session_uuid, batch_number"
+    ).bindparams(bindparam('uuids', expanding=True))
+
+    with engine.connect() as conn:
+        rows = conn.execute(query, {'uuids': session_uuids}).fetchall()
+
+    records = []
+    n_meta = len(BATCH_META_COLUMNS)
+    for row in rows:
+        record = dict(zip(BATCH_META_COLUMNS, row[:n_meta]))
+        raw = row[n_meta:]
+        for i, channel in enumerate(channels):
+            binary_value, text_value = raw[2 * i], raw[2 * i + 1]
+            record[channel] = binary_value if binary_value is not None else text_value
+        records.append(record)
+
+    return batches_from_records(records, channels)
+
+
+def batches_from_records(records, channels=BATCH_CHANNELS):
+    """
+    DataFrame de lotes a partir de dicts (linhas do banco, API REST ou os
+    exports JSON em `docs/hrv_batches_*.json`), com waveforms decodificados.
+    """
+    df = pd.DataFrame(records)
+    if df.empty:
+        return pd.DataFrame(columns=BATCH_META_COLUMNS + list(channels))
+    for channel in channels:
+        if channel in df.columns:
+            df[channel] = [decode_waveform(v) for v in df[channel]]
+    return df.sort_values(['session_uuid', 'batch_number'], kind='stable').reset_index(drop=True)
+
+
+def estimate_batch_rates(start_millis, end_millis, n_samples):
+    """Taxa de amostragem efetiva (Hz) de cada lote; NaN se a duração for inválida."""
+    duration = (np.asarray(end_millis, dtype=np.float64) - np.asarray(start_millis, dtype=np.float64)) / 1000
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.asarray(n_samples, dtype=np.float64) / duration
+    rates[~np.isfinite(rates) | (duration <= 0)] = np.nan
+    return rates
+
+
+def plan_layout(start_millis, end_millis, lengths, sample_counts, fs, tolerance_ms=5):
+    """
+    Posição de cada lote no sinal contínuo.
+
+    Args:
+        start_millis, end_millis: Tempo de início/fim de cada lote (ms)
+        lengths: Amostras realmente recebidas em cada lote
+        sample_counts: Amostras declaradas (`sample_count`)
+        fs: Taxa de amostragem usada para converter ms ↔ amostras
+        tolerance_ms: Diferença de tempo tolerada entre lotes consecutivos
+
+    Returns:
+        Dict com arrays por lote: 'gap_before' (amostras inventadas antes),
+        'skip' (amostras descartadas por sobreposição), 'offset' (posição da
+        primeira amostra copiada), 'copy' (amostras copiadas), 'gap_after'
+        (amostras faltando no fim do lote) e 'total' (tamanho final)
+    """
+    start = np.asarray(start_millis, dtype=np.float64)
+    end = np.asarray(end_millis, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    counts = np.maximum(np.asarray(sample_counts, dtype=np.int64), lengths)
+
+    delta_ms = np.zeros(len(start))
+    delta_ms[1:] = start[1:] - end[:-1]
+    delta_samples = np.rint(delta_ms * fs / 1000).astype(np.int64)
+
+    gap_before = np.where(delta_ms > tolerance_ms, delta_samples, 0)
+    skip = np.minimum(np.where(delta_ms < -tolerance_ms, -delta_samples, 0), lengths)
+    copy = lengths - skip
+    gap_after = counts - lengths
+
+    sizes = gap_before + copy + gap_after
+    block_start = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return {
+        'gap_before': gap_before,
+        'skip': skip,
+        'offset': block_start + gap_before,
+        'copy': copy,
+        'gap_after': gap_after,
+        'total': int(sizes.sum()),
+    }
+
+
+def _hold_last_valid(values, gap_mask):
+    """Preenche as lacunas com a última amostra válida (ou a próxima, no início)."""
+    if not gap_mask.any() or gap_mask.all():
+        return
+    idx = np.where(gap_mask, 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    first_valid = int(np.argmin(gap_mask))
+    idx[:first_valid] = first_valid
+    values[:] = values[idx]
+
+
+def reassemble_session(batches, channels=BATCH_CHANNELS, fs=None, tolerance_ms=5, dtype=np.int64):
+    """
+    Monta uma sessão contínua a partir dos seus lotes.
+
+    Args:
+        batches: DataFrame de uma sessão (saída de fetch_batches filtrada)
+        fs: Taxa para dimensionar lacunas/sobreposições; por padrão a mediana
+            das taxas efetivas dos lotes (cai em `sampling_rate_hz`)
+
+    Returns:
+        Dict com 'session_uuid', 'signals' ({canal: array}), 'gap_mask',
+        'fs', 'nominal_fs', 'batch_rates', 'batch_numbers', 'batch_offsets',
+        'batch_skip', 'batch_copy', 'batch_start_millis', 'batch_end_millis',
+        'batch_sample_counts', 'n_gaps', 'gap_samples', 'overlap_samples',
+        'missing_batches'
+    """
+    batches = batches.sort_values('batch_number', kind='stable')
+    channels = [c for c in channels if c in batches.columns]
+    waveforms = {c: list(batches[c]) for c in channels}
+    lengths = np.array([len(w) for w in waveforms[channels[0]]], dtype=np.int64)
+    for c in channels[1:]:
+        # Canais de um mesmo lote devem ter o mesmo tamanho; usa o menor
+        lengths = np.minimum(lengths, [len(w) for w in waveforms[c]])
+
+    start_millis = batches['start_millis'].to_numpy(dtype=np.float64)
+    end_millis = batches['end_millis'].to_numpy(dtype=np.float64)
+    sample_counts = batches['sample_count'].fillna(0).to_numpy(dtype=np.int64)
+    nominal_fs = float(batches['sampling_rate_hz'].iloc[0])
+
+    rates = estimate_batch_rates(start_millis, end_millis, np.maximum(sample_counts, lengths))
+    if fs is None:
+        fs = float(np.nanmedian(rates)) if np.isfinite(rates).any() else nominal_fs
+
+    layout = plan_layout(start_millis, end_millis, lengths, sample_counts, fs, tolerance_ms)
+    total = layout['total']
+
+    gap_mask = np.ones(total, dtype=bool)
+    signals = {c: np.zeros(total, dtype=dtype) for c in channels}
+    for i in range(len(batches)):
+        skip, n, offset = layout['skip'][i], layout['copy'][i], layout['offset'][i]
+        gap_mask[offset:offset + n] = False
+        for c in channels:
+            signals[c][offset:offset + n] = waveforms[c][i][skip:skip + n]
+
+    for c in channels:
+        _hold_last_valid(signals[c], gap_mask)
+
+    batch_numbers = batches['batch_number'].to_numpy(dtype=np.int64)
+    expected = np.arange(batch_numbers.min(), batch_numbers.max() + 1) if len(batch_numbers) else batch_numbers
+    gaps = np.diff(np.concatenate([[False], gap_mask, [False]]).astype(np.int8))
+
+    return {
+        'session_uuid': batches['session_uuid'].iloc[0],
+        'signals': signals,
+        'gap_mask': gap_mask,
+        'fs': fs,
+        'nominal_fs': nominal_fs,
+        'batch_rates': rates,
+        'batch_numbers': batch_numbers,
+        'batch_offsets': layout['offset'],
+        'batch_skip': layout['skip'],
+        'batch_copy': layout['copy'],
+        'batch_start_millis': start_millis,
+        'batch_end_millis': end_millis,
+        'batch_sample_counts': np.maximum(sample_counts, lengths),
+        'n_gaps': int((gaps == 1).sum()),
+        'gap_samples': int(gap_mask.sum()),
+        'overlap_samples': int(layout['skip'].sum()),
+        'missing_batches': np.setdiff1d(expected, batch_numbers),
+    }
+
+
+def reassemble_sessions(engine, session_uuids, channels=BATCH_CHANNELS, tolerance_ms=5,
+                        table='hrv_batches'):
+    """
+    Busca (uma consulta) e monta várias sessões.
+
+    Returns:
+        Dict session_uuid → resultado de reassemble_session
+    """
+    batches = fetch_batches(engine, session_uuids, channels, table)
+    return {
+        uuid: reassemble_session(group, channels, tolerance_ms=tolerance_ms)
+        for uuid, group in batches.groupby('session_uuid', sort=False)
+    }
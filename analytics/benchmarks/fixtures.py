@@ -0,0 +1,188 @@
+"""
+Fixtures determinísticas dos benchmarks.
+
+- Sujeitos sintéticos no formato do BIDMC (PPG + ECG @ 125 Hz, com picos R
+  e atraso de pulso conhecidos)
+- Diretório BIDMC sintético (`bidmc_XX_Signals.csv` + `bidmc_XX_Fix.txt`)
+  para medir o carregamento; `--bidmc-dir` usa o dataset real no lugar
+- CSV do ESP32 (IR invertido, ~757 Hz, em contagens de ADC)
+- Repositório de sessões em memória para o app de anotação (sem banco)
+- `script_functions`: funções definidas nos scripts-notebook (ex.: 01_*.py),
+  que não podem ser importados sem rodar o notebook inteiro
+"""
+
+import ast
+import contextlib
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+ANALYTICS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ANALYTICS_DIR not in sys.path:
+    sys.path.insert(0, ANALYTICS_DIR)
+
+BIDMC_FS = 125
+FIX_TEMPLATE = """{record}
+Signals: RESP; PLETH; V; AVR; II
+Signals sampling frequency: 125 Hz
+Numerics: HR; PULSE; RESP; SpO2
+Numerics sampling frequency: 1 Hz
+Age: 60
+Gender: F
+Location: micu
+"""
+
+
+def synthetic_beats(duration_s, fs, rng, hr_bpm=(60, 90)):
+    """Batimentos (índices) com FC sorteada e variabilidade respiratória."""
+    hr = rng.uniform(*hr_bpm) / 60
+    t = np.arange(int(duration_s * fs)) / fs
+    phase = np.cumsum(hr * (1 + 0.05 * np.sin(2 * np.pi * 0.25 * t))) / fs
+    return np.flatnonzero(np.diff(np.floor(phase)) > 0) + 1
+
+
+def synthetic_subject(subject_id, duration_s=480, fs=BIDMC_FS, ptt_s=0.22, seed=0):
+    """
+    Sujeito sintético: ECG com QRS estreito e PPG com pulso assimétrico
+    atrasado `ptt_s`, ruído e deriva de linha de base.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * fs)
+    t = np.arange(n) / fs
+    beats = synthetic_beats(duration_s, fs, rng)
+
+    ecg = 0.02 * rng.normal(size=n)
+    ppg = 0.1 * np.sin(2 * np.pi * 0.2 * t) + 0.01 * rng.normal(size=n)
+    qrs = np.exp(-0.5 * (np.arange(-8, 9) / 2.0) ** 2)
+    pulse_t = np.arange(int(0.7 * fs)) / fs
+    pulse = (pulse_t / 0.12) * np.exp(1 - pulse_t / 0.12)  # subida rápida, descida lenta
+    delay = int(ptt_s * fs) - int(0.12 * fs)
+    for b in beats:
+        if 8 <= b < n - 9:
+            ecg[b - 8:b + 9] += qrs
+        start = b + delay
+        if 0 <= start and start + len(pulse) < n:
+            ppg[start:start + len(pulse)] += pulse
+    return {'id': f'{subject_id:02d}', 'ppg': ppg, 'ecg': ecg, 'fs': fs}
+
+
+def synthetic_subjects(n_subjects=8, duration_s=480):
+    return [synthetic_subject(i + 1, duration_s, seed=i) for i in range(n_subjects)]
+
+
+def write_bidmc_dir(path, subjects):
+    """Grava sujeitos no formato dos CSVs do BIDMC (para medir o carregamento)."""
+    os.makedirs(path, exist_ok=True)
+    for subj in subjects:
+        n = len(subj['ppg'])
+        pd.DataFrame({
+            'Time [s]': np.arange(n) / subj['fs'],
+            'RESP': np.zeros(n),
+            'PLETH': subj['ppg'],
+            'V': np.zeros(n),
+            'AVR': np.zeros(n),
+            'II': subj['ecg'],
+        }).to_csv(
+            os.path.join(path, f"bidmc_{subj['id']}_Signals.csv"), index=False, float_format='%.5f')
+        with open(os.path.join(path, f"bidmc_{subj['id']}_Fix.txt"), 'w') as f:
+            f.write(FIX_TEMPLATE.format(record=f"bidmc{subj['id']}"))
+    return path
+
+
+def esp32_signal(duration_s=60, fs=757, seed=0):
+    """IR do MAX30102 em contagens de ADC (invertido, nível DC alto)."""
+    rng = np.random.default_rng(seed)
+    subj = synthetic_subject(0, duration_s, fs=fs, seed=seed)
+    return (60000 - 3000 * subj['ppg'] + rng.normal(0, 20, len(subj['ppg']))).astype(np.int64)
+
+
+def write_esp32_csv(path, duration_s=60, fs=757, seed=0):
+    ir = esp32_signal(duration_s, fs, seed)
+    pd.DataFrame({'ir_waveform': ir, 'sampling_rate_hz': fs}).to_csv(path, index=False)
+    return path
+
+
+class InMemorySessionRepository:
+    """Mesma interface de SessionRepository usada pelo app, sem banco."""
+
+    def __init__(self, waveforms, fs=800):
+        self.waveforms = waveforms
+        self.fs = fs
+
+    def list_sessions(self, columns=None):
+        ids = list(self.waveforms)
+        return pd.DataFrame({
+            'id': ids,
+            'created_at': pd.date_range('2026-01-01', periods=len(ids), freq='D'),
+            'device_id': 'bench',
+            'user_name': 'bench',
+            'sampling_rate_hz': self.fs,
+        })
+
+    def get_waveform(self, session_id, column='ir_waveform'):
+        return self.waveforms[str(session_id)]
+
+
+def annotator_sessions(durations_s=(60, 300), fs=800):
+    return {f'{i:08d}-bench': esp32_signal(d, fs, seed=i) for i, d in enumerate(durations_s)}
+
+
+@contextlib.contextmanager
+def annotator_app(workdir, sessions=None, fs=800):
+    """
+    Importa peak_annotator_app com o repositório em memória (sem Supabase).
+
+    Yields:
+        (módulo do app, cliente de teste Flask)
+    """
+    sessions = sessions or annotator_sessions(fs=fs)
+    repo = InMemorySessionRepository(sessions, fs)
+    cwd = os.getcwd()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # annotations/ relativo ao diretório atual
+    try:
+        with mock.patch('sqlalchemy.create_engine', lambda *a, **k: None), \
+                mock.patch('session_repository.SessionRepository', lambda *a, **k: repo):
+            sys.modules.pop('peak_annotator_app', None)
+            import peak_annotator_app as app_module
+        yield app_module, app_module.app.server.test_client()
+    finally:
+        sys.modules.pop('peak_annotator_app', None)
+        os.chdir(cwd)
+
+
+def script_functions(script_path, names, namespace=None):
+    """
+    Carrega funções de um script-notebook sem executar as células.
+
+    Executa só os imports de nível superior (ignorando os que faltam no
+    ambiente) e as definições pedidas; o restante dos globais usados pelas funções (ex.: WINDOW_SIZE, device)
+    vem de `namespace`.
+
+    Returns:
+        Dict nome → função
+    """
+    with open(script_path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script_path)
+
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.Import, ast.ImportFrom))
+             or (isinstance(node, ast.FunctionDef) and node.name in names)]
+    missing = set(names) - {n.name for n in nodes if isinstance(n, ast.FunctionDef)}
+    if missing:
+        raise KeyError(f"Funções não encontradas em {script_path}: {sorted(missing)}")
+
+    ns = dict(namespace or {})
+    ns.setdefault('__name__', 'bench_' + os.path.splitext(os.path.basename(script_path))[0])
+    for node in nodes:
+        code = compile(ast.Module(body=[node], type_ignores=[]), script_path, 'exec')
+        try:
+            exec(code, ns)
+        except ImportError:
+            # Dependência só das células (ex.: matplotlib): as funções não usam
+            if isinstance(node, ast.FunctionDef):
+                raise
+    return {name: ns[name] for name in names}
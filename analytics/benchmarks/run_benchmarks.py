@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do pipeline de análise (estilo asv).
+
+Cada benchmark prepara o que precisa fora da medição (fixtures fixas de
+`fixtures.py`) e devolve a função medida. Os resultados vão para um JSON
+com os metadados da máquina/commit, para comparar execuções ao longo do
+tempo.
+
+Uso:
+    python benchmarks/run_benchmarks.py                     # tudo
+    python benchmarks/run_benchmarks.py -k model -k labels  # filtro por nome
+    python benchmarks/run_benchmarks.py --quick             # fixtures menores
+    python benchmarks/run_benchmarks.py --bidmc-dir "datasets/ MIMIC II"
+    python benchmarks/run_benchmarks.py --compare results/antes.json
+    python benchmarks/run_benchmarks.py --compare results/antes.json results/depois.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from fixtures import (ANALYTICS_DIR, annotator_app, annotator_sessions, script_functions,
+                      synthetic_subjects, write_bidmc_dir, write_esp32_csv)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+NOTEBOOK_SCRIPT = os.path.join(ANALYTICS_DIR, '01_peak_detection_training.py')
+BENCHMARKS = []
+
+
+def benchmark(name, params=(None,)):
+    """Registra um benchmark: fn(ctx, param) → callable ou (setup, callable)."""
+    def decorator(fn):
+        BENCHMARKS.append((name, params, fn))
+        return fn
+    return decorator
+
+
+def measure(fn, setup=None, repeat=5, min_time=0.2, max_number=1000):
+    """
+    Tempo por chamada (s) em `repeat` amostras.
+
+    Sem `setup`, cada amostra repete a chamada o suficiente para durar
+    ~min_time/repeat (calibrado por uma chamada de aquecimento). Com
+    `setup` (ex.: limpar um cache), cada amostra é uma chamada precedida
+    do setup, fora da medição.
+    """
+    if setup is not None:
+        number = 1
+        setup()
+        fn()  # aquecimento
+    else:
+        t0 = time.perf_counter()
+        fn()
+        first = max(time.perf_counter() - t0, 1e-9)
+        number = int(min(max_number, max(1, (min_time / repeat) / first)))
+
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number)
+    return samples, number
+
+
+class Context:
+    """Fixtures compartilhadas (criadas sob demanda, uma vez por execução)."""
+
+    def __init__(self, workdir, n_subjects=8, duration_s=480, bidmc_dir=None):
+        self.workdir = workdir
+        self.n_subjects = n_subjects
+        self.duration_s = duration_s
+        self.bidmc_source = bidmc_dir
+        self._cache = {}
+
+    def _get(self, key, factory):
+        if key not in self._cache:
+            self._cache[key] = factory()
+        return self._cache[key]
+
+    @property
+    def subjects(self):
+        return self._get('subjects', lambda: synthetic_subjects(self.n_subjects, self.duration_s))
+
+    @property
+    def labeled_subjects(self):
+        def factory():
+            from labeling import label_all_subjects
+            subjects = [dict(s) for s in self.subjects]
+            with contextlib.redirect_stdout(io.StringIO()):
+                label_all_subjects(subjects, cache_dir=None, n_workers=1)
+            return subjects
+        return self._get('labeled', factory)
+
+    @property
+    def bidmc_dir(self):
+        """Cópia de trabalho do BIDMC (real, se --bidmc-dir, ou sintético)."""
+        def factory():
+            path = os.path.join(self.workdir, 'bidmc')
+            if self.bidmc_source:
+                os.makedirs(path, exist_ok=True)
+                for name in os.listdir(self.bidmc_source):
+                    if name.startswith('bidmc_') and name.endswith(('_Signals.csv', '_Fix.txt')):
+                        shutil.copy(os.path.join(self.bidmc_source, name), path)
+                return path
+            return write_bidmc_dir(path, self.subjects)
+        return self._get('bidmc_dir', factory)
+
+    @property
+    def notebook(self):
+        """Funções do notebook 01 com os globais que elas usam."""
+        def factory():
+            import torch
+            return script_functions(NOTEBOOK_SCRIPT, ['load_bidmc_record', 'load_all_subjects',
+                                                      'load_esp32_and_predict'], {
+                'FS': 125, 'WINDOW_SIZE': 500, 'device': torch.device('cpu'),
+                'subjects': self.subjects,
+            })
+        return self._get('notebook', factory)
+
+    @property
+    def model(self):
+        def factory():
+            import torch
+            from performer import PPGPeakPerformer
+            torch.manual_seed(0)
+            return PPGPeakPerformer(window_size=500).eval()
+        return self._get('model', factory)
+
+    @property
+    def esp32_csv(self):
+        return self._get('esp32_csv', lambda: write_esp32_csv(os.path.join(self.workdir, 'esp32.csv')))
+
+    @property
+    def annotator(self):
+        def factory():
+            stack = contextlib.ExitStack()
+            with contextlib.redirect_stdout(io.StringIO()):
+                app_module, client = stack.enter_context(
+                    annotator_app(os.path.join(self.workdir, 'annotator'), annotator_sessions()))
+            self._cache['annotator_stack'] = stack
+            return app_module, client
+        return self._get('annotator', factory)
+
+    def close(self):
+        if 'annotator_stack' in self._cache:
+            self._cache['annotator_stack'].close()
+
+
+# ============== BENCHMARKS ==============
+
+@benchmark('load_all_subjects', params=('csv', 'cache_cold', 'cache_warm'))
+def bench_load_all_subjects(ctx, mode):
+    load_all_subjects = ctx.notebook['load_all_subjects']
+    path = ctx.bidmc_dir
+    cache_dir = os.path.join(path, '.npy_cache')
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            subjects = load_all_subjects(path, use_cache=mode != 'csv')
+        # Tocar os sinais (memory-map só lê do disco no acesso)
+        return sum(float(np.asarray(s['ppg']).sum()) for s in subjects)
+
+    if mode == 'cache_cold':
+        return (lambda: shutil.rmtree(cache_dir, ignore_errors=True)), run
+    if mode == 'cache_warm':
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_all_subjects(path, use_cache=True)
+    return run
+
+
+@benchmark('create_labels_for_subject')
+def bench_create_labels(ctx, _):
+    from labeling import create_labels_for_subject
+    subject = ctx.subjects[0]
+    return lambda: create_labels_for_subject(subject)
+
+
+@benchmark('create_windows', params=(250, 125))
+def bench_create_windows(ctx, stride):
+    from windowing import create_windows
+    subject = ctx.labeled_subjects[0]
+    return lambda: create_windows(subject['ppg'], subject['labels'], 500, stride)
+
+
+@benchmark('detect_peaks_auto', params=(60, 300))
+def bench_detect_peaks_auto(ctx, duration_s):
+    app_module, _ = ctx.annotator
+    session_id = next(s for s, w in app_module.session_repo.waveforms.items()
+                      if len(w) == duration_s * app_module.session_repo.fs)
+    signal = app_module.preprocess_ppg(app_module.session_repo.get_waveform(session_id))
+    return lambda: app_module.detect_peaks_auto(signal, app_module.session_repo.fs)
+
+
+@benchmark('performer_forward', params=(1, 16, 64))
+def bench_performer_forward(ctx, batch_size):
+    import torch
+    model = ctx.model
+    x = torch.randn(batch_size, 500)
+
+    def run():
+        with torch.inference_mode():
+            return model(x)
+    return run
+
+
+@benchmark('load_esp32_and_predict')
+def bench_load_esp32_and_predict(ctx, _):
+    load_esp32_and_predict = ctx.notebook['load_esp32_and_predict']
+    model, path = ctx.model, ctx.esp32_csv
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return load_esp32_and_predict(model, path)
+    return run
+
+
+def _graph_callback(client, app_module, changed, session_idx=1, click=None, relayout=None,
+                    signal_info=None):
+    key = next(k for k in app_module.app.callback_map if 'ppg-graph.figure' in k)
+    payload = {
+        'output': key,
+        'outputs': [{'id': o.split('.')[0], 'property': o.split('.')[1]}
+                    for o in key.strip('.').split('...')],
+        'inputs': [
+            {'id': 'session-dropdown', 'property': 'value', 'value': session_idx},
+            {'id': 'detect-btn', 'property': 'n_clicks', 'value': 0},
+            {'id': 'ppg-graph', 'property': 'clickData', 'value': click},
+            {'id': 'ppg-graph', 'property': 'relayoutData', 'value': relayout},
+        ],
+        'state': [
+            {'id': 'signal-store', 'property': 'data', 'value': signal_info},
+            {'id': 'zoom-store', 'property': 'data', 'value': {}},
+        ],
+        'changedPropIds': [changed],
+    }
+    response = client.post('/_dash-update-component', json=payload)
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"update_graph falhou ({response.status_code}): {response.get_data()[:500]}")
+    return response
+
+
+@benchmark('update_graph', params=('load_cold', 'load_warm', 'click', 'relayout'))
+def bench_update_graph(ctx, action):
+    app_module, client = ctx.annotator
+    n_samples = len(app_module.session_repo.waveforms[str(app_module.df_sessions.iloc[1]['id'])])
+    session_id = str(app_module.df_sessions.iloc[1]['id'])
+    signal_info = {'session_id': session_id, 'n_samples': n_samples}
+    fs = app_module.session_repo.fs
+
+    def load():
+        return _graph_callback(client, app_module, 'session-dropdown.value')
+
+    if action == 'load_cold':
+        def clear():
+            app_module.lod_cache = type(app_module.lod_cache)(max_sessions=8)
+            app_module.session_peaks.clear()
+        return clear, load
+
+    load()  # sessão em cache, picos detectados
+    if action == 'load_warm':
+        return load
+
+    if action == 'click':
+        # Clique alterna o mesmo pico (adiciona/remove): estado estável
+        click = {'points': [{'x': (n_samples // 2) / fs}]}
+        return lambda: _graph_callback(client, app_module, 'ppg-graph.clickData',
+                                       click=click, signal_info=signal_info)
+
+    relayouts = [{'xaxis.range[0]': a, 'xaxis.range[1]': a + 10} for a in (10.0, 100.0, 200.0)]
+    state = {'i': 0}
+
+    def relayout():
+        state['i'] += 1
+        return _graph_callback(client, app_module, 'ppg-graph.relayoutData',
+                               relayout=relayouts[state['i'] % len(relayouts)],
+                               signal_info=signal_info)
+    return relayout
+
+
+# ============== EXECUÇÃO / RESULTADOS ==============
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ANALYTICS_DIR,
+                             capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               cwd=ANALYTICS_DIR, capture_output=True, text=True, timeout=30)
+        return out.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def machine_info():
+    info = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def run_benchmarks(ctx, filters=(), repeat=5, min_time=0.2, verbose=True):
+    """
+    Roda os benchmarks registrados (filtrados por substring do nome).
+
+    Returns:
+        Lista de dicts com 'name', 'param', 'times_ms', 'min_ms', 'median_ms',
+        'mean_ms', 'stdev_ms', 'number' (ou 'error')
+    """
+    results = []
+    for name, params, fn in BENCHMARKS:
+        for param in params:
+            full_name = name if param is None else f'{name}[{param}]'
+            if filters and not any(f in full_name for f in filters):
+                continue
+            row = {'name': full_name, 'param': param}
+            try:
+                target = fn(ctx, param)
+                setup, call = target if isinstance(target, tuple) else (None, target)
+                samples, number = measure(call, setup, repeat=repeat, min_time=min_time)
+                times = [s * 1000 for s in samples]
+                row.update({
+                    'times_ms': times,
+                    'min_ms': min(times),
+                    'median_ms': statistics.median(times),
+                    'mean_ms': statistics.fmean(times),
+                    'stdev_ms': statistics.stdev(times) if len(times) > 1 else 0.0,
+                    'number': number,
+                })
+                if verbose:
+                    print(f"   {full_name:40s} {row['median_ms']:10.3f} ms  "
+                          f"(min {row['min_ms']:.3f}, ±{row['stdev_ms']:.3f}, n={number})")
+            except Exception as e:
+                row['error'] = f'{type(e).__name__}: {e}'
+                if verbose:
+                    print(f"   {full_name:40s} ❌ {row['error']}")
+            results.append(row)
+    return results
+
+
+def save_results(results, meta, path=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    if path is None:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(RESULTS_DIR, f"{stamp}_{meta.get('commit') or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    return path
+
+
+def compare_results(base, new, threshold=0.10, verbose=True):
+    """
+    Compara medianas de duas execuções (dicts carregados dos JSON).
+
+    Returns:
+        Lista de dicts com 'name', 'base_ms', 'new_ms', 'ratio' e 'status'
+        ('regressão' / 'melhora' / 'igual' / 'novo' / 'removido')
+    """
+    base_rows = {r['name']: r for r in base['results'] if 'median_ms' in r}
+    new_rows = {r['name']: r for r in new['results'] if 'median_ms' in r}
+    rows = []
+    for name in list(base_rows) + [n for n in new_rows if n not in base_rows]:
+        b, n = base_rows.get(name), new_rows.get(name)
+        row = {'name': name, 'base_ms': b and b['median_ms'], 'new_ms': n and n['median_ms']}
+        if b is None:
+            row.update(ratio=None, status='novo')
+        elif n is None:
+            row.update(ratio=None, status='removido')
+        else:
+            ratio = n['median_ms'] / b['median_ms']
+            status = 'regressão' if ratio > 1 + threshold else 'melhora' if ratio < 1 - threshold else 'igual'
+            row.update(ratio=ratio, status=status)
+        rows.append(row)
+
+    if verbose:
+        print(f"\n📊 {base['meta'].get('commit')} → {new['meta'].get('commit')}")
+        for r in rows:
+            ratio = f"{r['ratio']:.2f}x" if r['ratio'] is not None else '-'
+            fmt = lambda v: f'{v:10.3f}' if v is not None else f"{'-':>10s}"
+            flag = {'regressão': '🔴', 'melhora': '🟢'}.get(r['status'], '  ')
+            print(f"   {flag} {r['name']:40s} {fmt(r['base_ms'])} → {fmt(r['new_ms'])} ms  {ratio:>7s}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks do pipeline de análise PPG')
+    parser.add_argument('-k', '--filter', action='append', default=[],
+                        help='Só benchmarks cujo nome contém o texto (repetível)')
+    parser.add_argument('--repeat', type=int, default=5, help='Amostras por benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Tempo mínimo total por benchmark (s)')
+    parser.add_argument('--quick', action='store_true', help='Fixtures menores (2 sujeitos × 2 min)')
+    parser.add_argument('--bidmc-dir', help='Dataset BIDMC real no lugar do sintético')
+    parser.add_argument('--output', help='Arquivo JSON de saída (padrão: results/<data>_<commit>.json)')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='BASE [NOVO]: compara com uma execução anterior')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Variação relativa considerada regressão/melhora')
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare aceita BASE ou BASE NOVO')
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f_base, open(args.compare[1]) as f_new:
+            rows = compare_results(json.load(f_base), json.load(f_new), args.threshold)
+        return int(any(r['status'] == 'regressão' for r in rows))
+
+    meta = machine_info()
+    meta.update({'quick': args.quick, 'bidmc_dir': args.bidmc_dir, 'repeat': args.repeat})
+    print(f"⏱️ Benchmarks @ {meta['commit']} ({meta['cpu_count']} CPUs)")
+
+    with tempfile.TemporaryDirectory(prefix='ppg_bench_') as workdir:
+        ctx = Context(workdir, n_subjects=2 if args.quick else 8,
+                      duration_s=120 if args.quick else 480, bidmc_dir=args.bidmc_dir)
+        try:
+            results = run_benchmarks(ctx, args.filter, args.repeat, args.min_time)
+        finally:
+            ctx.close()
+
+    path = save_results(results, meta, args.output)
+    print(f"💾 Resultados: {path}")
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            rows = compare_results(json.load(f), {'meta': meta, 'results': results}, args.threshold)
+        return int(any(r['status'] == 'regressão' for r in rows))
+    return int(any('error' in r for r in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
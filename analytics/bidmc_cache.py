@@ -0,0 +1,215 @@
+"""
+Cache binário do dataset BIDMC (MIMIC-II).
+
+Converte uma única vez cada `bidmc_*_Signals.csv` em um `.npy` float32 por
+canal e guarda um índice JSON com os metadados lidos dos `bidmc_*_Fix.txt`.
+Nas execuções seguintes os sinais são abertos com memory-map (sem parsing
+de CSV e sem copiar para a RAM).
+
+Invalidação: cada entrada guarda mtime/tamanho do CSV de origem. Se mudarem,
+o SHA-1 do arquivo é comparado antes de reconverter (um simples `touch` não
+força a reconversão).
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_SUBDIR = '.npy_cache'
+INDEX_FILE = 'index.json'
+
+
+def parse_fix_header(filepath):
+    """
+    Lê o cabeçalho `bidmc_XX_Fix.txt`.
+
+    Returns:
+        Dict com 'record', 'signals', 'fs', 'numerics', 'numerics_fs',
+        'age', 'gender', 'location' (campos ausentes ficam None)
+    """
+    fields = {}
+    with open(filepath, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    record = lines[0] if lines else None
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            fields[key.strip()] = value.strip()
+
+    def _list(key):
+        value = fields.get(key)
+        return [v.strip() for v in value.split(';')] if value else []
+
+    def _hz(key):
+        value = fields.get(key)
+        if not value:
+            return None
+        hz = float(value.split()[0])
+        return int(hz) if hz.is_integer() else hz
+
+    age = fields.get('Age')
+    return {
+        'record': record,
+        'signals': _list('Signals'),
+        'fs': _hz('Signals sampling frequency'),
+        'numerics': _list('Numerics'),
+        'numerics_fs': _hz('Numerics sampling frequency'),
+        'age': int(age) if age and age.isdigit() else None,
+        'gender': fields.get('Gender'),
+        'location': fields.get('Location'),
+    }
+
+
+def _file_sha1(filepath, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_index(cache_dir):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') == CACHE_VERSION:
+            return index
+    return {'version': CACHE_VERSION, 'subjects': {}}
+
+
+def _save_index(cache_dir, index):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _is_fresh(entry, csv_path, cache_dir):
+    """Verifica se a entrada do índice ainda corresponde ao CSV de origem."""
+    if entry is None:
+        return False
+    if not all(os.path.exists(os.path.join(cache_dir, fn)) for fn in entry['files'].values()):
+        return False
+
+    st = os.stat(csv_path)
+    if st.st_mtime_ns == entry['mtime_ns'] and st.st_size == entry['size']:
+        return True
+
+    # mtime mudou: confirmar pelo conteúdo
+    if st.st_size == entry['size'] and _file_sha1(csv_path) == entry['sha1']:
+        entry['mtime_ns'] = st.st_mtime_ns
+        return True
+
+    return False
+
+
+def _convert_record(csv_path, subject_id, cache_dir):
+    """Converte um CSV de sinais para .npy float32 (um arquivo por canal)."""
+    df = pd.read_csv(csv_path)
+    df.columns = df.columns.str.strip()
+
+    files = {}
+    for column in df.columns:
+        if column.lower().startswith('time'):
+            continue
+        values = df[column].values.astype(np.float64)
+        # Remover NaN (mesmo critério de load_bidmc_record)
+        values = np.nan_to_num(values, nan=np.nanmean(values))
+        filename = f'bidmc_{subject_id}_{column}.npy'
+        np.save(os.path.join(cache_dir, filename), values.astype(np.float32))
+        files[column] = filename
+
+    st = os.stat(csv_path)
+    return {
+        'source': os.path.basename(csv_path),
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'sha1': _file_sha1(csv_path),
+        'n_samples': int(len(df)),
+        'files': files,
+    }
+
+
+def build_cache(mimic_dir, cache_dir=None, verbose=True):
+    """
+    Converte (ou atualiza) o cache binário de todos os registros.
+
+    Só reconverte registros novos ou cujo CSV mudou.
+
+    Returns:
+        Índice do cache (dict)
+    """
+    cache_dir = cache_dir or os.path.join(mimic_dir, DEFAULT_CACHE_SUBDIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    index = _load_index(cache_dir)
+
+    files = sorted(glob.glob(os.path.join(mimic_dir, 'bidmc_*_Signals.csv')))
+    converted = 0
+    for csv_path in files:
+        subject_id = os.path.basename(csv_path).split('_')[1]
+        entry = index['subjects'].get(subject_id)
+
+        if not _is_fresh(entry, csv_path, cache_dir):
+            try:
+                entry = _convert_record(csv_path, subject_id, cache_dir)
+            except Exception as e:
+                print(f"⚠️ Erro ao converter {os.path.basename(csv_path)}: {e}")
+                continue
+            converted += 1
+
+        header_path = os.path.join(mimic_dir, f'bidmc_{subject_id}_Fix.txt')
+        entry['header'] = parse_fix_header(header_path) if os.path.exists(header_path) else {}
+        index['subjects'][subject_id] = entry
+
+    # Remover do índice registros cujo CSV sumiu
+    present = {os.path.basename(p).split('_')[1] for p in files}
+    for subject_id in list(index['subjects']):
+        if subject_id not in present:
+            del index['subjects'][subject_id]
+
+    _save_index(cache_dir, index)
+    if verbose and converted:
+        print(f"💾 Cache BIDMC: {converted} registros convertidos em {cache_dir}")
+    return index
+
+
+def load_all_subjects_cached(mimic_dir, cache_dir=None, default_fs=125):
+    """
+    Carrega todos os sujeitos do BIDMC a partir do cache binário.
+
+    Mesmo formato de `load_all_subjects`, mas 'ppg' e 'ecg' são arrays
+    float32 memory-mapped (somente leitura).
+
+    Returns:
+        subjects: Lista de dicts com 'id', 'ppg', 'ecg', 'fs', 'filepath', 'meta'
+    """
+    cache_dir = cache_dir or os.path.join(mimic_dir, DEFAULT_CACHE_SUBDIR)
+    index = build_cache(mimic_dir, cache_dir)
+
+    subjects = []
+    for subject_id in sorted(index['subjects']):
+        entry = index['subjects'][subject_id]
+        files = entry['files']
+        if 'PLETH' not in files or 'II' not in files:
+            print(f"⚠️ Sujeito {subject_id} sem PLETH/II no cache")
+            continue
+
+        header = entry.get('header', {})
+        subjects.append({
+            'id': subject_id,
+            'ppg': np.load(os.path.join(cache_dir, files['PLETH']), mmap_mode='r'),
+            'ecg': np.load(os.path.join(cache_dir, files['II']), mmap_mode='r'),
+            'fs': header.get('fs') or default_fs,
+            'filepath': os.path.join(mimic_dir, entry['source']),
+            'meta': header,
+        })
+
+    return subjects
@@ -0,0 +1,348 @@
+"""
+Métricas de HRV em lote para muitas sessões de uma vez.
+
+As séries RR de todas as sessões ficam num formato "ragged": um buffer
+plano `values` (ms) e `offsets` (n_sessões + 1), com a sessão i em
+`values[offsets[i]:offsets[i + 1]]`. Nada de laço por sessão:
+
+- Domínio do tempo (FC, SDNN, RMSSD, pNN50): reduções segmentadas com
+  `np.add.reduceat`
+- Domínio da frequência (VLF/LF/HF, LF/HF): Lomb-Scargle (amostragem
+  irregular, sem interpolação) avaliado para todas as sessões juntas, em
+  blocos de frequências, com as somas por sessão também via `reduceat`
+- Janelas deslizantes: as janelas viram outro conjunto ragged (índices
+  reunidos sem laço) e passam pelas mesmas funções
+
+Uso:
+    df = repo.list_sessions(columns=['id', 'created_at', 'rrr_intervals_ms'])
+    metrics = hrv_table(df)                       # uma linha por sessão
+    metrics = hrv_from_peaks([peaks], fs=125)     # a partir de picos
+    rolling = rolling_hrv(values, offsets, window_s=60, step_s=30)
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+from scipy.integrate import trapezoid
+
+DEFAULT_RR_RANGE = (300, 2000)  # ms (200–30 bpm)
+VLF_BAND = (0.0033, 0.04)
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+DEFAULT_N_FREQS = 128
+MAX_BLOCK_ELEMENTS = 4_000_000  # batimentos × frequências por bloco do Lomb-Scargle
+
+
+# ============== FORMATO RAGGED ==============
+
+def pack_rr(series):
+    """Lista de séries RR (ms) → (values float64, offsets int64)."""
+    series = [np.asarray(s, dtype=np.float64).ravel() for s in series]
+    offsets = np.zeros(len(series) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in series], out=offsets[1:])
+    values = np.concatenate(series) if series else np.zeros(0)
+    return values, offsets
+
+
+def unpack_rr(values, offsets):
+    """Inverso de `pack_rr` (views do buffer)."""
+    return [values[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def rr_from_peaks(peaks, fs):
+    """
+    RR (ms) de várias sessões a partir dos índices dos picos.
+
+    Args:
+        peaks: Lista de arrays de picos (amostras, ordenados)
+        fs: Frequência de amostragem (escalar ou uma por sessão)
+
+    Returns:
+        (values, offsets)
+    """
+    fs = np.broadcast_to(np.asarray(fs, dtype=np.float64), (len(peaks),))
+    return pack_rr([np.diff(np.asarray(p, dtype=np.float64)) / f * 1000 for p, f in zip(peaks, fs)])
+
+
+def parse_rr_column(column):
+    """Coluna `rrr_intervals_ms` do banco (lista JSONB, texto JSON ou None) → ragged."""
+    def parse(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return []
+        if isinstance(value, str):
+            value = json.loads(value)
+        return value
+    return pack_rr([parse(v) for v in column])
+
+
+def filter_rr(values, offsets, rr_range=DEFAULT_RR_RANGE):
+    """Remove intervalos fora de `rr_range` (ms), mantendo a segmentação."""
+    keep = (values >= rr_range[0]) & (values <= rr_range[1])
+    kept = np.concatenate([[0], np.cumsum(keep)])
+    return values[keep], kept[offsets]
+
+
+def _segment_sum(x, offsets):
+    """Soma de cada segmento (0 nos vazios); x pode ter eixos extras após o 0."""
+    counts = np.diff(offsets)
+    out = np.zeros((len(counts),) + x.shape[1:], dtype=np.result_type(x, np.float64))
+    nonempty = counts > 0
+    if nonempty.any():
+        out[nonempty] = np.add.reduceat(x, offsets[:-1][nonempty], axis=0)
+    return out
+
+
+def _successive_diffs(values, offsets):
+    """Diferenças RR sucessivas dentro de cada sessão (ragged)."""
+    counts = np.diff(offsets)
+    diffs = np.diff(values)
+    mask = np.ones(len(diffs), dtype=bool)
+    boundaries = offsets[1:-1] - 1
+    mask[boundaries[(boundaries >= 0) & (boundaries < len(diffs))]] = False
+    diff_offsets = np.zeros_like(offsets)
+    np.cumsum(np.maximum(counts - 1, 0), out=diff_offsets[1:])
+    return diffs[mask], diff_offsets
+
+
+# ============== DOMÍNIO DO TEMPO ==============
+
+def time_domain(values, offsets, pnn_threshold_ms=50, ddof=1):
+    """
+    FC, SDNN, RMSSD e pNN50 de todas as sessões.
+
+    Returns:
+        Dict de arrays (uma posição por sessão): 'n_rr', 'mean_rr_ms',
+        'hr_mean_bpm', 'hr_std_bpm', 'sdnn_ms', 'rmssd_ms', 'pnn50'
+        (%, intervalo `pnn_threshold_ms`). NaN onde faltam batimentos.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rr = _segment_sum(values, offsets) / counts
+        dev = values - np.repeat(mean_rr, counts)
+        sdnn = np.sqrt(_segment_sum(dev ** 2, offsets) / (counts - ddof))
+
+        hr = 60000 / values
+        hr_mean_inst = _segment_sum(hr, offsets) / counts
+        hr_std = np.sqrt(_segment_sum((hr - np.repeat(hr_mean_inst, counts)) ** 2, offsets)
+                         / (counts - ddof))
+
+        diffs, diff_offsets = _successive_diffs(values, offsets)
+        n_diffs = np.diff(diff_offsets)
+        rmssd = np.sqrt(_segment_sum(diffs ** 2, diff_offsets) / n_diffs)
+        pnn = 100 * _segment_sum((np.abs(diffs) > pnn_threshold_ms).astype(np.float64),
+                                 diff_offsets) / n_diffs
+
+    too_short = counts <= ddof
+    sdnn[too_short] = np.nan
+    hr_std[too_short] = np.nan
+    return {
+        'n_rr': counts,
+        'mean_rr_ms': mean_rr,
+        'hr_mean_bpm': 60000 / mean_rr,
+        'hr_std_bpm': hr_std,
+        'sdnn_ms': sdnn,
+        'rmssd_ms': rmssd,
+        'pnn50': pnn,
+    }
+
+
+# ============== DOMÍNIO DA FREQUÊNCIA ==============
+
+def lomb_scargle(values, offsets, freqs, block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    PSD Lomb-Scargle (ms²/Hz) de todas as sessões nas frequências `freqs` (Hz).
+
+    Os instantes são o acumulado dos RR; a série é centrada na média da
+    sessão. A escala 2·P·T/N faz a PSD integrar para a variância
+    (mesma convenção de uma PSD unilateral).
+
+    Returns:
+        Array (n_sessões, n_freqs); linhas de sessões com < 3 RR ficam NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    freqs = np.asarray(freqs, dtype=np.float64)
+    counts = np.diff(offsets)
+    n_sessions = len(counts)
+
+    # Instantes locais (s) de cada batimento: acumulado dentro da sessão
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    t = (csum[1:] - np.repeat(csum[offsets[:-1]], counts)) / 1000
+    duration = _segment_sum(values, offsets) / 1000
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = values - np.repeat(_segment_sum(values, offsets) / counts, counts)
+
+    psd = np.full((n_sessions, len(freqs)), np.nan)
+    if len(values) == 0:
+        return psd
+    block = max(1, block_elements // len(values))
+    equispaced = len(freqs) > 1 and np.allclose(np.diff(freqs), freqs[1] - freqs[0])
+    for i in range(0, len(freqs), block):
+        w = 2 * np.pi * freqs[i:i + block]
+        if equispaced and len(w) > 1:
+            # exp(iωₖt) = exp(iω₀t)·exp(iΔωt)ᵏ: multiplicações no lugar de senos/cossenos
+            z = np.empty((len(t), len(w)), dtype=np.complex128)
+            z[:, 0] = np.exp(1j * w[0] * t)
+            z[:, 1:] = np.exp(1j * (w[1] - w[0]) * t)[:, None]
+            np.cumprod(z, axis=1, out=z)
+        else:
+            z = np.exp(1j * t[:, None] * w[None, :])                   # (N, F)
+        # Somas por sessão de x·e^{iωt} e e^{2iωt} bastam: o deslocamento τ
+        # entra pelas identidades de cos/sin(ωt − ωτ)
+        xz = _segment_sum(x[:, None] * z, offsets)
+        z2 = _segment_sum(z * z, offsets)
+        xc, xs = xz.real, xz.imag
+        cc = (counts[:, None] + z2.real) / 2                            # Σcos²ωt
+        ss = (counts[:, None] - z2.real) / 2                            # Σsin²ωt
+        cs = z2.imag / 2
+        wtau = 0.5 * np.arctan2(2 * cs, cc - ss)                        # (S, F)
+        ct, st = np.cos(wtau), np.sin(wtau)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p = 0.5 * ((ct * xc + st * xs) ** 2 / (ct ** 2 * cc + 2 * ct * st * cs + st ** 2 * ss)
+                       + (ct * xs - st * xc) ** 2 / (ct ** 2 * ss - 2 * ct * st * cs + st ** 2 * cc))
+            psd[:, i:i + block] = 2 * p * (duration / counts)[:, None]
+
+    psd[counts < 3] = np.nan
+    return psd
+
+
+def _band_power(psd, freqs, band):
+    sel = (freqs >= band[0]) & (freqs <= band[1])
+    if sel.sum() < 2:
+        return np.full(len(psd), np.nan)
+    return trapezoid(psd[:, sel], freqs[sel], axis=1)
+
+
+def frequency_domain(values, offsets, n_freqs=DEFAULT_N_FREQS, freqs=None):
+    """
+    Potências VLF/LF/HF (ms²), LF/HF e LF/HF normalizados (n.u.).
+
+    Args:
+        n_freqs: Pontos da grade linear entre VLF_BAND[0] e HF_BAND[1]
+        freqs: Grade própria (Hz), no lugar da padrão
+
+    Returns:
+        Dict de arrays por sessão: 'vlf_ms2', 'lf_ms2', 'hf_ms2',
+        'total_ms2', 'lf_hf', 'lf_nu', 'hf_nu'
+    """
+    freqs = np.linspace(VLF_BAND[0], HF_BAND[1], n_freqs) if freqs is None else np.asarray(freqs)
+    psd = lomb_scargle(values, offsets, freqs)
+    vlf, lf, hf = (_band_power(psd, freqs, band) for band in (VLF_BAND, LF_BAND, HF_BAND))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'vlf_ms2': vlf,
+            'lf_ms2': lf,
+            'hf_ms2': hf,
+            'total_ms2': _band_power(psd, freqs, (freqs[0], freqs[-1])),
+            'lf_hf': lf / hf,
+            'lf_nu': 100 * lf / (lf + hf),
+            'hf_nu': 100 * hf / (lf + hf),
+        }
+
+
+# ============== TABELAS ==============
+
+def hrv_metrics(values, offsets, rr_range=DEFAULT_RR_RANGE, frequency=True, n_freqs=DEFAULT_N_FREQS):
+    """
+    Domínio do tempo (+ frequência) de todas as sessões.
+
+    Args:
+        rr_range: Intervalos fora da faixa (ms) são descartados antes (None = mantém)
+        frequency: Inclui as bandas do Lomb-Scargle
+
+    Returns:
+        DataFrame com uma linha por sessão
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if rr_range is not None:
+        values, offsets = filter_rr(values, offsets, rr_range)
+    metrics = time_domain(values, offsets)
+    if frequency:
+        metrics.update(frequency_domain(values, offsets, n_freqs))
+    return pd.DataFrame(metrics)
+
+
+def hrv_from_peaks(peaks, fs, **kwargs):
+    """`hrv_metrics` a partir dos picos de cada sessão (ver `rr_from_peaks`)."""
+    return hrv_metrics(*rr_from_peaks(peaks, fs), **kwargs)
+
+
+def hrv_table(df_sessions, rr_column='rrr_intervals_ms', id_column='id', **kwargs):
+    """
+    HRV de toda a tabela `hrv_sessions` numa chamada.
+
+    Args:
+        df_sessions: DataFrame com a coluna de RR (ex.: de
+            `SessionRepository.list_sessions(columns=[...])`)
+        **kwargs: De `hrv_metrics`
+
+    Returns:
+        DataFrame com `id_column` + métricas, na ordem de `df_sessions`
+    """
+    metrics = hrv_metrics(*parse_rr_column(df_sessions[rr_column]), **kwargs)
+    if id_column in df_sessions:
+        metrics.insert(0, id_column, df_sessions[id_column].to_numpy())
+    return metrics
+
+
+# ============== JANELAS DESLIZANTES ==============
+
+def rolling_windows(values, offsets, window_s=60, step_s=30):
+    """
+    Janelas de tempo de todas as sessões como um novo conjunto ragged.
+
+    Um RR pertence à janela [início, início + window_s) se o batimento que
+    o fecha cai nela. Só janelas inteiras dentro da sessão.
+
+    Returns:
+        (win_values, win_offsets, session_idx, start_s)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    n_sessions = len(counts)
+
+    duration = _segment_sum(values, offsets) / 1000
+    n_windows = np.maximum(np.floor((duration - window_s) / step_s).astype(np.int64) + 1, 0)
+    session_idx = np.repeat(np.arange(n_sessions), n_windows)
+    first_window = np.concatenate([[0], np.cumsum(n_windows)])[:-1]
+    start_s = (np.arange(len(session_idx)) - np.repeat(first_window, n_windows)) * step_s
+
+    # Tempo global: sessões enfileiradas, cada uma começando após o fim da anterior
+    session_t0 = np.concatenate([[0.0], np.cumsum(duration + window_s)])[:-1]
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    t_local = (csum[1:] - np.repeat(csum[offsets[:-1]], counts)) / 1000
+    t_global = t_local + np.repeat(session_t0, counts)
+
+    win_start = session_t0[session_idx] + start_s
+    lo = np.searchsorted(t_global, win_start, side='left')
+    hi = np.searchsorted(t_global, win_start + window_s, side='left')
+
+    win_counts = hi - lo
+    win_offsets = np.zeros(len(lo) + 1, dtype=np.int64)
+    np.cumsum(win_counts, out=win_offsets[1:])
+    gather = np.arange(win_offsets[-1]) - np.repeat(win_offsets[:-1] - lo, win_counts)
+    return values[gather], win_offsets, session_idx, start_s
+
+
+def rolling_hrv(values, offsets, window_s=60, step_s=30, rr_range=DEFAULT_RR_RANGE,
+                frequency=False, **kwargs):
+    """
+    `hrv_metrics` em janelas deslizantes de todas as sessões.
+
+    Returns:
+        DataFrame com 'session', 'start_s' + métricas, uma linha por janela
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if rr_range is not None:
+        values, offsets = filter_rr(values, offsets, rr_range)
+    win_values, win_offsets, session_idx, start_s = rolling_windows(values, offsets, window_s, step_s)
+    metrics = hrv_metrics(win_values, win_offsets, rr_range=None, frequency=frequency, **kwargs)
+    metrics.insert(0, 'start_s', start_s)
+    metrics.insert(0, 'session', session_idx)
+    return metrics
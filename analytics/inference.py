@@ -0,0 +1,209 @@
+"""
+Inferência em lote do PPGPeakPerformer com janelas deslizantes.
+
+Em vez de rodar o modelo uma janela por vez, as janelas (views com stride)
+são normalizadas em lote, empilhadas em mini-batches grandes e avaliadas por
+um backend de `inference_backends` (torch sob `inference_mode` ou ONNX
+Runtime). A média das janelas sobrepostas é feita com overlap-add vetorizado.
+
+Modos:
+- `predict_signal`: sinal inteiro → probabilidades por amostra
+- `iter_predictions`: gerador que processa o sinal em blocos e entrega os
+  trechos já finalizados (memória limitada, útil para gravações de horas ou
+  arrays memory-mapped)
+- `predict_session`: modelo `length_agnostic` na sessão inteira numa única
+  chamada (sem janelas nem overlap-add)
+
+`benchmark_inference` compara modos em latência e F1 por pico.
+"""
+
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from inference_backends import as_backend
+from peak_evaluation import evaluate_peaks, peaks_from_probs, summarize_peak_metrics
+from profiling import profiled
+from windowing import window_starts, zscore_windows
+
+
+def overlap_add(preds, offsets, length):
+    """
+    Soma predições de janelas sobrepostas.
+
+    Args:
+        preds: (n_janelas, window_size)
+        offsets: Início de cada janela (relativo ao buffer de saída)
+        length: Tamanho do buffer de saída
+
+    Returns:
+        sums, counts: Arrays (length,)
+    """
+    n_windows, window_size = preds.shape
+    sums = np.zeros(length, dtype=np.float64)
+    counts = np.zeros(length, dtype=np.float64)
+    if n_windows == 0:
+        return sums, counts
+
+    stride = int(offsets[1] - offsets[0]) if n_windows > 1 else window_size
+    uniform = n_windows == 1 or np.all(np.diff(offsets) == stride)
+
+    if uniform and window_size % stride == 0 and offsets[0] % stride == 0:
+        # Stride divide a janela: cada janela cobre k blocos de `stride` amostras
+        # e a soma vira k adições deslocadas de arrays (n_janelas, stride)
+        k = window_size // stride
+        first_block = int(offsets[0]) // stride
+        n_blocks = n_windows + k - 1
+        block_sums = np.zeros((n_blocks, stride), dtype=np.float64)
+        block_counts = np.zeros(n_blocks, dtype=np.float64)
+        blocks = preds.reshape(n_windows, k, stride)
+        for j in range(k):
+            block_sums[j:j + n_windows] += blocks[:, j, :]
+            block_counts[j:j + n_windows] += 1
+
+        start = first_block * stride
+        end = start + n_blocks * stride
+        sums[start:end] = block_sums.ravel()
+        counts[start:end] = np.repeat(block_counts, stride)
+    else:
+        # Caso geral: scatter com bincount
+        idx = (np.asarray(offsets)[:, None] + np.arange(window_size)).ravel()
+        sums += np.bincount(idx, weights=preds.ravel(), minlength=length)[:length]
+        counts += np.bincount(idx, minlength=length)[:length]
+
+    return sums, counts
+
+
+def iter_predictions(model, signal, window_size=500, stride=None, batch_size=64,
+                     chunk_windows=2048, device=None):
+    """
+    Gera as probabilidades por amostra em blocos.
+
+    Cada bloco processa até `chunk_windows` janelas; as amostras que nenhuma
+    janela futura vai tocar são entregues imediatamente e só a sobreposição
+    com o próximo bloco fica em memória.
+
+    Args:
+        model: nn.Module (roda via TorchBackend) ou backend de
+            `inference_backends` (ex.: OnnxRuntimeBackend)
+        batch_size, device: Usados só quando `model` é um nn.Module
+
+    Yields:
+        (start, probs): índice da primeira amostra e probabilidades do trecho
+    """
+    stride = stride or window_size // 4
+    backend = as_backend(model, device=device, batch_size=batch_size)
+    n_samples = len(signal)
+    starts = window_starts(n_samples, window_size, stride)
+    n_windows = len(starts)
+
+    if n_windows == 0:
+        yield 0, np.zeros(n_samples)
+        return
+
+    carry_sums = np.zeros(0)
+    carry_counts = np.zeros(0)
+
+    for i in range(0, n_windows, chunk_windows):
+        j = min(i + chunk_windows, n_windows)
+        region_start = int(starts[i])
+        region_end = int(starts[j - 1]) + window_size
+
+        segment = np.asarray(signal[region_start:region_end], dtype=np.float64)
+        # O trecho termina exatamente no fim da última janela do bloco
+        windows = zscore_windows(sliding_window_view(segment, window_size)[::stride])
+        preds = backend(windows)
+
+        sums, counts = overlap_add(preds, starts[i:j] - region_start, region_end - region_start)
+        sums[:len(carry_sums)] += carry_sums
+        counts[:len(carry_counts)] += carry_counts
+
+        # Amostras antes do início da próxima janela já estão finalizadas
+        final_end = int(starts[j]) if j < n_windows else region_end
+        n_final = final_end - region_start
+        yield region_start, sums[:n_final] / np.maximum(counts[:n_final], 1)
+
+        carry_sums = sums[n_final:]
+        carry_counts = counts[n_final:]
+
+    # Cauda sem cobertura de nenhuma janela (mesmo comportamento do loop original: 0)
+    if region_end < n_samples:
+        yield region_end, np.zeros(n_samples - region_end)
+
+
+@profiled('inference')
+def predict_signal(model, signal, window_size=500, stride=None, batch_size=64,
+                   chunk_windows=2048, device=None):
+    """
+    Probabilidade de pico por amostra para o sinal inteiro.
+
+    Equivale ao loop janela-a-janela de `load_esp32_and_predict`
+    (Z-score por janela + média das sobreposições), mas em lote.
+    """
+    predictions = np.zeros(len(signal))
+    for start, probs in iter_predictions(model, signal, window_size, stride,
+                                         batch_size, chunk_windows, device):
+        predictions[start:start + len(probs)] = probs
+    return predictions
+
+
+@profiled('inference')
+def predict_session(model, signal, batch_size=1, device=None):
+    """
+    Probabilidade de pico por amostra numa única passada pelo modelo.
+
+    Requer um modelo de comprimento livre (PPGPeakPerformer(length_agnostic=True)
+    ou o .onnx exportado dele). O sinal é normalizado por inteiro (Z-score
+    da sessão, como nos recortes do treino). A memória cresce linearmente
+    com o comprimento (atenção linear); para gravações de horas, use
+    `iter_predictions`.
+    """
+    backend = as_backend(model, device=device, batch_size=batch_size)
+    x = zscore_windows(np.asarray(signal, dtype=np.float64)[None, :])
+    return backend(x)[0].astype(np.float64)
+
+
+def benchmark_inference(runs, subjects, fs=125, tolerance_s=0.05, threshold=0.5, verbose=True):
+    """
+    Latência e F1 por pico de modos de inferência.
+
+    Args:
+        runs: Dict nome → função sinal → probabilidades, ex.:
+            {'janelas': lambda s: predict_signal(model, s),
+             'sessão': lambda s: predict_session(model_la, s)}
+        subjects: Sujeitos com 'ppg' e 'peaks'
+
+    Returns:
+        Lista de dicts com 'mode', 'f1', 'precision', 'recall',
+        'ms_per_session', 'ms_per_minute'
+    """
+    rows = []
+    for name, run in runs.items():
+        run(subjects[0]['ppg'][:fs * 10])  # aquecimento
+        beats = []
+        elapsed = 0.0
+        minutes = 0.0
+        for subj in subjects:
+            t0 = time.perf_counter()
+            probs = run(subj['ppg'])
+            elapsed += time.perf_counter() - t0
+            minutes += len(subj['ppg']) / fs / 60
+            beats.append(evaluate_peaks(peaks_from_probs(probs, fs, threshold), subj['peaks'],
+                                        fs, tolerance_s * 1000))
+
+        summary = summarize_peak_metrics(beats)
+        rows.append({
+            'mode': name,
+            'f1': summary['f1'],
+            'precision': summary['ppv'],
+            'recall': summary['sensitivity'],
+            'ms_per_session': elapsed * 1000 / len(subjects),
+            'ms_per_minute': elapsed * 1000 / max(minutes, 1e-9),
+        })
+
+    if verbose:
+        for r in rows:
+            print(f"   {r['mode']:20s} F1 {r['f1']:.3f} | {r['ms_per_session']:8.1f} ms/sessão "
+                  f"| {r['ms_per_minute']:6.1f} ms/min de sinal")
+    return rows
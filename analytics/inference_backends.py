@@ -0,0 +1,234 @@
+"""
+Backends de inferência do PPGPeakPerformer (torch / ONNX Runtime).
+
+Um backend é qualquer objeto chamável que recebe janelas normalizadas
+(n, window_size) float32 e devolve as probabilidades (n, window_size)
+float32. `inference.iter_predictions` / `predict_signal` aceitam um backend
+ou um modelo torch (embrulhado em `TorchBackend`).
+
+O backend ONNX Runtime não importa torch: um script de inferência que só usa
+`OnnxRuntimeBackend` + `inference.predict_signal` carrega bem mais rápido.
+
+Uso:
+    backend = load_backend('performer_peak_detector.onnx')
+    probs = predict_signal(backend, ppg_125hz)
+
+Exportação: ver `export_onnx`.
+"""
+
+import os
+import time
+
+import numpy as np
+
+ONNX_INPUT = 'ppg'
+ONNX_OUTPUT = 'probs'
+DEFAULT_OPSET = 17
+MODEL_CONFIG_KEYS = ('window_size', 'd_model', 'n_heads', 'n_layers', 'causal', 'memory',
+                     'lookahead', 'length_agnostic')
+
+
+class TorchBackend:
+    """Modelo torch em modo avaliação, em lotes, sob `inference_mode`."""
+
+    name = 'torch'
+
+    def __init__(self, model, device=None, batch_size=64):
+        import torch
+
+        self._torch = torch
+        self.model = model.eval()
+        self.device = device or next(model.parameters()).device
+        self.batch_size = batch_size
+
+    def __call__(self, windows):
+        torch = self._torch
+        out = np.empty(windows.shape, dtype=np.float32)
+        with torch.inference_mode():
+            for i in range(0, len(windows), self.batch_size):
+                batch = np.ascontiguousarray(windows[i:i + self.batch_size], dtype=np.float32)
+                batch = torch.from_numpy(batch).to(self.device)
+                out[i:i + self.batch_size] = self.model(batch).float().cpu().numpy()
+        return out
+
+
+class OnnxRuntimeBackend:
+    """
+    Sessão ONNX Runtime sobre um modelo exportado por `export_onnx`.
+
+    Args:
+        path: Arquivo .onnx
+        batch_size: Janelas por chamada ao runtime
+        intra_op_threads: Threads do ORT (None = padrão do ORT)
+        providers: Execution providers (padrão: CPU)
+    """
+
+    name = 'onnxruntime'
+
+    def __init__(self, path, batch_size=64, intra_op_threads=None, providers=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnxruntime não instalado: pip install onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            path, sess_options=options, providers=providers or ['CPUExecutionProvider']
+        )
+        self.batch_size = batch_size
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, windows):
+        out = np.empty(windows.shape, dtype=np.float32)
+        for i in range(0, len(windows), self.batch_size):
+            batch = np.ascontiguousarray(windows[i:i + self.batch_size], dtype=np.float32)
+            out[i:i + self.batch_size] = self.session.run(None, {self.input_name: batch})[0]
+        return out
+
+
+def as_backend(model_or_backend, device=None, batch_size=64):
+    """Embrulha um nn.Module em TorchBackend; backends passam direto."""
+    if hasattr(model_or_backend, 'parameters') and hasattr(model_or_backend, 'eval'):
+        return TorchBackend(model_or_backend, device=device, batch_size=batch_size)
+    return model_or_backend
+
+
+def load_torch_model(checkpoint_path, model_config=None, map_location='cpu'):
+    """
+    Carrega um PPGPeakPerformer de um checkpoint.
+
+    Aceita o formato da seção 9 do notebook ({'model_state_dict', 'config'}),
+    o checkpoint int8 de `quantization.save_quantized_checkpoint` (chave
+    'quantization') ou um state_dict puro (ex.: best_performer.pth).
+    """
+    import torch
+    from performer import PPGPeakPerformer
+
+    state = torch.load(checkpoint_path, map_location=map_location)
+    config = dict(model_config or {})
+    quantization = None
+    if isinstance(state, dict) and 'model_state_dict' in state:
+        quantization = state.get('quantization')
+        saved = state.get('config', {})
+        for key in MODEL_CONFIG_KEYS:
+            if key in saved:
+                config.setdefault(key, saved[key])
+        state = state['model_state_dict']
+
+    model = PPGPeakPerformer(**config)
+    if quantization:
+        from quantization import quantize_dynamic_torch
+        model = quantize_dynamic_torch(model)
+    model.load_state_dict(state)
+    return model.eval()
+
+
+def load_backend(path, backend=None, model_config=None, batch_size=64, **kwargs):
+    """
+    Backend a partir de um arquivo: .onnx → ONNX Runtime, .pth → torch.
+
+    Args:
+        backend: Força 'torch' ou 'onnxruntime'
+    """
+    backend = backend or ('onnxruntime' if path.endswith('.onnx') else 'torch')
+    if backend == 'onnxruntime':
+        return OnnxRuntimeBackend(path, batch_size=batch_size, **kwargs)
+    if backend == 'torch':
+        return TorchBackend(load_torch_model(path, model_config), batch_size=batch_size, **kwargs)
+    raise ValueError(f"Backend desconhecido: {backend}")
+
+
+def export_onnx(model, path, window_size=None, opset=DEFAULT_OPSET, check=True,
+                atol=1e-4, verbose=True):
+    """
+    Exporta o modelo para ONNX com eixos dinâmicos de batch e sequência.
+
+    O comprimento da sequência pode variar até `window_size` (tamanho da
+    codificação posicional do modelo), ou livremente em modelos
+    `length_agnostic`. Modelos causais (`causal=True`) não são exportáveis:
+    a atenção causal percorre a sequência em blocos num laço Python, que o
+    trace fixaria no comprimento do exemplo; use `performer.PerformerStream`.
+
+    Args:
+        check: Compara ONNX Runtime × torch em entradas de vários formatos
+        atol: Tolerância absoluta da checagem
+
+    Returns:
+        Dict com 'path', 'size_mb' e, se check, 'max_abs_diff'
+
+    Raises:
+        ValueError: Se o modelo for causal
+        AssertionError: Se a diferença passar de `atol`
+    """
+    import torch
+
+    if getattr(model, 'causal', False):
+        raise ValueError("Modelo causal não exportável para ONNX (atenção em blocos com "
+                         "comprimento dinâmico); use performer.PerformerStream")
+    model = model.eval().cpu()
+    window_size = window_size or model.pos_encoding.pe.shape[1]
+    dummy = torch.randn(2, window_size)
+
+    tmp = path + '.tmp'
+    torch.onnx.export(
+        model, (dummy,), tmp,
+        input_names=[ONNX_INPUT], output_names=[ONNX_OUTPUT],
+        dynamic_axes={ONNX_INPUT: {0: 'batch', 1: 'seq'}, ONNX_OUTPUT: {0: 'batch', 1: 'seq'}},
+        opset_version=opset, do_constant_folding=True, dynamo=False,
+    )
+    os.replace(tmp, path)
+
+    result = {'path': path, 'size_mb': os.path.getsize(path) / 1e6}
+    if check:
+        shapes = [(1, window_size), (7, window_size), (3, window_size // 2)]
+        if model.pos_encoding.extendable:
+            shapes.append((1, 4 * window_size))  # sessão maior que a janela de referência
+        result['max_abs_diff'] = check_parity(model, OnnxRuntimeBackend(path), window_size, shapes)
+        assert result['max_abs_diff'] <= atol, (
+            f"Paridade ONNX falhou: diferença máxima {result['max_abs_diff']:.2e} > {atol:.0e}"
+        )
+    if verbose:
+        msg = f"📦 ONNX exportado: {path} ({result['size_mb']:.2f} MB)"
+        if check:
+            msg += f" | paridade: {result['max_abs_diff']:.2e}"
+        print(msg)
+    return result
+
+
+def check_parity(model, backend, window_size, shapes=None, seed=0):
+    """Maior diferença absoluta entre torch e `backend` em vários formatos de entrada."""
+    shapes = shapes or [(1, window_size), (7, window_size), (3, window_size // 2)]
+    reference = TorchBackend(model)
+    rng = np.random.default_rng(seed)
+    max_diff = 0.0
+    for shape in shapes:
+        x = rng.standard_normal(shape).astype(np.float32)
+        max_diff = max(max_diff, float(np.abs(reference(x) - backend(x)).max()))
+    return max_diff
+
+
+def benchmark_backends(backends, window_size=500, batch_sizes=(1, 64), repeats=20):
+    """
+    Latência por janela de cada backend.
+
+    Args:
+        backends: Dict nome → backend
+
+    Returns:
+        Lista de dicts com 'backend', 'batch_size', 'ms_per_window'
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for name, backend in backends.items():
+        for bs in batch_sizes:
+            x = rng.standard_normal((bs, window_size)).astype(np.float32)
+            backend(x)  # aquecimento
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                backend(x)
+            elapsed = (time.perf_counter() - t0) / repeats
+            results.append({'backend': name, 'batch_size': bs, 'ms_per_window': elapsed * 1000 / bs})
+    return results
@@ -0,0 +1,219 @@
+"""
+Labels de picos PPG a partir do ECG (BIDMC), vetorizado e em cache.
+
+1. Picos R no ECG (passa-banda + quadrado + suavização + find_peaks) — a
+   etapa cara; roda em um pool de processos só para os sujeitos fora do cache
+   (em série quando o `__main__` é um script sem guarda, ver `spawn_pool_safe`)
+2. Transferência ECG → PPG: argmax em cada janela de PTT, todas as janelas
+   de uma vez via `sliding_window_view` (sem laço por batimento)
+3. Labels: dilatação ±`label_radius` amostras com indexação vetorizada
+
+Cache em disco (`.npy`), em dois níveis:
+- picos R: chave = ECG + parâmetros do filtro
+- picos PPG: chave = picos R + PPG + `ptt_range`
+Mudar só o `ptt_range` reaproveita os picos R; reprocessar os 53 sujeitos
+leva frações de segundo.
+
+Uso:
+    from labeling import label_all_subjects
+    label_all_subjects(subjects, ptt_range=(0.15, 0.35), cache_dir='.label_cache')
+    subjects[0]['peaks'], subjects[0]['labels']
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import gaussian_filter1d
+from scipy.signal import butter, filtfilt, find_peaks
+
+from profiling import profiled
+
+DEFAULT_FILTER_PARAMS = {
+    'band': (5, 25),
+    'order': 2,
+    'smooth_sec': 0.02,
+    'threshold_percentile': 70,
+    'min_distance_sec': 0.4,
+}
+DEFAULT_PTT_RANGE = (0.15, 0.35)
+DEFAULT_LABEL_RADIUS = 3  # ±3 amostras (±24ms @ 125Hz)
+
+
+def detect_ecg_r_peaks(ecg, fs, min_distance_sec=0.4, band=(5, 25), order=2,
+                       smooth_sec=0.02, threshold_percentile=70):
+    """
+    Detecta picos R no ECG usando derivada + threshold.
+    """
+    # Filtro passa-banda para QRS (5-25 Hz)
+    nyq = fs / 2
+    b, a = butter(order, [band[0] / nyq, band[1] / nyq], btype='band')
+    ecg_filt = filtfilt(b, a, ecg)
+
+    # Elevar ao quadrado e suavizar
+    ecg_smooth = gaussian_filter1d(ecg_filt ** 2, sigma=fs * smooth_sec)
+
+    # Detectar picos
+    min_dist = int(min_distance_sec * fs)
+    threshold = np.percentile(ecg_smooth, threshold_percentile)
+    peaks, _ = find_peaks(ecg_smooth, distance=min_dist, height=threshold)
+
+    return peaks
+
+
+def transfer_peaks_to_ppg(ecg_peaks, ppg, fs, ptt_range=DEFAULT_PTT_RANGE):
+    """
+    Transfere picos R do ECG para picos sistólicos do PPG.
+    O Pulse Transit Time (PTT) é tipicamente 150-350ms.
+
+    Todas as janelas de busca são views de um único `sliding_window_view`.
+    """
+    ppg = np.asarray(ppg)
+    ecg_peaks = np.asarray(ecg_peaks, dtype=np.int64)
+    ptt_min = int(ptt_range[0] * fs)
+    ptt_max = int(ptt_range[1] * fs)
+    width = ptt_max - ptt_min
+
+    starts = ecg_peaks + ptt_min
+    starts = starts[(ecg_peaks + ptt_max < len(ppg)) & (starts >= 0)]
+    if len(starts) == 0 or width <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    windows = sliding_window_view(ppg, width)[starts]  # (n_batimentos, width)
+    return starts + np.argmax(windows, axis=1)
+
+
+def dilate_labels(peaks, length, radius=DEFAULT_LABEL_RADIUS, dtype=np.float64):
+    """Array binário com 1 em ±`radius` amostras de cada pico."""
+    labels = np.zeros(length, dtype=dtype)
+    idx = (np.asarray(peaks, dtype=np.int64)[:, None] + np.arange(-radius, radius + 1)).ravel()
+    labels[idx[(idx >= 0) & (idx < length)]] = 1
+    return labels
+
+
+def create_labels_for_subject(subject, ptt_range=DEFAULT_PTT_RANGE,
+                              label_radius=DEFAULT_LABEL_RADIUS, filter_params=None):
+    """
+    Cria labels binários para um sujeito (sem cache).
+    """
+    filter_params = {**DEFAULT_FILTER_PARAMS, **(filter_params or {})}
+    ecg_peaks = detect_ecg_r_peaks(subject['ecg'], subject['fs'], **filter_params)
+    ppg_peaks = transfer_peaks_to_ppg(ecg_peaks, subject['ppg'], subject['fs'], ptt_range)
+    return ppg_peaks, dilate_labels(ppg_peaks, len(subject['ppg']), label_radius)
+
+
+def _fingerprint(array):
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def _key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _r_peaks_worker(ecg, fs, filter_params):
+    return detect_ecg_r_peaks(np.asarray(ecg, dtype=np.float64), fs, **filter_params)
+
+
+def _load(path):
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        return None
+
+
+def _save(path, array):
+    tmp = path + '.tmp.npy'
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def spawn_pool_safe():
+    """
+    True se um pool "spawn" pode ser aberto a partir do `__main__` atual.
+
+    Os workers reimportam o script principal: num script-notebook sem
+    `if __name__ == '__main__'` (ex.: `python 01_peak_detection_training.py`)
+    cada um rodaria o notebook inteiro de novo. Kernels Jupyter/IPython (sem
+    `__file__`) e `python -m <módulo>` são tratados como seguros.
+    """
+    main = sys.modules.get('__main__')
+    return (main is None or not getattr(main, '__file__', None)
+            or getattr(main, '__spec__', None) is not None)
+
+
+@profiled('label')
+def label_all_subjects(subjects, ptt_range=DEFAULT_PTT_RANGE, label_radius=DEFAULT_LABEL_RADIUS,
+                       filter_params=None, cache_dir='.label_cache', n_workers=None, verbose=True):
+    """
+    Cria 'peaks' e 'labels' para todos os sujeitos (altera os dicts no lugar).
+
+    Args:
+        subjects: Lista de dicts com 'id', 'ppg', 'ecg', 'fs'
+        ptt_range: Janela de PTT (s) para a transferência ECG → PPG
+        label_radius: Meia-largura (amostras) da região positiva
+        filter_params: Sobrescreve DEFAULT_FILTER_PARAMS (detecção R)
+        cache_dir: Diretório do cache (None desativa)
+        n_workers: Processos para a detecção R (padrão: os.cpu_count(), ou
+            1 se `spawn_pool_safe()` for falso)
+
+    Returns:
+        subjects
+    """
+    filter_params = {**DEFAULT_FILTER_PARAMS, **(filter_params or {})}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # 1. Picos R (cache por ECG + filtro; faltantes em paralelo)
+    r_keys = [_key('r', s['id'], s['fs'], _fingerprint(s['ecg']), filter_params) for s in subjects]
+    r_peaks = {}
+    missing = []
+    for i, key in enumerate(r_keys):
+        cached = _load(os.path.join(cache_dir, f'rpeaks_{key}.npy')) if cache_dir else None
+        if cached is not None:
+            r_peaks[i] = cached
+        else:
+            missing.append(i)
+
+    if missing:
+        if n_workers is None:
+            n_workers = (os.cpu_count() or 1) if spawn_pool_safe() else 1
+        n_workers = min(n_workers, len(missing))
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context('spawn')) as pool:
+                futures = {
+                    i: pool.submit(_r_peaks_worker, np.asarray(subjects[i]['ecg']), subjects[i]['fs'], filter_params)
+                    for i in missing
+                }
+                for i, future in futures.items():
+                    r_peaks[i] = future.result()
+        else:
+            for i in missing:
+                r_peaks[i] = _r_peaks_worker(subjects[i]['ecg'], subjects[i]['fs'], filter_params)
+        if cache_dir:
+            for i in missing:
+                _save(os.path.join(cache_dir, f'rpeaks_{r_keys[i]}.npy'), r_peaks[i])
+
+    # 2. Transferência para o PPG + labels (barato, vetorizado)
+    hits = 0
+    for i, subj in enumerate(subjects):
+        key = _key('ppg', r_keys[i], _fingerprint(subj['ppg']), list(ptt_range))
+        path = os.path.join(cache_dir, f'ppgpeaks_{key}.npy') if cache_dir else None
+        peaks = _load(path) if path else None
+        if peaks is None:
+            peaks = transfer_peaks_to_ppg(r_peaks[i], subj['ppg'], subj['fs'], ptt_range)
+            if path:
+                _save(path, peaks)
+        else:
+            hits += 1
+        subj['peaks'] = peaks
+        subj['labels'] = dilate_labels(peaks, len(subj['ppg']), label_radius)
+
+    if verbose:
+        print(f"🏷️ Labels: {len(subjects)} sujeitos | picos R calculados: {len(missing)} | "
+              f"cache PPG: {hits}/{len(subjects)}")
+    return subjects
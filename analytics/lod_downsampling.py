@@ -0,0 +1,117 @@
+"""
+Downsampling min/max (nível de detalhe) para o gráfico do anotador.
+
+Para cada sessão é construída, uma única vez, uma pirâmide de min/max: no
+nível k cada bucket cobre 2^k amostras e guarda o índice da amostra mínima e
+da máxima. Para um intervalo visível do eixo x escolhe-se o nível mais fino
+que caiba em `max_points` e retornam-se só os mínimos e máximos daquele
+trecho. Picos e vales continuam visíveis em qualquer zoom, e cada resposta
+ao navegador tem alguns milhares de pontos em vez do sinal inteiro.
+
+As pirâmides ficam em cache no servidor (`LODCache`), por sessão.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MinMaxPyramid:
+    """
+    Pirâmide de índices de mínimo/máximo de um sinal 1D.
+
+    Args:
+        signal: Sinal (não é copiado)
+        min_buckets: Para de reduzir quando o nível tem até este número de buckets
+    """
+
+    def __init__(self, signal, min_buckets=256):
+        self.signal = np.asarray(signal)
+        self.levels = []  # [(bucket, idx_min, idx_max)], bucket = 2, 4, 8, ...
+
+        idx_min = idx_max = np.arange(len(self.signal), dtype=np.int64)
+        bucket = 1
+        while len(idx_min) > min_buckets:
+            idx_min = self._reduce(idx_min, np.less_equal)
+            idx_max = self._reduce(idx_max, np.greater_equal)
+            bucket *= 2
+            self.levels.append((bucket, idx_min, idx_max))
+
+    def _reduce(self, idx, keep_first):
+        """Combina buckets vizinhos dois a dois."""
+        if len(idx) % 2:
+            idx = np.append(idx, idx[-1])
+        a, b = idx[0::2], idx[1::2]
+        return np.where(keep_first(self.signal[a], self.signal[b]), a, b)
+
+    def query(self, start, end, max_points=2000):
+        """
+        Índices das amostras a desenhar no intervalo [start, end).
+
+        Returns:
+            Array ordenado de índices (no máximo ~max_points)
+        """
+        n = len(self.signal)
+        start = int(max(0, start))
+        end = int(min(n, end))
+        if end <= start:
+            return np.zeros(0, dtype=np.int64)
+
+        span = end - start
+        if span <= max_points:
+            return np.arange(start, end, dtype=np.int64)
+
+        for bucket, idx_min, idx_max in self.levels:
+            if 2 * span / bucket <= max_points or bucket == self.levels[-1][0]:
+                b0 = start // bucket
+                b1 = -(-end // bucket)
+                idx = np.concatenate([idx_min[b0:b1], idx_max[b0:b1]])
+                return np.unique(idx)
+
+        return np.arange(start, end, dtype=np.int64)
+
+
+class LODCache:
+    """
+    Cache (LRU, por número de sessões) de sinal + pirâmide no servidor.
+    """
+
+    def __init__(self, max_sessions=8):
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+
+    def put(self, session_id, signal):
+        entry = {'signal': np.asarray(signal), 'pyramid': MinMaxPyramid(signal)}
+        self._entries[session_id] = entry
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, session_id):
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            self._entries.move_to_end(session_id)
+        return entry
+
+    def __contains__(self, session_id):
+        return session_id in self._entries
+
+
+def x_range_from_relayout(relayout_data):
+    """
+    Extrai o intervalo do eixo x de um `relayoutData` do Plotly.
+
+    Returns:
+        (x0, x1), 'auto' (autorange / duplo clique) ou None (evento sem eixo x)
+    """
+    if not relayout_data:
+        return None
+    if relayout_data.get('xaxis.autorange'):
+        return 'auto'
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return float(relayout_data['xaxis.range[0]']), float(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        x0, x1 = relayout_data['xaxis.range']
+        return float(x0), float(x1)
+    return None
@@ -0,0 +1,375 @@
+"""
+Validação Leave-One-Subject-Out (LOSO) paralela do PPGPeakPerformer.
+
+Cada fold treina um modelo do zero em um processo separado (pool de CPU):
+- Número de threads do torch limitado por processo (evita oversubscription)
+- Sinais dos sujeitos compartilhados via memória compartilhada (somente leitura)
+- Checkpoints por fold: folds concluídos são pulados e folds interrompidos
+  retomam da última época salva
+
+O pool usa "spawn": os workers reimportam o `__main__`. A partir de um
+script sem guarda (ex.: `python 01_peak_detection_training.py`) use a CLI,
+que carrega e rotula os sujeitos no próprio processo:
+
+Uso:
+    python -m loso_runner --bidmc-dir datasets/BIDMC --threads-per-worker 2
+    results = run_loso_cli(MIMIC_DIR, 'loso_checkpoints', threads_per_worker=2)  # notebook
+
+    from loso_runner import run_loso   # só sob `if __name__ == '__main__'` ou no Jupyter
+    results = run_loso(subjects, 'loso_checkpoints', n_workers=8, threads_per_worker=2)
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from peak_evaluation import (DEFAULT_TOLERANCE_MS, evaluate_peaks, peaks_from_labels,
+                             peaks_from_probs, summarize_peak_metrics)
+
+WINDOW_SIZE = 500
+FS = 125
+
+DEFAULT_MODEL_CONFIG = {
+    'window_size': WINDOW_SIZE,
+    'd_model': 64,
+    'n_heads': 4,
+    'n_layers': 4,
+    'dropout': 0.1,
+}
+
+# Estado de cada processo de trabalho (preenchido por _init_worker)
+_worker_shm = None
+_worker_subjects = None
+
+
+def pack_subjects(subjects):
+    """
+    Copia PPG e labels de todos os sujeitos para um único bloco de memória
+    compartilhada (float32).
+
+    Returns:
+        shm: SharedMemory (o chamador é responsável por close/unlink)
+        layout: Lista de (id, offset, length) de cada sujeito
+    """
+    lengths = [len(s['ppg']) for s in subjects]
+    total = int(sum(lengths))
+    shm = SharedMemory(create=True, size=max(2 * total * 4, 1))
+    buf = np.ndarray((2, total), dtype=np.float32, buffer=shm.buf)
+
+    layout = []
+    offset = 0
+    for subj, n in zip(subjects, lengths):
+        buf[0, offset:offset + n] = subj['ppg']
+        buf[1, offset:offset + n] = subj['labels']
+        layout.append((subj['id'], offset, n))
+        offset += n
+
+    return shm, layout
+
+
+def attach_subjects(shm, layout):
+    """Reconstrói a lista de sujeitos como views somente leitura do bloco."""
+    total = sum(n for _, _, n in layout)
+    buf = np.ndarray((2, total), dtype=np.float32, buffer=shm.buf)
+    buf.flags.writeable = False
+
+    return [
+        {'id': subject_id, 'ppg': buf[0, offset:offset + n], 'labels': buf[1, offset:offset + n]}
+        for subject_id, offset, n in layout
+    ]
+
+
+def _init_worker(shm_name, layout, n_threads):
+    global _worker_shm, _worker_subjects
+    import torch
+
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+
+    _worker_shm = SharedMemory(name=shm_name)
+    _worker_subjects = attach_subjects(_worker_shm, layout)
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def fold_dir(checkpoint_dir, test_subject_id):
+    return os.path.join(checkpoint_dir, f'fold_{test_subject_id}')
+
+
+def load_fold_result(checkpoint_dir, test_subject_id):
+    """Resultado de um fold já concluído, ou None."""
+    path = os.path.join(fold_dir(checkpoint_dir, test_subject_id), 'result.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def evaluate_fold(model, X_test, y_test, subject, window_size=WINDOW_SIZE, fs=FS,
+                  batch_size=256, tolerance_ms=DEFAULT_TOLERANCE_MS):
+    """
+    Loss BCE nas janelas do sujeito de teste e métricas por batimento no
+    sinal inteiro dele (predict_signal → find_peaks vs picos dos labels).
+
+    Returns:
+        Dict com 'test_loss' e as chaves de `peak_evaluation.evaluate_peaks`
+        com prefixo 'test_' (test_sensitivity, test_ppv, test_f1, ...)
+    """
+    import torch
+    import torch.nn.functional as F
+    from inference import predict_signal
+
+    model.eval()
+    total_loss = 0.0
+    with torch.no_grad():
+        for start in range(0, len(X_test), batch_size):
+            X_b = torch.from_numpy(np.ascontiguousarray(X_test[start:start + batch_size]))
+            y_b = torch.from_numpy(np.ascontiguousarray(y_test[start:start + batch_size]))
+            total_loss += F.binary_cross_entropy(model(X_b), y_b, reduction='sum').item()
+
+    probs = predict_signal(model, subject['ppg'], window_size, batch_size=batch_size)
+    beats = evaluate_peaks(peaks_from_probs(probs, fs), peaks_from_labels(subject['labels']),
+                           fs, tolerance_ms)
+    return {
+        'test_loss': total_loss / max(y_test.size, 1),
+        **{f'test_{k}': float(v) for k, v in beats.items()},
+    }
+
+
+def loso_summary(df):
+    """Métricas por batimento acumuladas sobre todos os folds (`summarize_peak_metrics`)."""
+    cols = [c for c in df.columns if c.startswith('test_') and c != 'test_loss']
+    if 'test_tp' not in cols:
+        return None
+    rows = df[cols].rename(columns=lambda c: c[len('test_'):]).to_dict('records')
+    return summarize_peak_metrics(rows)
+
+
+def _run_fold(test_subject_id, checkpoint_dir, train_kwargs, model_config, val_fraction, seed):
+    import torch
+    from performer import PPGPeakPerformer, train_performer
+    from windowing import prepare_dataset_loso
+
+    t0 = time.time()
+    out_dir = fold_dir(checkpoint_dir, test_subject_id)
+    os.makedirs(out_dir, exist_ok=True)
+
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+
+    window_size = model_config['window_size']
+    X_train, y_train, X_test, y_test = prepare_dataset_loso(
+        _worker_subjects, test_subject_id, window_size, window_size // 2
+    )
+
+    # Validação (seleção do melhor modelo) sai do treino, nunca do sujeito de teste
+    perm = rng.permutation(len(X_train))
+    n_val = max(1, int(len(X_train) * val_fraction))
+    val_idx, train_idx = perm[:n_val], perm[n_val:]
+
+    model = PPGPeakPerformer(**model_config)
+    history = train_performer(
+        model, X_train[train_idx], y_train[train_idx], X_train[val_idx], y_train[val_idx],
+        checkpoint_path=os.path.join(out_dir, 'best.pth'),
+        resume_path=os.path.join(out_dir, 'state.pth'),
+        device=torch.device('cpu'),
+        verbose=False,
+        **train_kwargs
+    )
+
+    result = {
+        'subject_id': test_subject_id,
+        'n_train_windows': int(len(train_idx)),
+        'n_test_windows': int(len(X_test)),
+        'best_val_loss': float(min(history['val_loss'])),
+        'epochs': len(history['val_loss']),
+        'elapsed_s': time.time() - t0,
+    }
+    if len(X_test) > 0:
+        test_subject = next(s for s in _worker_subjects if s['id'] == test_subject_id)
+        result.update(evaluate_fold(model, X_test, y_test, test_subject, window_size))
+
+    _write_json(os.path.join(out_dir, 'history.json'),
+                {k: [float(v) for v in vals] for k, vals in history.items()})
+    _write_json(os.path.join(out_dir, 'result.json'), result)
+
+    # O estado de retomada não é mais necessário depois do fold concluído
+    state_path = os.path.join(out_dir, 'state.pth')
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+    return result
+
+
+def run_loso(subjects, checkpoint_dir, n_workers=None, threads_per_worker=1,
+             epochs=50, batch_size=64, lr=1e-3, model_config=None,
+             subject_ids=None, val_fraction=0.15, seed=42):
+    """
+    Executa a validação LOSO completa em um pool de processos.
+
+    Args:
+        subjects: Lista de sujeitos com 'id', 'ppg' e 'labels'
+        checkpoint_dir: Diretório dos checkpoints/resultados por fold
+        n_workers: Processos paralelos (padrão: n_cpus // threads_per_worker)
+        threads_per_worker: Threads do torch em cada processo
+        subject_ids: Subconjunto de sujeitos de teste (padrão: todos)
+
+    Returns:
+        DataFrame com uma linha por fold (agregado por batimento em
+        `df.attrs['summary']`, ver `loso_summary`)
+    """
+    model_config = {**DEFAULT_MODEL_CONFIG, **(model_config or {})}
+    train_kwargs = {'epochs': epochs, 'batch_size': batch_size, 'lr': lr}
+
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    subject_ids = [s['id'] for s in subjects] if subject_ids is None else list(subject_ids)
+
+    results = {}
+    pending = []
+    for subject_id in subject_ids:
+        result = load_fold_result(checkpoint_dir, subject_id)
+        if result is not None:
+            results[subject_id] = result
+        else:
+            pending.append(subject_id)
+
+    print(f"🧪 LOSO: {len(subject_ids)} folds | ✅ {len(results)} concluídos | "
+          f"⏳ {len(pending)} pendentes | {n_workers} processos x {threads_per_worker} threads")
+
+    if pending:
+        shm, layout = pack_subjects(subjects)
+        try:
+            # spawn: evita herdar o pool de threads do torch via fork
+            with ProcessPoolExecutor(
+                max_workers=min(n_workers, len(pending)),
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(shm.name, layout, threads_per_worker),
+            ) as pool:
+                futures = {
+                    pool.submit(_run_fold, subject_id, checkpoint_dir, train_kwargs,
+                                model_config, val_fraction, seed): subject_id
+                    for subject_id in pending
+                }
+                for future in as_completed(futures):
+                    subject_id = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Fold {subject_id} falhou: {e}")
+                        continue
+                    results[subject_id] = result
+                    print(f"   Fold {subject_id} | F1: {result.get('test_f1', float('nan')):.4f} | "
+                          f"{result['elapsed_s']:.0f}s | {len(results)}/{len(subject_ids)}")
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return _results_frame([results[s] for s in subject_ids if s in results])
+
+
+def _results_frame(rows, verbose=True):
+    df = pd.DataFrame(rows)
+    summary = loso_summary(df)
+    if summary is not None:
+        df.attrs['summary'] = summary
+        if verbose:
+            print(f"📊 F1 LOSO: {df['test_f1'].mean():.4f} ± {df['test_f1'].std():.4f} por fold | "
+                  f"Se {summary['sensitivity']:.4f} | PPV {summary['ppv']:.4f} | "
+                  f"erro {summary['timing_mae_ms']:.1f} ms | RR {summary['rr_mae_ms']:.1f} ms")
+    return df
+
+
+def load_loso_results(checkpoint_dir, subject_ids=None, verbose=True):
+    """Resultados dos folds já concluídos em `checkpoint_dir` (mesmo formato de `run_loso`)."""
+    if subject_ids is None:
+        subject_ids = sorted(d[len('fold_'):] for d in os.listdir(checkpoint_dir) if d.startswith('fold_'))
+    results = [load_fold_result(checkpoint_dir, s) for s in subject_ids]
+    return _results_frame([r for r in results if r is not None], verbose)
+
+
+def run_loso_cli(bidmc_dir, checkpoint_dir, **kwargs):
+    """
+    Roda `python -m loso_runner` num processo separado e lê os resultados.
+
+    Para notebooks e scripts sem guarda de `__main__`: os workers "spawn"
+    reimportam só o loso_runner, não o notebook. A saída da CLI é repassada
+    linha a linha.
+
+    Args:
+        **kwargs: Opções da CLI (ex.: threads_per_worker=2, epochs=50,
+            subject_ids=['01', '02'], ptt_range=(0.15, 0.35))
+
+    Returns:
+        DataFrame de `load_loso_results`
+    """
+    cmd = [sys.executable, '-m', 'loso_runner', '--bidmc-dir', bidmc_dir,
+           '--checkpoint-dir', checkpoint_dir]
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        cmd += [f"--{key.replace('_', '-')}", *map(str, values)]
+
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')]))}
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                          env=env) as proc:
+        for line in proc.stdout:
+            print(line, end='')
+    if proc.returncode != 0:
+        raise RuntimeError(f"loso_runner terminou com código {proc.returncode}")
+    return load_loso_results(checkpoint_dir, kwargs.get('subject_ids'), verbose=False)
+
+
+def main():
+    from bidmc_cache import load_all_subjects_cached
+    from labeling import DEFAULT_LABEL_RADIUS, DEFAULT_PTT_RANGE, label_all_subjects
+
+    parser = argparse.ArgumentParser(description="Validação LOSO paralela do PPGPeakPerformer")
+    parser.add_argument('--bidmc-dir', required=True, help="Diretório dos CSVs do BIDMC")
+    parser.add_argument('--checkpoint-dir', default='loso_checkpoints')
+    parser.add_argument('--label-cache', default=None,
+                        help="Cache dos labels (padrão: <bidmc-dir>/.label_cache)")
+    parser.add_argument('--ptt-range', type=float, nargs=2, default=DEFAULT_PTT_RANGE)
+    parser.add_argument('--label-radius', type=int, default=DEFAULT_LABEL_RADIUS)
+    parser.add_argument('--n-workers', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--subject-ids', nargs='+', default=None, help="Sujeitos de teste (padrão: todos)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    subjects = load_all_subjects_cached(args.bidmc_dir)
+    label_all_subjects(subjects, ptt_range=tuple(args.ptt_range), label_radius=args.label_radius,
+                       cache_dir=args.label_cache or os.path.join(args.bidmc_dir, '.label_cache'))
+    df = run_loso(subjects, args.checkpoint_dir, n_workers=args.n_workers,
+                  threads_per_worker=args.threads_per_worker, epochs=args.epochs,
+                  batch_size=args.batch_size, lr=args.lr, subject_ids=args.subject_ids,
+                  seed=args.seed)
+    path = os.path.join(args.checkpoint_dir, 'loso_results.csv')
+    df.to_csv(path, index=False)
+    print(f"💾 Resultados: {path}")
+
+
+if __name__ == '__main__':
+    main()
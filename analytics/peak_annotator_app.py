@@ -10,17 +10,21 @@ Botões: Salvar, Marcar como Ruim, Recarregar
 """
 
 import dash
-from dash import dcc, html, callback_context
+from dash import dcc, html, callback_context, Patch
 from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import pandas as pd
 import numpy as np
-from scipy.signal import find_peaks
 from sqlalchemy import create_engine
 import json
-from datetime import datetime
+from bisect import bisect_left
 import os
 
+from annotation_store import AnnotationStore
+from session_repository import SessionRepository
+from lod_downsampling import LODCache, x_range_from_relayout
+from signal_conditioning import detect_peaks_auto, preprocess_ppg
+from profiling import profiled, prometheus_text
+
 # ============== CONFIGURAÇÃO ==============
 USER = 'postgres'
 PASSWORD = '_xs#hiUAWeN6LMK'
@@ -30,10 +34,17 @@ DBNAME = 'postgres'
 
 ANNOTATIONS_DIR = './annotations'
 STATUS_FILE = './annotations/session_status.json'
+ANNOTATIONS_DB = './annotations/annotations.sqlite'
 
 url_conexao = f'postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}'
 engine = create_engine(url_conexao)
 
+# Waveforms são buscados sob demanda (cache LRU de até 256 MB)
+session_repo = SessionRepository(engine, cache_bytes=256 * 1024 * 1024)
+
+# Anotações versionadas por sessão (SQLite, ver annotation_store.py)
+annotation_store = AnnotationStore(ANNOTATIONS_DB)
+
 # ============== FUNÇÕES ==============
 def load_session_status():
     """Carrega status das sessões (anotada/ruim/pendente)"""
@@ -48,6 +59,16 @@ def save_session_status(status_dict):
     with open(STATUS_FILE, 'w') as f:
         json.dump(status_dict, f, indent=2)
 
+def set_session_status(session_id, value):
+    """Atualiza o status em memória e grava no disco"""
+    session_status[session_id] = value
+    save_session_status(session_status)
+
+def refresh_session_status():
+    """Relê o status do disco (botão Recarregar)"""
+    global session_status
+    session_status = load_session_status()
+
 def get_session_label(session_id, status_dict):
     """Retorna emoji de status"""
     status = status_dict.get(session_id, 'pending')
@@ -58,45 +79,15 @@ def get_session_label(session_id, status_dict):
     else:
         return '⏳'
 
-def preprocess_ppg(signal):
-    """Normaliza e inverte o sinal PPG"""
-    signal = np.array(signal)
-    sig_min = np.min(signal)
-    sig_max = np.max(signal)
-    sig_norm = (signal - sig_min) / (sig_max - sig_min)
-    return 1.0 - sig_norm
-
-def detect_peaks_auto(signal, fs, min_hr=40, max_hr=200):
-    """Detecta picos automaticamente"""
-    min_distance = int(fs * 60 / max_hr)
-    peaks, _ = find_peaks(signal, distance=min_distance, height=0.3, prominence=0.1)
-    return peaks.tolist()
-
 def save_annotations(session_id, peaks, signal, sampling_rate):
-    """Salva anotações em CSV"""
-    os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
-    
-    peaks = np.array(peaks)
-    df_annotations = pd.DataFrame({
-        'peak_index': peaks,
-        'peak_time_s': peaks / sampling_rate,
-        'peak_value': signal[peaks]
-    })
-    
-    if len(peaks) > 1:
-        rr_intervals = np.diff(peaks) / sampling_rate * 1000
-        df_annotations['rr_interval_ms'] = np.concatenate([[np.nan], rr_intervals])
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'{ANNOTATIONS_DIR}/peaks_{session_id[:8]}_{timestamp}.csv'
-    df_annotations.to_csv(filename, index=False)
-    
-    return filename
+    """Salva uma nova versão das anotações no AnnotationStore"""
+    peaks = np.array(peaks, dtype=int)
+    return annotation_store.save(session_id, peaks, sampling_rate, peak_values=signal[peaks])
 
 # Carregar sessões e status
 print("📊 Carregando sessões do Supabase...")
-query = "SELECT * FROM hrv_sessions ORDER BY created_at DESC"
-df_sessions = pd.read_sql(query, engine)
+df_sessions = session_repo.list_sessions()  # apenas metadados
+annotation_store.import_csv_dir(ANNOTATIONS_DIR, df_sessions['id'], verbose=False)  # CSVs antigos (uma vez)
 session_status = load_session_status()
 print(f"✅ {len(df_sessions)} sessões encontradas")
 
@@ -116,9 +107,37 @@ current_peaks = []
 current_session = None
 sampling_rate = 757
 
+# Sinais pré-processados + pirâmides min/max ficam no servidor (por sessão);
+# o navegador recebe só os pontos do intervalo visível
+MAX_PLOT_POINTS = 2000
+lod_cache = LODCache(max_sessions=8)
+
+# Picos por sessão: lista ordenada (inserção/remoção com bisect)
+session_peaks = {}
+
+def get_session_signal(session_id):
+    """Sinal pré-processado da sessão (cache no servidor)"""
+    entry = lod_cache.get(session_id)
+    if entry is None:
+        entry = lod_cache.put(session_id, preprocess_ppg(session_repo.get_waveform(session_id)))
+    return entry
+
+def visible_trace(entry, fs, x_range):
+    """
+    Pontos (tempo, valor) do sinal a desenhar: visão geral grosseira da sessão
+    inteira (para o rangeslider) + detalhe no intervalo x_range (segundos)
+    """
+    pyramid = entry['pyramid']
+    n = len(entry['signal'])
+    idx = pyramid.query(0, n, MAX_PLOT_POINTS // 4 if x_range else MAX_PLOT_POINTS)
+    if x_range is not None:
+        start, end = int(x_range[0] * fs), int(np.ceil(x_range[1] * fs)) + 1
+        idx = np.union1d(idx, pyramid.query(start, end, MAX_PLOT_POINTS))
+    return idx / fs, entry['signal'][idx]
+
 def create_dropdown_options():
     """Cria opções do dropdown com status"""
-    status = load_session_status()
+    status = session_status
     options = []
     for i, row in df_sessions.iterrows():
         session_id = str(row['id'])
@@ -181,7 +200,7 @@ app.layout = html.Div([
     
     # Armazenamento de estado
     dcc.Store(id='peaks-store', data=[]),
-    dcc.Store(id='signal-store', data=[]),
+    dcc.Store(id='signal-store', data={}),  # só {'session_id', 'n_samples'}; o sinal fica no servidor
     dcc.Store(id='history-store', data=[]),
     dcc.Store(id='zoom-store', data={}),
 ], style={'fontFamily': 'Arial, sans-serif', 'maxWidth': '1400px', 'margin': '0 auto'})
@@ -192,8 +211,12 @@ app.layout = html.Div([
      Input('bad-btn', 'n_clicks'),
      Input('reload-btn', 'n_clicks')]
 )
+@profiled('annotator.update_stats')
 def update_stats(save_clicks, bad_clicks, reload_clicks):
-    status = load_session_status()
+    ctx = callback_context
+    if ctx.triggered and ctx.triggered[0]['prop_id'].startswith('reload-btn'):
+        refresh_session_status()
+    status = session_status
     done_count = sum(1 for s in status.values() if s == 'done')
     bad_count = sum(1 for s in status.values() if s == 'bad')
     pending_count = len(df_sessions) - done_count - bad_count
@@ -206,6 +229,7 @@ def update_stats(save_clicks, bad_clicks, reload_clicks):
      Input('bad-btn', 'n_clicks'),
      Input('reload-btn', 'n_clicks')]
 )
+@profiled('annotator.update_dropdown')
 def update_dropdown(save_clicks, bad_clicks, reload_clicks):
     return create_dropdown_options()
 
@@ -214,11 +238,12 @@ def update_dropdown(save_clicks, bad_clicks, reload_clicks):
     [Input('next-btn', 'n_clicks')],
     [State('session-dropdown', 'value')]
 )
+@profiled('annotator.next_pending')
 def next_pending(n_clicks, current_value):
     if n_clicks == 0:
         return current_value
     
-    status = load_session_status()
+    status = session_status
     
     # Encontrar próxima pendente após a atual
     for i in range(current_value + 1, len(df_sessions)):
@@ -234,18 +259,93 @@ def next_pending(n_clicks, current_value):
     
     return current_value
 
+def toggle_peak(peaks, click_sample, signal, fs):
+    """
+    Remove o pico mais próximo do clique (< 100 ms) ou adiciona o máximo
+    local (± 50 ms). `peaks` é uma lista ordenada, alterada no lugar.
+    """
+    i = bisect_left(peaks, click_sample)
+    neighbors = [j for j in (i - 1, i) if 0 <= j < len(peaks)]
+    if neighbors:
+        closest = min(neighbors, key=lambda j: abs(peaks[j] - click_sample))
+        if abs(peaks[closest] - click_sample) < fs * 0.1:  # 100ms - remover
+            del peaks[closest]
+            return
+    
+    # adicionar
+    window = int(fs * 0.05)
+    start = max(0, click_sample - window)
+    end = min(len(signal), click_sample + window)
+    local_max = int(start + np.argmax(signal[start:end]))
+    
+    k = bisect_left(peaks, local_max)
+    if k == len(peaks) or peaks[k] != local_max:
+        peaks.insert(k, local_max)
+
+def graph_title(session, n_peaks):
+    label = session_status.get(str(session['id']), 'pendente')
+    return f"Sessão: {session['device_id']} - {session['user_name']} | {n_peaks} picos | Status: {label.upper()}"
+
+def status_text(n_samples, peaks, fs):
+    status = f"📊 {n_samples} amostras | ⏱️ {n_samples/fs:.1f}s | 🎯 {len(peaks)} picos"
+    if len(peaks) > 1:
+        # picos ordenados: RR médio = (último - primeiro) / (n - 1)
+        mean_rr = (peaks[-1] - peaks[0]) / (len(peaks) - 1) / fs * 1000
+        status += f" | ❤️ {60000 / mean_rr:.1f} BPM"
+    return status
+
+def build_figure(entry, peaks, fs, session, x_range):
+    """Figura completa (apenas ao carregar uma sessão)"""
+    sig_arr = entry['signal']
+    peaks_arr = np.array(peaks, dtype=int)
+    time, values = visible_trace(entry, fs, x_range)
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scattergl(
+        x=time,
+        y=values,
+        mode='lines',
+        name='PPG',
+        line=dict(color='green', width=1)
+    ))
+    
+    # Trace de picos sempre presente (índice 1), mesmo vazio, para os patches
+    fig.add_trace(go.Scatter(
+        x=peaks_arr / fs,
+        y=sig_arr[peaks_arr],
+        mode='markers',
+        name='Picos',
+        marker=dict(color='red', size=10, symbol='triangle-down')
+    ))
+    
+    fig.update_layout(
+        title=graph_title(session, len(peaks)),
+        xaxis_title='Tempo (s)',
+        yaxis_title='Amplitude',
+        hovermode='x unified',
+        xaxis=dict(rangeslider=dict(visible=True)),
+        # uirevision preserva zoom/pan quando o valor não muda
+        # Muda apenas quando carrega nova sessão
+        uirevision=str(session['id']),
+    )
+    return fig
+
 @app.callback(
     [Output('ppg-graph', 'figure'),
      Output('peaks-store', 'data'),
      Output('signal-store', 'data'),
+     Output('zoom-store', 'data'),
      Output('status-text', 'children')],
     [Input('session-dropdown', 'value'),
      Input('detect-btn', 'n_clicks'),
-     Input('ppg-graph', 'clickData')],
-    [State('peaks-store', 'data'),
-     State('signal-store', 'data')]
+     Input('ppg-graph', 'clickData'),
+     Input('ppg-graph', 'relayoutData')],
+    [State('signal-store', 'data'),
+     State('zoom-store', 'data')]
 )
-def update_graph(session_idx, detect_clicks, click_data, peaks, signal):
+@profiled('annotator.update_graph')
+def update_graph(session_idx, detect_clicks, click_data, relayout_data, signal_info, zoom):
     global current_signal, current_peaks, current_session, sampling_rate
     
     ctx = callback_context
@@ -253,111 +353,64 @@ def update_graph(session_idx, detect_clicks, click_data, peaks, signal):
         trigger = 'session-dropdown'
     else:
         trigger = ctx.triggered[0]['prop_id'].split('.')[0]
+    prop = ctx.triggered[0]['prop_id'].split('.')[-1] if ctx.triggered else ''
     
-    # Determinar se é nova sessão (reset zoom) ou apenas edição (manter zoom)
-    reset_view = False
-    
-    # Carregar nova sessão
-    if trigger == 'session-dropdown' or signal is None or len(signal) == 0:
+    # Carregar nova sessão: figura completa
+    if trigger == 'session-dropdown' or not signal_info:
         session = df_sessions.iloc[session_idx]
         current_session = session
         sampling_rate = session['sampling_rate_hz']
-        signal = preprocess_ppg(session['ir_waveform']).tolist()
-        current_signal = np.array(signal)
-        peaks = detect_peaks_auto(current_signal, sampling_rate)
+        session_id = str(session['id'])
+        entry = get_session_signal(session_id)
+        current_signal = entry['signal']
+        if session_id not in session_peaks:
+            saved = annotation_store.latest_peaks(session_id)
+            session_peaks[session_id] = (saved.tolist() if saved is not None
+                                         else detect_peaks_auto(current_signal, sampling_rate))
+        peaks = session_peaks[session_id]
         current_peaks = peaks
-        reset_view = True  # Nova sessão, resetar zoom
+        signal_info = {'session_id': session_id, 'n_samples': len(current_signal)}
+        
+        fig = build_figure(entry, peaks, sampling_rate, session, None)
+        return fig, peaks, signal_info, {}, status_text(len(current_signal), peaks, sampling_rate)
+    
+    session_id = signal_info['session_id']
+    entry = get_session_signal(session_id)
+    sig_arr = entry['signal']
+    patch = Patch()
+    
+    # Zoom/pan: só reamostrar o trace do sinal no trecho visível
+    if trigger == 'ppg-graph' and prop == 'relayoutData':
+        x_range = x_range_from_relayout(relayout_data)
+        if x_range is None:
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        zoom = {} if x_range == 'auto' else {'x_range': list(x_range)}
+        time, values = visible_trace(entry, sampling_rate, zoom.get('x_range'))
+        patch['data'][0]['x'] = time
+        patch['data'][0]['y'] = values
+        return patch, dash.no_update, dash.no_update, zoom, dash.no_update
+    
+    peaks = session_peaks[session_id]
     
     # Detectar picos
     if trigger == 'detect-btn':
-        peaks = detect_peaks_auto(np.array(signal), sampling_rate)
-        current_peaks = peaks
+        peaks = detect_peaks_auto(sig_arr, sampling_rate)
+        session_peaks[session_id] = peaks
     
     # Adicionar/remover pico por clique
-    if trigger == 'ppg-graph' and click_data:
-        point = click_data['points'][0]
-        click_time = point['x']
-        click_sample = int(click_time * sampling_rate)
-        
-        sig_arr = np.array(signal)
-        peaks_arr = np.array(peaks)
-        
-        if len(peaks_arr) > 0:
-            distances = np.abs(peaks_arr - click_sample)
-            min_dist = np.min(distances)
-            closest_idx = np.argmin(distances)
-            
-            if min_dist < sampling_rate * 0.1:  # 100ms - remover
-                peaks = [p for i, p in enumerate(peaks) if i != closest_idx]
-            else:  # adicionar
-                window = int(sampling_rate * 0.05)
-                start = max(0, click_sample - window)
-                end = min(len(sig_arr), click_sample + window)
-                local_max = start + np.argmax(sig_arr[start:end])
-                
-                if local_max not in peaks:
-                    peaks.append(local_max)
-                    peaks.sort()
-        else:
-            window = int(sampling_rate * 0.05)
-            start = max(0, click_sample - window)
-            end = min(len(sig_arr), click_sample + window)
-            local_max = start + np.argmax(sig_arr[start:end])
-            peaks = [local_max]
-        
-        current_peaks = peaks
+    if trigger == 'ppg-graph' and prop == 'clickData' and click_data:
+        click_time = click_data['points'][0]['x']
+        toggle_peak(peaks, int(click_time * sampling_rate), sig_arr, sampling_rate)
     
-    # Criar gráfico
-    sig_arr = np.array(signal)
-    peaks_arr = np.array(peaks)
-    time = np.arange(len(sig_arr)) / sampling_rate
+    current_peaks = peaks
     
-    fig = go.Figure()
+    # Atualizar só o trace de picos e o título
+    peaks_arr = np.array(peaks, dtype=int)
+    patch['data'][1]['x'] = peaks_arr / sampling_rate
+    patch['data'][1]['y'] = sig_arr[peaks_arr]
+    patch['layout']['title']['text'] = graph_title(current_session, len(peaks))
     
-    fig.add_trace(go.Scattergl(
-        x=time,
-        y=sig_arr,
-        mode='lines',
-        name='PPG',
-        line=dict(color='green', width=1)
-    ))
-    
-    if len(peaks_arr) > 0:
-        peak_times = peaks_arr / sampling_rate
-        peak_values = sig_arr[peaks_arr]
-        fig.add_trace(go.Scatter(
-            x=peak_times,
-            y=peak_values,
-            mode='markers',
-            name='Picos',
-            marker=dict(color='red', size=10, symbol='triangle-down')
-        ))
-    
-    # Status da sessão
-    session_id = str(current_session['id'])
-    status_dict = load_session_status()
-    session_status_label = status_dict.get(session_id, 'pendente')
-    
-    # uirevision preserva zoom/pan quando o valor não muda
-    # Muda apenas quando carrega nova sessão (reset_view = True)
-    ui_revision = str(session_idx) if reset_view else "keep"
-    
-    fig.update_layout(
-        title=f"Sessão: {current_session['device_id']} - {current_session['user_name']} | {len(peaks)} picos | Status: {session_status_label.upper()}",
-        xaxis_title='Tempo (s)',
-        yaxis_title='Amplitude',
-        hovermode='x unified',
-        xaxis=dict(rangeslider=dict(visible=True)),
-        uirevision=ui_revision,  # Preserva zoom/pan
-    )
-    
-    status = f"📊 {len(signal)} amostras | ⏱️ {len(signal)/sampling_rate:.1f}s | 🎯 {len(peaks)} picos"
-    if len(peaks) > 1:
-        rr = np.diff(peaks_arr) / sampling_rate * 1000
-        hr = 60000 / np.mean(rr)
-        status += f" | ❤️ {hr:.1f} BPM"
-    
-    return fig, peaks, signal, status
+    return patch, peaks, dash.no_update, dash.no_update, status_text(len(sig_arr), peaks, sampling_rate)
 
 @app.callback(
     Output('save-status', 'children'),
@@ -366,7 +419,8 @@ def update_graph(session_idx, detect_clicks, click_data, peaks, signal):
     [State('peaks-store', 'data'),
      State('signal-store', 'data')]
 )
-def save_callback(save_clicks, bad_clicks, peaks, signal):
+@profiled('annotator.save_callback')
+def save_callback(save_clicks, bad_clicks, peaks, signal_info):
     ctx = callback_context
     if not ctx.triggered:
         return ""
@@ -377,26 +431,28 @@ def save_callback(save_clicks, bad_clicks, peaks, signal):
         return "❌ Nenhuma sessão carregada"
     
     session_id = str(current_session['id'])
-    status_dict = load_session_status()
     
     if trigger == 'save-btn' and save_clicks > 0:
-        filename = save_annotations(
+        version = save_annotations(
             session_id,
-            peaks,
-            np.array(signal),
+            session_peaks.get(session_id, peaks),
+            get_session_signal(session_id)['signal'],
             sampling_rate
         )
-        status_dict[session_id] = 'done'
-        save_session_status(status_dict)
-        return f"✅ Salvo em: {filename}"
+        set_session_status(session_id, 'done')
+        return f"✅ Salvo: versão {version} ({ANNOTATIONS_DB})"
     
     elif trigger == 'bad-btn' and bad_clicks > 0:
-        status_dict[session_id] = 'bad'
-        save_session_status(status_dict)
+        set_session_status(session_id, 'bad')
         return f"❌ Sessão marcada como RUIM"
     
     return ""
 
+# Métricas dos callbacks (PPG_PROFILE=1) para o Prometheus
+@app.server.route('/metrics')
+def metrics():
+    return prometheus_text(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("🫀 Anotador de Picos PPG")
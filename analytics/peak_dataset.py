@@ -0,0 +1,175 @@
+"""
+Dataset PyTorch de janelas PPG geradas sob demanda.
+
+Em vez de materializar X/y densos (n_janelas × window_size em float32), o
+dataset guarda só os sinais de cada sujeito (memory-mapped, ver
+`bidmc_cache`), os índices esparsos dos picos e a lista (sujeito, início)
+das janelas. Cada item:
+- fatia o sinal e aplica o Z-score da janela (mesmo critério de
+  `windowing.zscore_windows`)
+- gera o alvo denso marcando ±`label_radius` amostras em torno dos picos que
+  caem na janela (mesmo resultado de `labeling.dilate_labels`)
+
+A memória não cresce com o número de janelas/sessões. Funciona com
+`num_workers` (inclusive com start method 'spawn': arrays memory-mapped são
+reabertos pelo caminho no processo filho em vez de copiados) e `pin_memory`.
+
+Uso:
+    ds = PeakWindowDataset(subjects, window_size=500, stride=250)
+    train_ds, val_ds = split_dataset(ds, val_fraction=0.15)
+    history = train_performer(model, train_ds, None, val_ds, None, num_workers=2)
+
+Recortes de comprimento variável (modelo `length_agnostic`): janelas longas
++ `RandomCropCollate`, que corta cada lote num comprimento sorteado.
+"""
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Subset
+
+from labeling import DEFAULT_LABEL_RADIUS
+from windowing import window_starts, zscore_windows
+
+
+def _memmap_state(array):
+    """Descreve um np.memmap pelo arquivo (para reabrir no processo filho)."""
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return ('memmap', array.filename, int(array.offset), array.dtype.str, array.shape)
+    return ('array', np.asarray(array))
+
+
+def _from_state(state):
+    if state[0] == 'memmap':
+        _, filename, offset, dtype, shape = state
+        return np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape)
+    return state[1]
+
+
+class PeakWindowDataset(Dataset):
+    """
+    Janelas (x, y) geradas sob demanda a partir de sinais e picos esparsos.
+
+    Args:
+        subjects: Lista de dicts com 'id', 'ppg' e 'peaks' (índices ordenados)
+        window_size: Tamanho da janela (amostras)
+        stride: Passo entre janelas (convenção de `windowing.window_starts`)
+        label_radius: Meia-largura da região positiva em torno de cada pico
+        only_with_peaks: Mantém só janelas com pelo menos uma amostra positiva
+            (mesmo filtro de `windowing.create_windows`)
+    """
+
+    def __init__(self, subjects, window_size=500, stride=250,
+                 label_radius=DEFAULT_LABEL_RADIUS, only_with_peaks=True):
+        self.window_size = window_size
+        self.stride = stride
+        self.label_radius = label_radius
+        self.subject_ids = [s['id'] for s in subjects]
+        self.signals = [s['ppg'] for s in subjects]
+        self.peaks = [np.sort(np.asarray(s['peaks'], dtype=np.int64)) for s in subjects]
+
+        subject_idx, starts = [], []
+        for i, (signal, peaks) in enumerate(zip(self.signals, self.peaks)):
+            st = window_starts(len(signal), window_size, stride)
+            if only_with_peaks:
+                lo = np.searchsorted(peaks, st - label_radius, side='left')
+                hi = np.searchsorted(peaks, st + window_size + label_radius, side='left')
+                st = st[hi > lo]
+            subject_idx.append(np.full(len(st), i, dtype=np.int32))
+            starts.append(st)
+
+        self.subject_index = np.concatenate(subject_idx) if subject_idx else np.zeros(0, dtype=np.int32)
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def target(self, subject, start):
+        """Alvo denso (window_size,) a partir dos picos esparsos."""
+        r = self.label_radius
+        peaks = self.peaks[subject]
+        lo = np.searchsorted(peaks, start - r, side='left')
+        hi = np.searchsorted(peaks, start + self.window_size + r, side='left')
+
+        y = np.zeros(self.window_size, dtype=np.float32)
+        idx = (peaks[lo:hi, None] - start + np.arange(-r, r + 1)).ravel()
+        n = len(self.signals[subject])
+        # Mesmo recorte de dilate_labels: fora da janela ou do sinal não marca
+        valid = (idx >= 0) & (idx < self.window_size) & (idx + start < n)
+        y[idx[valid]] = 1
+        return y
+
+    def __getitem__(self, i):
+        subject = int(self.subject_index[i])
+        start = int(self.starts[i])
+        segment = self.signals[subject][start:start + self.window_size]
+        x = zscore_windows(segment[None, :])[0]
+        return torch.from_numpy(x), torch.from_numpy(self.target(subject, start))
+
+    def subject_subset(self, subject_ids, exclude=False):
+        """Subset com as janelas dos sujeitos dados (ou de todos menos eles)."""
+        wanted = np.isin(np.asarray(self.subject_ids)[self.subject_index], list(subject_ids))
+        return Subset(self, np.flatnonzero(~wanted if exclude else wanted).tolist())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['signals'] = [_memmap_state(s) for s in self.signals]
+        return state
+
+    def __setstate__(self, state):
+        state['signals'] = [_from_state(s) for s in state['signals']]
+        self.__dict__.update(state)
+
+
+class RandomCropCollate:
+    """
+    collate_fn que recorta o lote inteiro num comprimento aleatório.
+
+    Cada lote sorteia um comprimento em [min_len, max_len] (múltiplo de
+    `multiple`) e um início por janela; os recortes são normalizados de novo
+    (Z-score do recorte, como na inferência de sessão inteira). Os itens
+    devem ter pelo menos `max_len` amostras (ex.: PeakWindowDataset com
+    window_size=max_len).
+
+    Args:
+        min_len, max_len: Faixa de comprimentos (amostras)
+        multiple: Granularidade dos comprimentos
+        seed: Semente (None = aleatório; cada worker tem o seu gerador)
+    """
+
+    def __init__(self, min_len=250, max_len=2000, multiple=25, seed=None):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.multiple = multiple
+        self.seed = seed
+        self._rng = None
+
+    def __call__(self, batch):
+        if self._rng is None:
+            # Gerador criado no processo que usa o collate (worker ou principal)
+            info = torch.utils.data.get_worker_info()
+            self._rng = np.random.default_rng(
+                None if self.seed is None else self.seed + (info.id if info else 0))
+
+        x = torch.stack([item[0] for item in batch])
+        y = torch.stack([item[1] for item in batch])
+        n = x.shape[1]
+        hi = min(self.max_len, n) // self.multiple
+        lo = min(max(1, self.min_len // self.multiple), hi)
+        length = int(self._rng.integers(lo, hi + 1)) * self.multiple
+
+        starts = torch.from_numpy(self._rng.integers(0, n - length + 1, size=len(batch)))
+        idx = starts[:, None] + torch.arange(length)
+        x = torch.gather(x, 1, idx)
+        y = torch.gather(y, 1, idx)
+
+        mean = x.mean(dim=1, keepdim=True)
+        std = x.std(dim=1, unbiased=False, keepdim=True)
+        return (x - mean) / (std + 1e-8), y
+
+
+def split_dataset(dataset, val_fraction=0.15, seed=42):
+    """Divide as janelas aleatoriamente em treino/validação (Subsets)."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(dataset))
+    n_val = max(1, int(len(dataset) * val_fraction))
+    return Subset(dataset, perm[n_val:].tolist()), Subset(dataset, perm[:n_val].tolist())
@@ -0,0 +1,206 @@
+"""
+Avaliação de picos por batimento (evento), com tolerância em ms.
+
+Cada pico predito é casado com o pico verdadeiro mais próximo via
+`searchsorted` (O(n log n)), no máximo um para um. A partir do casamento:
+sensibilidade (Se), valor preditivo positivo (PPV), F1, erro de instante
+(predito − verdadeiro) e erro dos intervalos RR / HRV.
+
+Serve para qualquer detector: saída do modelo (`peaks_from_probs`),
+`detect_peaks_auto` do anotador contra as anotações manuais
+(`AnnotationStore.load_latest`, ou `load_annotation_peaks` para os CSVs
+antigos) ou janelas de validação (`evaluate_windows`,
+usado a cada época por `performer.train_performer`).
+
+Uso:
+    row = evaluate_peaks(pred_peaks, true_peaks, fs=125)
+    df, summary = evaluate_subjects({s['id']: peaks_from_probs(p, 125) ...}, subjects)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks
+
+from hrv import rr_from_peaks, time_domain
+
+DEFAULT_TOLERANCE_MS = 50
+DEFAULT_MIN_DISTANCE_S = 0.4  # FC máxima de 150 bpm (mesmo de find_peaks no notebook)
+
+
+def peaks_from_probs(probs, fs, threshold=0.5, min_distance_s=DEFAULT_MIN_DISTANCE_S):
+    """Picos das probabilidades do modelo (find_peaks com altura e distância mínima)."""
+    peaks, _ = find_peaks(probs, height=threshold, distance=max(1, int(min_distance_s * fs)))
+    return peaks
+
+
+def peaks_from_labels(labels):
+    """Centro de cada trecho positivo de labels dilatados (inverso de `dilate_labels`)."""
+    edges = np.diff(np.concatenate([[0], (np.asarray(labels) > 0.5).astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return (starts + ends - 1) // 2
+
+
+def load_annotation_peaks(path):
+    """Índices dos picos de um CSV de anotação antigo (antes do AnnotationStore)."""
+    return np.sort(pd.read_csv(path)['peak_index'].to_numpy(dtype=np.int64))
+
+
+def match_peaks(pred, true, tolerance):
+    """
+    Casa picos preditos e verdadeiros (um para um) a até `tolerance` amostras.
+
+    Cada predito vai para o verdadeiro mais próximo; se vários disputam o
+    mesmo verdadeiro, fica o mais próximo. Com tolerância menor que meio
+    intervalo RR (ex.: 50 ms), é o casamento ótimo.
+
+    Args:
+        pred, true: Índices de picos ordenados
+
+    Returns:
+        (pred_idx, true_idx): posições casadas em `pred` e `true`, em ordem
+    """
+    pred = np.asarray(pred, dtype=np.int64)
+    true = np.asarray(true, dtype=np.int64)
+    if len(pred) == 0 or len(true) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    right = np.searchsorted(true, pred)
+    left = right - 1
+    dist_left = np.where(left >= 0, pred - true[np.clip(left, 0, None)], np.iinfo(np.int64).max)
+    dist_right = np.where(right < len(true), true[np.clip(right, None, len(true) - 1)] - pred,
+                          np.iinfo(np.int64).max)
+    nearest = np.where(dist_left <= dist_right, left, right)
+    dist = np.minimum(dist_left, dist_right)
+
+    ok = dist <= tolerance
+    pred_idx, true_idx, dist = np.flatnonzero(ok), nearest[ok], dist[ok]
+    if len(pred_idx) == 0:
+        return pred_idx, true_idx
+    order = np.lexsort((dist, true_idx))
+    pred_idx, true_idx = pred_idx[order], true_idx[order]
+    first = np.concatenate([[True], true_idx[1:] != true_idx[:-1]])
+    return pred_idx[first], true_idx[first]
+
+
+def evaluate_peaks(pred, true, fs, tolerance_ms=DEFAULT_TOLERANCE_MS, rr=True):
+    """
+    Métricas por batimento de um registro.
+
+    Args:
+        pred, true: Índices dos picos predito / verdadeiro (amostras)
+        fs: Frequência de amostragem (Hz)
+        tolerance_ms: Distância máxima para um predito contar como acerto
+        rr: Calcula também erro de RR e de HRV (desligue para trechos
+            não contíguos, ex.: janelas concatenadas)
+
+    Returns:
+        Dict com 'n_true', 'n_pred', 'tp', 'fp', 'fn', 'sensitivity', 'ppv',
+        'f1', 'timing_error_ms' (média com sinal), 'timing_mae_ms',
+        'timing_std_ms' e, com rr: 'n_rr', 'rr_mae_ms', 'hr_error_bpm',
+        'sdnn_error_ms', 'rmssd_error_ms' (predito − verdadeiro)
+    """
+    pred = np.sort(np.asarray(pred, dtype=np.int64))
+    true = np.sort(np.asarray(true, dtype=np.int64))
+    pred_idx, true_idx = match_peaks(pred, true, tolerance_ms * fs / 1000)
+
+    tp = len(pred_idx)
+    row = {
+        'n_true': len(true), 'n_pred': len(pred),
+        'tp': tp, 'fp': len(pred) - tp, 'fn': len(true) - tp,
+        'sensitivity': tp / len(true) if len(true) else np.nan,
+        'ppv': tp / len(pred) if len(pred) else np.nan,
+        'f1': 2 * tp / (len(pred) + len(true)) if len(pred) + len(true) else np.nan,
+    }
+    errors = (pred[pred_idx] - true[true_idx]) / fs * 1000
+    row['timing_error_ms'] = errors.mean() if tp else np.nan
+    row['timing_mae_ms'] = np.abs(errors).mean() if tp else np.nan
+    row['timing_std_ms'] = errors.std() if tp else np.nan
+
+    if rr:
+        # RR de batimentos verdadeiros consecutivos casados com preditos consecutivos
+        both = (np.diff(true_idx) == 1) & (np.diff(pred_idx) == 1)
+        rr_true = np.diff(true[true_idx])[both]
+        rr_pred = np.diff(pred[pred_idx])[both]
+        row['n_rr'] = int(both.sum())
+        row['rr_mae_ms'] = np.abs(rr_pred - rr_true).mean() / fs * 1000 if both.any() else np.nan
+
+        # HRV de cada série inteira (predita × verdadeira), como um detector reportaria
+        stats = time_domain(*rr_from_peaks([pred, true], fs))
+        row['hr_error_bpm'] = stats['hr_mean_bpm'][0] - stats['hr_mean_bpm'][1]
+        row['sdnn_error_ms'] = stats['sdnn_ms'][0] - stats['sdnn_ms'][1]
+        row['rmssd_error_ms'] = stats['rmssd_ms'][0] - stats['rmssd_ms'][1]
+    return row
+
+
+def evaluate_windows(probs, labels, fs, threshold=0.5, tolerance_ms=DEFAULT_TOLERANCE_MS,
+                     min_distance_s=DEFAULT_MIN_DISTANCE_S):
+    """
+    `evaluate_peaks` num lote de janelas (n, window_size) de uma vez.
+
+    As janelas são concatenadas com um intervalo de zeros maior que a
+    distância mínima e a tolerância, para nenhum pico ou casamento cruzar de
+    uma janela para outra. Os picos verdadeiros são os centros dos trechos
+    positivos de `labels` (só aproximados nas bordas das janelas).
+    """
+    probs = np.asarray(probs, dtype=np.float32)
+    labels = np.asarray(labels)
+    gap = int(max(min_distance_s, tolerance_ms / 1000) * fs) + 1
+    pad = ((0, 0), (gap, gap))
+    pred = peaks_from_probs(np.pad(probs, pad).ravel(), fs, threshold, min_distance_s)
+    true = peaks_from_labels(np.pad(labels, pad).ravel())
+    return evaluate_peaks(pred, true, fs, tolerance_ms, rr=False)
+
+
+def summarize_peak_metrics(rows):
+    """
+    Agregado de várias linhas de `evaluate_peaks` (sujeitos, lotes ou folds).
+
+    Se/PPV/F1 e erros de instante/RR são acumulados sobre todos os
+    batimentos; 'f1_subject_mean/std' e os erros de HRV em módulo são
+    médias por linha.
+    """
+    df = pd.DataFrame(rows)
+    tp, n_pred, n_true = df['tp'].sum(), df['n_pred'].sum(), df['n_true'].sum()
+    summary = {
+        'n_true': int(n_true), 'n_pred': int(n_pred), 'tp': int(tp),
+        'fp': int(n_pred - tp), 'fn': int(n_true - tp),
+        'sensitivity': tp / n_true if n_true else np.nan,
+        'ppv': tp / n_pred if n_pred else np.nan,
+        'f1': 2 * tp / (n_pred + n_true) if n_pred + n_true else np.nan,
+        'f1_subject_mean': df['f1'].mean(),
+        'f1_subject_std': df['f1'].std(),
+    }
+    weights = df['tp'].where(df['timing_mae_ms'].notna(), 0)
+    for key in ('timing_error_ms', 'timing_mae_ms'):
+        summary[key] = (df[key].fillna(0) * weights).sum() / weights.sum() if weights.sum() else np.nan
+
+    if 'n_rr' in df:
+        w = df['n_rr'].where(df['rr_mae_ms'].notna(), 0)
+        summary['rr_mae_ms'] = (df['rr_mae_ms'].fillna(0) * w).sum() / w.sum() if w.sum() else np.nan
+        for key in ('hr_error_bpm', 'sdnn_error_ms', 'rmssd_error_ms'):
+            summary[key.replace('_error', '_abs_error')] = df[key].abs().mean()
+    return summary
+
+
+def evaluate_subjects(pred_peaks, subjects, fs=125, tolerance_ms=DEFAULT_TOLERANCE_MS,
+                      verbose=True):
+    """
+    Avaliação por sujeito + agregado.
+
+    Args:
+        pred_peaks: Dict id do sujeito → picos preditos
+        subjects: Sujeitos com 'id' e 'peaks' (verdade)
+
+    Returns:
+        (DataFrame com uma linha por sujeito, dict de `summarize_peak_metrics`)
+    """
+    rows = [{'subject_id': s['id'], **evaluate_peaks(pred_peaks[s['id']], s['peaks'], fs, tolerance_ms)}
+            for s in subjects if s['id'] in pred_peaks]
+    df = pd.DataFrame(rows)
+    summary = summarize_peak_metrics(rows)
+    if verbose:
+        print(f"💓 {len(rows)} sujeitos | Se {summary['sensitivity']:.3f} | PPV {summary['ppv']:.3f} | "
+              f"F1 {summary['f1']:.3f} | erro {summary['timing_mae_ms']:.1f} ms | "
+              f"RR {summary['rr_mae_ms']:.1f} ms")
+    return df, summary
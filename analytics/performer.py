@@ -0,0 +1,800 @@
+"""
+Modelo Performer para detecção de picos em PPG.
+
+Extraído do notebook 01_peak_detection_training.py para poder ser importado
+por processos de trabalho (validação LOSO paralela) e por outros scripts.
+"""
+
+import contextlib
+import math
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from scipy.signal import lfilter
+from torch.utils.data import DataLoader, Dataset, TensorDataset
+
+import profiling
+from peak_evaluation import DEFAULT_TOLERANCE_MS, evaluate_windows, summarize_peak_metrics
+
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+class PositionalEncoding(nn.Module):
+    """
+    Codificação posicional sinusoidal.
+
+    Com `extendable=True` a tabela é calculada para o comprimento de cada
+    entrada (sem limite de `max_len`, inclusive no grafo ONNX) e, no treino,
+    as posições começam num deslocamento aleatório em [0, `max_offset`): o
+    modelo não aprende onde a janela começa, só distâncias relativas, e
+    roda em sequências de qualquer comprimento (sessão inteira).
+    """
+    
+    def __init__(self, d_model, max_len=1000, extendable=False, max_offset=16384):
+        super().__init__()
+        self.extendable = extendable
+        self.max_offset = max_offset
+        pe = torch.zeros(max_len, d_model)
+        position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
+        div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
+        pe[:, 0::2] = torch.sin(position * div_term)
+        pe[:, 1::2] = torch.cos(position * div_term)
+        self.register_buffer('pe', pe.unsqueeze(0))
+        self.register_buffer('div_term', div_term, persistent=False)
+    
+    def forward(self, x):
+        if not self.extendable:
+            return x + self.pe[:, :x.size(1)]
+
+        position = torch.arange(x.size(1), device=x.device, dtype=torch.float)
+        if self.training:
+            position = position + torch.randint(0, self.max_offset, (1,), device=x.device)
+        angle = position.unsqueeze(1) * self.div_term  # (seq, d_model/2)
+        # Intercalado sin/cos como na tabela fixa
+        pe = torch.stack([torch.sin(angle), torch.cos(angle)], dim=-1).flatten(1)
+        return x + pe.unsqueeze(0).to(x.dtype)
+
+
+class CausalConv1d(nn.Conv1d):
+    """
+    Conv1d causal: só amostras passadas (padding à esquerda).
+
+    Os parâmetros têm os mesmos nomes/formatos de nn.Conv1d. No modo stream
+    o estado são as últimas `kernel_size - 1` amostras de entrada.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size):
+        super().__init__(in_channels, out_channels, kernel_size, padding=0)
+        self.context = kernel_size - 1
+
+    def forward(self, x):
+        return super().forward(F.pad(x, (self.context, 0)))
+
+    def stream(self, x, cache):
+        """Processa um bloco (batch, canais, n); retorna (saída, novo cache)."""
+        if cache is None:
+            cache = x.new_zeros(x.shape[0], x.shape[1], self.context)
+        x = torch.cat([cache, x], dim=-1)
+        return super().forward(x), x[..., x.shape[-1] - self.context:]
+
+
+def _conv(in_channels, out_channels, kernel_size, causal):
+    if causal:
+        return CausalConv1d(in_channels, out_channels, kernel_size)
+    return nn.Conv1d(in_channels, out_channels, kernel_size, padding=kernel_size // 2)
+
+
+def _stream_sequential(seq, x, caches):
+    """Roda um nn.Sequential em modo stream (estado só nas CausalConv1d)."""
+    new_caches = []
+    for module, cache in zip(seq, caches):
+        if isinstance(module, CausalConv1d):
+            x, cache = module.stream(x, cache)
+        else:
+            x = module(x)
+        new_caches.append(cache)
+    return x, new_caches
+
+
+class PerformerAttention(nn.Module):
+    """
+    Atenção Linear usando FAVOR+ (aproximação do softmax).
+    
+    Complexidade: O(n) ao invés de O(n²)
+
+    Com `causal=True` a posição t só atende a s ≤ t, com peso decaindo
+    γ^(t−s) (γ = exp(−1/memory)). O estado (kv, k_sum) resume todo o passado,
+    então a mesma atenção roda em blocos (`stream`) com custo constante por
+    amostra; o decaimento mantém o contexto efetivo em ~`memory` amostras
+    também num stream sem fim, igual ao visto no treino.
+    """
+    
+    def __init__(self, d_model, n_heads=4, n_features=64, causal=False, memory=None,
+                 chunk_size=64):
+        super().__init__()
+        self.d_model = d_model
+        self.n_heads = n_heads
+        self.head_dim = d_model // n_heads
+        self.n_features = n_features
+        self.causal = causal
+        self.decay = math.exp(-1.0 / memory) if memory else 1.0
+        self.chunk_size = chunk_size
+        
+        self.q_proj = nn.Linear(d_model, d_model)
+        self.k_proj = nn.Linear(d_model, d_model)
+        self.v_proj = nn.Linear(d_model, d_model)
+        self.out_proj = nn.Linear(d_model, d_model)
+        
+        # Random features para aproximação do kernel
+        self.register_buffer(
+            'random_features',
+            torch.randn(n_heads, self.head_dim, n_features) / math.sqrt(n_features)
+        )
+    
+    def _feature_map(self, x):
+        """Mapa de features positivas para aproximar exp(q·k)."""
+        # x: (batch, heads, seq, head_dim)
+        # random_features: (heads, head_dim, n_features)
+        
+        # Projeção random (matmul com broadcast: (b,h,s,d) @ (h,d,f))
+        x_proj = torch.matmul(x, self.random_features)
+        
+        # Softmax positivo (aproximação)
+        if torch.onnx.is_in_onnx_export():
+            # Softplus do ONNX Runtime é escalar (~20x mais lento que o resto
+            # do grafo); a forma estável relu(x) + log1p(exp(-|x|)) é vetorizada
+            return F.relu(x_proj) + torch.log1p(torch.exp(-x_proj.abs()))
+        return F.softplus(x_proj)
+
+    def _project(self, x):
+        batch, seq_len, _ = x.shape
+        
+        # Projeções Q, K, V
+        q = self.q_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+        k = self.k_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+        v = self.v_proj(x).view(batch, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+        
+        # Feature maps
+        return self._feature_map(q), self._feature_map(k), v  # q', k': (batch, heads, seq, n_features)
+
+    def _output(self, out):
+        # Reshape e projeção final
+        batch, _, seq_len, _ = out.shape
+        out = out.transpose(1, 2).contiguous().view(batch, seq_len, self.d_model)
+        return self.out_proj(out)
+    
+    def forward(self, x):
+        q_prime, k_prime, v = self._project(x)
+        if self.causal:
+            out, _ = self._causal_attention(q_prime, k_prime, v, None)
+            return self._output(out)
+        
+        # Atenção linear: O(n*d*m) onde m = n_features
+        # kv = k_prime^T @ v (matmul em lote: evita as cópias de permute do einsum)
+        kv = torch.matmul(k_prime.transpose(-2, -1), v)  # (batch, heads, n_features, head_dim)
+        
+        # Denominador para normalização
+        k_sum = k_prime.sum(dim=2, keepdim=True)  # (batch, heads, 1, n_features)
+        
+        # Numerador
+        qkv = torch.matmul(q_prime, kv)  # (batch, heads, seq, head_dim)
+        
+        # Denominador por posição
+        denom = torch.matmul(q_prime, k_sum.transpose(-2, -1)) + 1e-8  # (batch, heads, seq, 1)
+        
+        # Output normalizado
+        return self._output(qkv / denom)
+
+    def _causal_attention(self, q_prime, k_prime, v, state):
+        """
+        Atenção linear causal em blocos de `chunk_size` posições.
+
+        Dentro do bloco: produto q'k'ᵀ com máscara triangular de decaimento;
+        entre blocos: estado (kv, k_sum) acumulado e decaído.
+
+        Returns:
+            out (batch, heads, seq, head_dim), estado (kv, k_sum)
+        """
+        batch, heads, seq_len, n_features = q_prime.shape
+        if state is None:
+            kv = q_prime.new_zeros(batch, heads, n_features, self.head_dim)
+            k_sum = q_prime.new_zeros(batch, heads, n_features, 1)
+        else:
+            kv, k_sum = state
+
+        log_decay = math.log(self.decay)
+        outputs = []
+        for start in range(0, seq_len, self.chunk_size):
+            qc = q_prime[:, :, start:start + self.chunk_size]
+            kc = k_prime[:, :, start:start + self.chunk_size]
+            vc = v[:, :, start:start + self.chunk_size]
+            n = qc.shape[2]
+
+            pos = torch.arange(n, device=qc.device, dtype=qc.dtype)
+            lag = pos[:, None] - pos[None, :]
+            mask = torch.where(lag >= 0, torch.exp(lag.clamp(min=0) * log_decay), torch.zeros_like(lag))
+            past = torch.exp((pos + 1) * log_decay)[:, None]  # decaimento do estado até a posição i
+            weights = torch.matmul(qc, kc.transpose(-2, -1)) * mask  # (batch, heads, n, n)
+
+            num = torch.matmul(weights, vc) + torch.matmul(qc, kv) * past
+            denom = weights.sum(dim=-1, keepdim=True) + torch.matmul(qc, k_sum) * past + 1e-8
+            outputs.append(num / denom)
+
+            # Estado ao fim do bloco: cada k_j decaído pela distância até a última posição
+            k_weighted = kc * torch.exp((n - 1 - pos) * log_decay)[:, None]
+            kv = kv * math.exp(n * log_decay) + torch.matmul(k_weighted.transpose(-2, -1), vc)
+            k_sum = k_sum * math.exp(n * log_decay) + k_weighted.sum(dim=2).unsqueeze(-1)
+
+        return torch.cat(outputs, dim=2), (kv, k_sum)
+
+    def stream(self, x, state):
+        """Bloco (batch, n, d_model) com estado; retorna (saída, novo estado)."""
+        q_prime, k_prime, v = self._project(x)
+        out, state = self._causal_attention(q_prime, k_prime, v, state)
+        return self._output(out), state
+
+
+class PerformerBlock(nn.Module):
+    """Bloco Transformer com Performer Attention."""
+    
+    def __init__(self, d_model, n_heads=4, ff_dim=256, dropout=0.1, causal=False, memory=None):
+        super().__init__()
+        self.attention = PerformerAttention(d_model, n_heads, causal=causal, memory=memory)
+        self.norm1 = nn.LayerNorm(d_model)
+        self.norm2 = nn.LayerNorm(d_model)
+        
+        self.ff = nn.Sequential(
+            nn.Linear(d_model, ff_dim),
+            nn.GELU(),
+            nn.Dropout(dropout),
+            nn.Linear(ff_dim, d_model),
+            nn.Dropout(dropout)
+        )
+        self.dropout = nn.Dropout(dropout)
+    
+    def forward(self, x, state=None, stream=False):
+        # Self-attention com residual
+        if stream:
+            attn_out, state = self.attention.stream(self.norm1(x), state)
+        else:
+            attn_out = self.attention(self.norm1(x))
+        x = x + self.dropout(attn_out)
+        
+        # Feed-forward com residual
+        ff_out = self.ff(self.norm2(x))
+        x = x + ff_out
+        
+        return (x, state) if stream else x
+
+
+class PPGPeakPerformer(nn.Module):
+    """
+    Modelo Performer para detecção de picos em PPG.
+    
+    Arquitetura:
+    - Embedding 1D (Conv)
+    - Positional Encoding
+    - N x Performer Blocks
+    - Decoder (Conv 1D)
+
+    Variante causal (`causal=True`), para inferência ao vivo amostra a
+    amostra: convs causais, atenção causal com decaimento (`memory`
+    amostras, padrão `window_size`) e sem codificação posicional absoluta
+    (um stream não tem origem; a ordem local vem das convs). A saída da
+    amostra t usa x[..t + lookahead]: `forward` alinha a saída com a entrada
+    (o fim da janela vê zeros no lugar do futuro, como no `flush` do
+    stream), então o treino (`train_performer`) é o mesmo do modelo
+    bidirecional. Ver `init_stream` / `forward_stream` e `PerformerStream`.
+
+    Variante de comprimento livre (`length_agnostic=True`): codificação
+    posicional extensível (ver `PositionalEncoding`); treinada com recortes
+    de comprimento variável (`peak_dataset.RandomCropCollate`), infere uma
+    sessão inteira numa única chamada (`inference.predict_session`).
+    `window_size` passa a ser só o comprimento de referência.
+    """
+    
+    def __init__(self, window_size=500, d_model=64, n_heads=4, n_layers=4, dropout=0.1,
+                 causal=False, memory=None, lookahead=25, length_agnostic=False):
+        super().__init__()
+        self.causal = causal
+        self.lookahead = lookahead if causal else 0
+        memory = (memory or window_size) if causal else None
+        
+        # Embedding: 1D signal -> d_model features
+        self.embedding = nn.Sequential(
+            _conv(1, d_model // 2, 7, causal),
+            nn.BatchNorm1d(d_model // 2),
+            nn.GELU(),
+            _conv(d_model // 2, d_model, 5, causal),
+            nn.BatchNorm1d(d_model),
+            nn.GELU()
+        )
+        
+        self.pos_encoding = PositionalEncoding(d_model, max_len=window_size,
+                                               extendable=length_agnostic)
+        
+        # Performer blocks
+        self.transformer = nn.ModuleList([
+            PerformerBlock(d_model, n_heads, ff_dim=d_model * 4, dropout=dropout,
+                           causal=causal, memory=memory)
+            for _ in range(n_layers)
+        ])
+        
+        # Decoder
+        self.decoder = nn.Sequential(
+            _conv(d_model, d_model // 2, 5, causal),
+            nn.BatchNorm1d(d_model // 2),
+            nn.GELU(),
+            _conv(d_model // 2, 1, 3, causal),
+            nn.Sigmoid()
+        )
+    
+    def forward(self, x):
+        # x: (batch, window_size)
+        batch, seq_len = x.shape
+        if self.lookahead:
+            x = F.pad(x, (0, self.lookahead))
+        
+        # Embedding
+        x = x.unsqueeze(1)  # (batch, 1, seq_len)
+        x = self.embedding(x)  # (batch, d_model, seq_len)
+        x = x.transpose(1, 2)  # (batch, seq_len, d_model)
+        
+        # Positional encoding
+        if not self.causal:
+            x = self.pos_encoding(x)
+        
+        # Transformer blocks
+        for block in self.transformer:
+            x = block(x)
+        
+        # Decoder
+        x = x.transpose(1, 2)  # (batch, d_model, seq_len)
+        x = self.decoder(x)  # (batch, 1, seq_len)
+        
+        return x.squeeze(1)[:, self.lookahead:]  # (batch, seq_len)
+
+    def init_stream(self):
+        """Estado inicial do modo stream (modelo causal)."""
+        if not self.causal:
+            raise ValueError("Modo stream requer PPGPeakPerformer(causal=True)")
+        return {
+            'embedding': [None] * len(self.embedding),
+            'attention': [None] * len(self.transformer),
+            'decoder': [None] * len(self.decoder),
+        }
+
+    def forward_stream(self, x, state):
+        """
+        Processa um bloco (batch, n) de amostras normalizadas.
+
+        A saída de um bloco corresponde às mesmas posições da entrada, mas
+        atrasada de `lookahead` amostras (a probabilidade de x[t] sai junto
+        com x[t + lookahead]). Concatenar as saídas de todos os blocos dá o
+        mesmo resultado de `forward` no sinal inteiro, deslocado.
+
+        Returns:
+            probs (batch, n), novo estado
+        """
+        x, embedding = _stream_sequential(self.embedding, x.unsqueeze(1), state['embedding'])
+        x = x.transpose(1, 2)
+
+        attention = []
+        for block, block_state in zip(self.transformer, state['attention']):
+            x, block_state = block(x, block_state, stream=True)
+            attention.append(block_state)
+
+        x, decoder = _stream_sequential(self.decoder, x.transpose(1, 2), state['decoder'])
+        return x.squeeze(1), {'embedding': embedding, 'attention': attention, 'decoder': decoder}
+
+
+class PerformerStream:
+    """
+    Inferência ao vivo com um PPGPeakPerformer causal.
+
+    Cada `push` normaliza as amostras novas (média/variância móveis com
+    constante de tempo `window_size`, aproximando o Z-score por janela do
+    treino), roda `forward_stream` só nelas e devolve as probabilidades das
+    amostras já confirmadas (atraso fixo de `model.lookahead` amostras). O
+    custo por amostra é constante: nada é recalculado.
+
+    Aquecimento: as primeiras `window_size` amostras ficam retidas até
+    completarem uma janela, que semeia média/variância (o Z-score do
+    treino); só então o modelo roda. Assim a saída não depende do tamanho
+    dos blocos (ver `check_chunk_invariance`), ao custo de a primeira
+    saída sair ~`window_size` amostras depois do início.
+
+    O modelo é treinado em janelas com Z-score próprio, não na normalização
+    móvel do stream; a seção TRAIN_CAUSAL do notebook 01 compara as métricas
+    por batimento do stream com as de `inference.predict_signal` nos
+    sujeitos de teste antes de se confiar no modo ao vivo.
+
+    Uso:
+        stream = PerformerStream(model)
+        for chunk in chunks:          # sinal já em 125 Hz
+            start, probs = stream.push(chunk)
+        start, probs = stream.flush()
+
+    Args:
+        model: PPGPeakPerformer(causal=True) treinado
+        window_size: Constante de tempo da normalização (amostras)
+    """
+
+    def __init__(self, model, window_size=500, device=None):
+        self.model = model.eval()
+        self.device = device or next(model.parameters()).device
+        self.window_size = window_size
+        self.alpha = 1.0 / window_size
+        self.state = model.init_stream()
+        self.mean = None
+        self.var = None
+        self._warmup = []
+        self._n_warmup = 0
+        self.n_in = 0
+        self.n_out = 0
+
+    def _normalize(self, chunk, final=False):
+        if self.mean is None:
+            # Retém até completar uma janela (ou até o flush) para semear as estatísticas
+            self._warmup.append(chunk)
+            self._n_warmup += len(chunk)
+            if self._n_warmup < self.window_size and not final:
+                return chunk[:0]
+            chunk = np.concatenate(self._warmup)
+            self._warmup = []
+            seed = chunk[:self.window_size]
+            self.mean, self.var = seed.mean(), max(seed.var(), 1e-12)
+        # EMAs amostra a amostra (filtros IIR de 1ª ordem com estado)
+        b, a = [self.alpha], [1, self.alpha - 1]
+        mean, _ = lfilter(b, a, chunk, zi=[(1 - self.alpha) * self.mean])
+        var, _ = lfilter(b, a, (chunk - mean) ** 2, zi=[(1 - self.alpha) * self.var])
+        self.mean, self.var = mean[-1], var[-1]
+        return (chunk - mean) / (np.sqrt(var) + 1e-8)
+
+    def _run(self, x):
+        batch = torch.from_numpy(x.astype(np.float32))[None].to(self.device)
+        with torch.inference_mode():
+            probs, self.state = self.model.forward_stream(batch, self.state)
+        return probs[0].float().cpu().numpy()
+
+    def push(self, chunk):
+        """
+        Consome amostras novas.
+
+        Returns:
+            (start, probs): índice da primeira amostra confirmada e as
+            probabilidades (podem ser vazias)
+        """
+        chunk = np.asarray(chunk, dtype=np.float64).ravel()
+        x = self._normalize(chunk) if len(chunk) else chunk
+        if len(x) == 0:
+            return self.n_out, np.zeros(0)
+        probs = self._run(x)
+        self.n_in += len(x)
+        return self._emit(probs)
+
+    def flush(self):
+        """Confirma as amostras pendentes (futuro = zeros); encerra o stream."""
+        x = np.zeros(0)
+        if self._n_warmup and self.mean is None:  # sinal menor que uma janela
+            x = self._normalize(np.zeros(0), final=True)
+        if self.n_in + len(x) == 0:
+            return self.n_out, np.zeros(0)
+        x = np.concatenate([x, np.zeros(self.model.lookahead)])
+        probs = self._run(x)
+        self.n_in += len(x)
+        return self._emit(probs)
+
+    def _emit(self, probs):
+        # Saídas do bloco cobrem as posições [n_in − len − lookahead, n_in − lookahead)
+        first = self.n_in - len(probs) - self.model.lookahead
+        keep = probs[max(0, self.n_out - first):]
+        start = self.n_out
+        self.n_out += len(keep)
+        return start, keep
+
+
+def stream_signal(model, signal, chunk_size=125, window_size=500, device=None):
+    """
+    Probabilidades de um sinal inteiro via `PerformerStream`, em blocos.
+
+    Returns:
+        Array do tamanho de `signal`
+    """
+    signal = np.asarray(signal, dtype=np.float64).ravel()
+    stream = PerformerStream(model, window_size=window_size, device=device)
+    probs = np.zeros(len(signal))
+    for i in range(0, len(signal), chunk_size):
+        start, p = stream.push(signal[i:i + chunk_size])
+        probs[start:start + len(p)] = p
+    start, p = stream.flush()
+    probs[start:start + len(p)] = p[:max(0, len(signal) - start)]
+    return probs
+
+
+def check_chunk_invariance(model, signal, chunk_sizes=(1, 50, 500, None), window_size=500,
+                           device=None):
+    """
+    Confere que `PerformerStream` dá as mesmas probabilidades para vários
+    tamanhos de bloco (None = sinal inteiro num só `push`, a referência).
+
+    Returns:
+        Dict tamanho do bloco → maior diferença absoluta em relação à referência
+    """
+    reference = stream_signal(model, signal, len(signal), window_size, device)
+    return {size: float(np.abs(stream_signal(model, signal, size or len(signal), window_size,
+                                             device) - reference).max())
+            for size in chunk_sizes}
+
+
+def _as_dataset(X, y):
+    """Aceita um Dataset (ex.: peak_dataset.PeakWindowDataset) ou arrays X/y."""
+    if isinstance(X, Dataset):
+        return X
+    return TensorDataset(torch.from_numpy(np.asarray(X, dtype=np.float32)),
+                         torch.from_numpy(np.asarray(y, dtype=np.float32)))
+
+
+def _autocast(device, precision):
+    """Contexto de autocast para 'bf16' (no-op em 'fp32')."""
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision != 'bf16':
+        raise ValueError(f"precision inválida: {precision} (use 'fp32' ou 'bf16')")
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+
+
+def set_threads(num_threads=None, num_interop_threads=None):
+    """
+    Ajusta as threads intra-op / inter-op do torch.
+
+    inter-op só pode ser definido antes do primeiro trabalho paralelo do
+    processo; depois disso o valor atual é mantido (com aviso).
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None and num_interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            print(f"⚠️ inter-op threads já fixadas em {torch.get_num_interop_threads()} neste processo")
+
+
+def evaluate_loader(model, loader, device, precision='fp32', fs=125,
+                    tolerance_ms=DEFAULT_TOLERANCE_MS, threshold=0.5):
+    """
+    Loss BCE e métricas por batimento em lotes (sem um forward gigante).
+
+    Os picos de cada janela (find_peaks nas probabilidades) são casados com
+    os centros dos trechos positivos dos labels (ver
+    `peak_evaluation.evaluate_windows`).
+
+    Returns:
+        val_loss, metrics (dict de `peak_evaluation.summarize_peak_metrics`:
+        'f1', 'sensitivity', 'ppv', 'timing_mae_ms', ...)
+    """
+    model.eval()
+    total_loss, n = 0.0, 0
+    rows = []
+    with torch.no_grad():
+        for X_batch, y_batch in loader:
+            X_batch = X_batch.to(device, non_blocking=True)
+            y_batch = y_batch.to(device, non_blocking=True)
+            with _autocast(device, precision):
+                y_pred = model(X_batch)
+            y_pred = y_pred.float()
+            total_loss += F.binary_cross_entropy(y_pred, y_batch, reduction='sum').item()
+            n += y_batch.numel()
+            rows.append(evaluate_windows(y_pred.cpu().numpy(), y_batch.cpu().numpy(), fs,
+                                         threshold, tolerance_ms))
+
+    return total_loss / max(n, 1), summarize_peak_metrics(rows)
+
+
+def train_performer(model, X_train, y_train, X_val, y_val, 
+                   epochs=50, batch_size=64, lr=1e-3,
+                   checkpoint_path='best_performer.pth', resume_path=None,
+                   device=None, verbose=True, num_workers=0, pin_memory=None,
+                   val_batch_size=256, precision='fp32', compile_model=False,
+                   num_threads=None, num_interop_threads=None, collate_fn=None,
+                   fs=125, tolerance_ms=DEFAULT_TOLERANCE_MS):
+    """
+    Treina o modelo Performer.
+    
+    Args:
+        X_train, X_val: Arrays (n, window_size) ou Datasets que devolvem
+            (x, y) — ex.: peak_dataset.PeakWindowDataset (y_* são ignorados)
+        checkpoint_path: Onde salvar o melhor modelo (menor val_loss)
+        resume_path: Se definido, salva o estado completo (modelo, optimizer,
+            scheduler, histórico) a cada época e retoma dele se já existir
+        device: Dispositivo de treino (padrão: cuda se disponível)
+        verbose: Imprime o log a cada 10 épocas
+        num_workers: Processos do DataLoader (janelas geradas em paralelo)
+        pin_memory: Memória fixada para cópia assíncrona (padrão: só em cuda)
+        val_batch_size: Tamanho dos lotes da validação
+        precision: 'fp32' ou 'bf16' (autocast; a loss é sempre em fp32)
+        compile_model: Usa torch.compile no modelo de treino (os
+            checkpoints continuam sendo do modelo original)
+        num_threads, num_interop_threads: Threads do torch (padrão: não mexe)
+        collate_fn: collate dos lotes de treino (ex.:
+            peak_dataset.RandomCropCollate para recortes de comprimento variável)
+        fs, tolerance_ms: Frequência do sinal e tolerância do casamento de
+            picos nas métricas de validação
+    
+    Returns:
+        history com 'train_loss', 'val_loss', 'val_f1', 'val_sensitivity',
+        'val_ppv', 'val_timing_mae_ms' (métricas por batimento), 'epoch_time'
+        (s) e 'windows_per_sec' (janelas de treino por segundo)
+    """
+    device = globals()['device'] if device is None else device
+    set_threads(num_threads, num_interop_threads)
+    _autocast(device, precision)  # valida precision antes de começar
+    train_model = torch.compile(model) if compile_model else model
+    if pin_memory is None:
+        pin_memory = torch.device(device).type == 'cuda'
+    
+    # DataLoaders
+    loader_kwargs = {
+        'num_workers': num_workers,
+        'pin_memory': pin_memory,
+        'persistent_workers': num_workers > 0,
+    }
+    train_loader = DataLoader(_as_dataset(X_train, y_train), batch_size=batch_size,
+                              shuffle=True, collate_fn=collate_fn, **loader_kwargs)
+    val_loader = DataLoader(_as_dataset(X_val, y_val), batch_size=val_batch_size,
+                            shuffle=False, **loader_kwargs)
+    
+    # Loss e optimizer
+    # Usar Focal Loss para lidar com desbalanceamento (poucos 1s, muitos 0s)
+    criterion = nn.BCELoss()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=0.01)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+    
+    history = {'train_loss': [], 'val_loss': [], 'val_f1': [], 'val_sensitivity': [], 'val_ppv': [],
+               'val_timing_mae_ms': [], 'epoch_time': [], 'windows_per_sec': []}
+    best_val_loss = float('inf')
+    start_epoch = 0
+    
+    # Retomar treino interrompido
+    if resume_path is not None and os.path.exists(resume_path):
+        state = torch.load(resume_path, map_location=device)
+        model.load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        scheduler.load_state_dict(state['scheduler_state_dict'])
+        history.update(state['history'])
+        best_val_loss = state['best_val_loss']
+        start_epoch = state['epoch'] + 1
+        if verbose:
+            print(f"🔁 Retomando da época {start_epoch}/{epochs}")
+    
+    for epoch in range(start_epoch, epochs):
+        model.train()
+        train_losses = []
+        n_windows = 0
+        t0 = time.perf_counter()
+        
+        with profiling.stage('train.epoch', epoch=epoch):
+            for X_batch, y_batch in train_loader:
+                X_batch = X_batch.to(device, non_blocking=True)
+                y_batch = y_batch.to(device, non_blocking=True)
+                
+                optimizer.zero_grad()
+                with _autocast(device, precision):
+                    y_pred = train_model(X_batch)
+                # BCE fora do autocast (não é segura em bf16)
+                loss = criterion(y_pred.float(), y_batch)
+                loss.backward()
+                
+                # Gradient clipping
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+                
+                optimizer.step()
+                train_losses.append(loss.item())
+                n_windows += len(X_batch)
+        
+        epoch_time = time.perf_counter() - t0
+        scheduler.step()
+        
+        # Validação (em lotes)
+        with profiling.stage('validate', epoch=epoch):
+            val_loss, val_metrics = evaluate_loader(train_model, val_loader, device, precision,
+                                                    fs, tolerance_ms)
+        f1 = val_metrics['f1']
+        
+        train_loss = np.mean(train_losses)
+        history['train_loss'].append(train_loss)
+        history['val_loss'].append(val_loss)
+        history['val_f1'].append(f1)
+        history['val_sensitivity'].append(val_metrics['sensitivity'])
+        history['val_ppv'].append(val_metrics['ppv'])
+        history['val_timing_mae_ms'].append(val_metrics['timing_mae_ms'])
+        history['epoch_time'].append(epoch_time)
+        history['windows_per_sec'].append(n_windows / epoch_time)
+        
+        # Log
+        if verbose and (epoch + 1) % 10 == 0:
+            print(f"Epoch {epoch+1:3d}/{epochs} | "
+                  f"Train: {train_loss:.4f} | Val: {val_loss:.4f} | F1: {f1:.4f} | "
+                  f"{n_windows / epoch_time:.0f} janelas/s")
+        
+        # Early save
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            torch.save(model.state_dict(), checkpoint_path)
+        
+        # Checkpoint completo para retomada
+        if resume_path is not None:
+            torch.save({
+                'epoch': epoch,
+                'model_state_dict': model.state_dict(),
+                'optimizer_state_dict': optimizer.state_dict(),
+                'scheduler_state_dict': scheduler.state_dict(),
+                'history': history,
+                'best_val_loss': best_val_loss,
+            }, resume_path + '.tmp')
+            os.replace(resume_path + '.tmp', resume_path)
+    
+    # Carregar melhor modelo
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    
+    return history
+
+
+def compare_training_modes(make_model, X_train, y_train, X_val, y_val, modes=None,
+                           epochs=3, batch_size=64, seed=0, device=None, **train_kwargs):
+    """
+    Treina o mesmo modelo inicial em vários modos e compara velocidade e loss.
+
+    Args:
+        make_model: Função sem argumentos que cria o modelo
+        modes: Dict nome → kwargs de train_performer (precision,
+            compile_model, num_threads, ...). O primeiro é a referência.
+        epochs: Épocas por modo (a primeira inclui aquecimento/compilação)
+
+    Returns:
+        Lista de dicts com 'mode', 'windows_per_sec'
+        (mediana das épocas após a primeira), 'final_train_loss',
+        'final_val_loss', 'val_loss_diff' (vs referência) e 'val_f1'
+    """
+    import tempfile
+
+    modes = modes or {
+        'fp32': {},
+        'bf16': {'precision': 'bf16'},
+        'fp32+compile': {'compile_model': True},
+        'bf16+compile': {'precision': 'bf16', 'compile_model': True},
+    }
+    device = globals()['device'] if device is None else device
+
+    torch.manual_seed(seed)
+    initial_state = {k: v.clone() for k, v in make_model().state_dict().items()}
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, mode_kwargs in modes.items():
+            torch.manual_seed(seed)
+            model = make_model().to(device)
+            model.load_state_dict(initial_state)
+            history = train_performer(
+                model, X_train, y_train, X_val, y_val, epochs=epochs, batch_size=batch_size,
+                checkpoint_path=os.path.join(tmp, f'{name}.pth'), device=device,
+                verbose=False, **{**train_kwargs, **mode_kwargs}
+            )
+            speeds = history['windows_per_sec'][1:] or history['windows_per_sec']
+            results.append({
+                'mode': name,
+                'windows_per_sec': float(np.median(speeds)),
+                'final_train_loss': float(history['train_loss'][-1]),
+                'final_val_loss': float(history['val_loss'][-1]),
+                'val_f1': float(history['val_f1'][-1]),
+            })
+
+    reference = results[0]['final_val_loss']
+    for r in results:
+        r['val_loss_diff'] = r['final_val_loss'] - reference
+    return results
+
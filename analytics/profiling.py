@@ -0,0 +1,345 @@
+"""
+Instrumentação por etapa do pipeline (tempo, RSS e alocações Python).
+
+Etapas são marcadas com o context manager `stage` ou o decorador
+`profiled`. Desligado (padrão), `stage` devolve um context manager nulo
+compartilhado e `profiled` só testa uma flag antes de chamar a função —
+pode ficar no código de produção.
+
+Ligado, cada etapa registra duração (perf_counter), RSS no início/fim e o
+pico de RSS visto por uma thread de amostragem, e — com
+`trace_memory=True` — o pico de memória alocada pelo Python (tracemalloc,
+que deixa o código ~2x mais lento). Etapas aninhadas ficam como filhas no
+trace.
+
+Os agregados por etapa (contagem, soma, máximo, picos) são atualizados ao
+fim de cada etapa; as etapas individuais ficam só num buffer circular
+(`MAX_SPANS`). Memória e custo de `summary()` / `/metrics` não crescem com
+o tempo de processo.
+
+Exportação:
+- `export_trace`: JSON no formato Trace Event (abre no chrome://tracing ou
+  ui.perfetto.dev), com a série de RSS como contador
+- `export_prometheus`: texto no formato de exposição do Prometheus
+  (ex.: para o textfile collector do node_exporter), agregado por etapa
+
+Uso:
+    import profiling
+    profiling.enable()
+    with profiling.stage('load'):
+        subjects = load_all_subjects(MIMIC_DIR)
+    profiling.export('profile/')
+
+Em jobs em lote, `PPG_PROFILE=1` liga na importação e `PPG_PROFILE_DIR`
+exporta ao sair do processo.
+"""
+
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+METRIC_PREFIX = 'ppg_stage'
+DEFAULT_RSS_INTERVAL = 0.05
+MAX_RSS_SAMPLES = 100_000  # ~1h30 a 50 ms (processos longos, ex.: o app de anotação)
+MAX_SPANS = 100_000  # etapas individuais guardadas para o trace (as mais recentes)
+
+_NULL_STAGE = contextlib.nullcontext()
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_spans = collections.deque(maxlen=MAX_SPANS)
+_stats = {}
+_open_stages = set()
+_rss_samples = collections.deque(maxlen=MAX_RSS_SAMPLES)
+_sampler = None
+_t0 = time.perf_counter()
+
+
+def _read_rss():
+    """RSS atual do processo em bytes (0 se indisponível)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+class _RSSSampler(threading.Thread):
+    """Amostra o RSS em intervalo fixo (picos entre o início e o fim das etapas)."""
+
+    def __init__(self, interval):
+        super().__init__(name='ppg-rss-sampler', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = _read_rss()
+            _rss_samples.append((time.perf_counter() - _t0, rss))
+            for st in list(_open_stages):
+                st.rss_peak = max(st.rss_peak, rss)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def enable(trace_memory=False, rss_interval=DEFAULT_RSS_INTERVAL):
+    """
+    Liga a instrumentação.
+
+    Args:
+        trace_memory: Também mede o pico de alocações Python (tracemalloc)
+        rss_interval: Intervalo da amostragem de RSS (s); None desliga
+    """
+    global _enabled, _sampler
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if rss_interval and _sampler is None:
+        _sampler = _RSSSampler(rss_interval)
+        _sampler.start()
+    _enabled = True
+
+
+def disable():
+    """Desliga a instrumentação (os registros continuam disponíveis)."""
+    global _enabled, _sampler
+    _enabled = False
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Descarta etapas, agregados e amostras de RSS registrados."""
+    with _lock:
+        _spans.clear()
+        _stats.clear()
+        _rss_samples.clear()
+
+
+def spans():
+    """Cópia das últimas `MAX_SPANS` etapas (dicts, na ordem de término)."""
+    with _lock:
+        return [dict(s) for s in _spans]
+
+
+class _Stage:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.child_alloc_peak = 0
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            self.alloc_start = tracemalloc.get_traced_memory()[0]
+        self.rss_start = self.rss_peak = _read_rss()
+        _open_stages.add(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        rss_end = _read_rss()
+        _open_stages.discard(self)
+        _local.stack.pop()
+
+        span = {
+            'name': self.name,
+            'start_s': self.start - _t0,
+            'duration_s': end - self.start,
+            'thread': threading.current_thread().name,
+            'tid': threading.get_native_id(),
+            'depth': len(_local.stack),
+            'parent': self.parent.name if self.parent else None,
+            'rss_start_bytes': self.rss_start,
+            'rss_end_bytes': rss_end,
+            'rss_peak_bytes': max(self.rss_peak, rss_end),
+            'error': exc_type.__name__ if exc_type else None,
+            'attrs': self.attrs,
+        }
+
+        if self.tracing and tracemalloc.is_tracing():
+            # O pico do tracemalloc é global: as filhas repassam o seu antes
+            # de zerá-lo, para o pico da mãe cobrir o trecho inteiro
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_alloc_peak)
+            span['alloc_peak_bytes'] = max(0, peak - self.alloc_start)
+            if self.parent is not None:
+                self.parent.child_alloc_peak = max(self.parent.child_alloc_peak, peak)
+            tracemalloc.reset_peak()
+
+        with _lock:
+            _spans.append(span)
+            _accumulate(span)
+        return False
+
+
+def _accumulate(span):
+    """Atualiza o agregado da etapa (chamado sob `_lock`)."""
+    agg = _stats.get(span['name'])
+    if agg is None:
+        agg = _stats[span['name']] = {'count': 0, 'total_s': 0.0, 'max_s': 0.0,
+                                      'rss_peak_bytes': 0, 'errors': 0}
+    agg['count'] += 1
+    agg['total_s'] += span['duration_s']
+    agg['max_s'] = max(agg['max_s'], span['duration_s'])
+    agg['rss_peak_bytes'] = max(agg['rss_peak_bytes'], span['rss_peak_bytes'])
+    agg['errors'] += span['error'] is not None
+    if 'alloc_peak_bytes' in span:
+        agg['alloc_peak_bytes'] = max(agg.get('alloc_peak_bytes', 0), span['alloc_peak_bytes'])
+
+
+def stage(name, **attrs):
+    """
+    Context manager que mede uma etapa.
+
+    Args:
+        name: Nome da etapa (ex.: 'load', 'train.epoch')
+        **attrs: Atributos só do trace (ex.: epoch=3), não viram labels no
+            Prometheus
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, attrs)
+
+
+def profiled(name=None):
+    """Decorador: mede cada chamada da função como a etapa `name`."""
+    def decorator(fn):
+        stage_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(stage_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary():
+    """
+    Agregado por etapa, desde o início (ou o último `reset`).
+
+    Returns:
+        Dict nome → {'count', 'total_s', 'mean_s', 'max_s', 'rss_peak_bytes',
+        'alloc_peak_bytes' (se medido), 'errors'}
+    """
+    with _lock:
+        out = {name: dict(agg) for name, agg in _stats.items()}
+    for agg in out.values():
+        agg['mean_s'] = agg['total_s'] / agg['count']
+    return out
+
+
+def print_summary():
+    rows = sorted(summary().items(), key=lambda kv: -kv[1]['total_s'])
+    print(f"{'etapa':28s} {'n':>5s} {'total s':>9s} {'média ms':>9s} {'RSS pico MB':>12s}")
+    for name, agg in rows:
+        print(f"{name:28s} {agg['count']:5d} {agg['total_s']:9.2f} {agg['mean_s'] * 1000:9.1f} "
+              f"{agg['rss_peak_bytes'] / 1e6:12.1f}")
+
+
+def _atomic_write(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return path
+
+
+def export_trace(path):
+    """Grava as etapas em JSON Trace Event (chrome://tracing / Perfetto)."""
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for s in spans():
+        threads[s['tid']] = s['thread']
+        args = {k: s[k] for k in ('rss_start_bytes', 'rss_end_bytes', 'rss_peak_bytes',
+                                  'alloc_peak_bytes', 'error') if s.get(k) is not None}
+        args.update(s['attrs'])
+        events.append({'name': s['name'], 'ph': 'X', 'pid': pid, 'tid': s['tid'],
+                       'ts': s['start_s'] * 1e6, 'dur': s['duration_s'] * 1e6, 'args': args})
+    for t, rss in list(_rss_samples):
+        events.append({'name': 'rss', 'ph': 'C', 'pid': pid, 'ts': t * 1e6,
+                       'args': {'MB': rss / 1e6}})
+    events.sort(key=lambda e: e['ts'])
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+               for tid, name in threads.items()]
+    doc = {'traceEvents': events, 'displayTimeUnit': 'ms', 'summary': summary()}
+    return _atomic_write(path, json.dumps(doc, default=str))
+
+
+def prometheus_text(prefix=METRIC_PREFIX):
+    """Métricas agregadas por etapa no formato de exposição do Prometheus."""
+    agg = summary()
+    metrics = [
+        ('duration_seconds', 'summary', 'Duração das etapas do pipeline', None),
+        ('duration_seconds_max', 'gauge', 'Maior duração de uma execução da etapa', 'max_s'),
+        ('rss_peak_bytes', 'gauge', 'Pico de RSS do processo durante a etapa', 'rss_peak_bytes'),
+        ('alloc_peak_bytes', 'gauge', 'Pico de alocações Python na etapa (tracemalloc)',
+         'alloc_peak_bytes'),
+        ('errors_total', 'counter', 'Execuções da etapa que terminaram em exceção', 'errors'),
+    ]
+    lines = []
+    for suffix, kind, help_text, key in metrics:
+        rows = [(name, a) for name, a in sorted(agg.items()) if key is None or key in a]
+        if not rows:
+            continue
+        metric = f'{prefix}_{suffix}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        for name, a in rows:
+            label = '{stage="%s"}' % name.replace('\\', '\\\\').replace('"', '\\"')
+            if key is None:
+                lines.append(f"{metric}_sum{label} {a['total_s']:.6f}")
+                lines.append(f"{metric}_count{label} {a['count']}")
+            else:
+                lines.append(f'{metric}{label} {a[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export_prometheus(path, prefix=METRIC_PREFIX):
+    """Grava `prometheus_text` (escrita atômica, seguro para o textfile collector)."""
+    return _atomic_write(path, prometheus_text(prefix))
+
+
+def export(out_dir, basename='profile'):
+    """
+    Grava `<basename>_trace.json` e `<basename>.prom` em `out_dir`.
+
+    Returns:
+        (caminho do trace, caminho do .prom)
+    """
+    return (export_trace(os.path.join(out_dir, f'{basename}_trace.json')),
+            export_prometheus(os.path.join(out_dir, f'{basename}.prom')))
+
+
+if os.environ.get('PPG_PROFILE', '').lower() in ('1', 'true', 'yes'):
+    enable(trace_memory=os.environ.get('PPG_PROFILE_MEMORY', '').lower() in ('1', 'true', 'yes'))
+    if os.environ.get('PPG_PROFILE_DIR'):
+        atexit.register(lambda: export(os.environ['PPG_PROFILE_DIR'], f'profile_{os.getpid()}'))
@@ -0,0 +1,227 @@
+"""
+Quantização int8 pós-treino do PPGPeakPerformer (inferência em CPU).
+
+Três variantes ao lado do fp32:
+- `torch_dynamic`: `torch.ao.quantization.quantize_dynamic` nas camadas
+  nn.Linear (projeções Q/K/V/out e feed-forward dos blocos). O PyTorch não
+  tem Conv1d dinâmico, então embedding/decoder ficam em fp32. Checkpoint
+  salvo com `save_quantized_checkpoint` e lido por
+  `inference_backends.load_torch_model`.
+- `onnx_dynamic`: ONNX Runtime, pesos int8 de MatMul e Conv (embedding,
+  projeções, feed-forward e decoder), ativações quantizadas em tempo de
+  execução.
+- `onnx_static`: ONNX Runtime QDQ com escalas das ativações calibradas em
+  janelas BIDMC (`calibration_windows`).
+
+Nas variantes ONNX ficam em fp32 os MatMul da atenção linear sem peso 2D
+(k'ᵀv, q'·kv e a projeção das random features, que alimenta o softplus) e
+as Conv de 1 canal (entrada do embedding e saída do decoder) — são as que
+mais perdem precisão e quase não têm pesos para comprimir.
+
+Os .onnx quantizados são carregados por `inference_backends.load_backend`
+como qualquer outro.
+
+Uso:
+    variants = build_quantized_variants(model, 'models/', train_ds)
+    report = quantization_report(variants, test_subjects)
+"""
+
+import copy
+import os
+
+import numpy as np
+
+from inference import predict_signal
+from inference_backends import benchmark_backends, export_onnx, load_backend
+from peak_evaluation import evaluate_peaks, peaks_from_probs, summarize_peak_metrics
+
+QUANTIZATION_DYNAMIC_INT8 = 'dynamic_int8'
+
+
+def quantize_dynamic_torch(model):
+    """Cópia do modelo com nn.Linear em int8 dinâmico (CPU)."""
+    import torch
+    from torch import nn
+    from torch.ao.quantization import quantize_dynamic
+
+    model = copy.deepcopy(model).eval().cpu()
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized_checkpoint(qmodel, path, config):
+    """Salva no formato da seção 9 do notebook + chave 'quantization'."""
+    import torch
+
+    torch.save({
+        'model_state_dict': qmodel.state_dict(),
+        'config': config,
+        'quantization': QUANTIZATION_DYNAMIC_INT8,
+    }, path)
+
+
+def calibration_windows(dataset, n_windows=512, seed=0):
+    """
+    Janelas normalizadas (n, window_size) float32 sorteadas de um Dataset
+    de `peak_dataset` (ex.: o `train_ds` do notebook).
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(dataset), size=min(n_windows, len(dataset)), replace=False)
+    return np.stack([dataset[int(i)][0].numpy() for i in np.sort(idx)]).astype(np.float32)
+
+
+def _fp32_nodes(model_path):
+    """
+    Nós mantidos em fp32: MatMul entre duas ativações, a projeção das random
+    features (peso 3D por cabeça, sem quantização por canal no ORT) e as
+    Conv de 1 canal (primeira camada do embedding e saída do decoder).
+    """
+    import onnx
+
+    graph = onnx.load(model_path).graph
+    shapes = {init.name: list(init.dims) for init in graph.initializer}
+    keep = []
+    for node in graph.node:
+        weight = shapes.get(node.input[1]) if len(node.input) > 1 else None
+        if node.op_type == 'MatMul' and (weight is None or len(weight) != 2):
+            keep.append(node.name)
+        elif node.op_type == 'Conv' and weight is not None and 1 in weight[:2]:
+            keep.append(node.name)
+    return keep
+
+
+def quantize_onnx(fp32_path, out_path, mode='dynamic', calibration=None, batch_size=32):
+    """
+    Quantiza um .onnx de `export_onnx` para int8 com o ONNX Runtime.
+
+    Args:
+        mode: 'dynamic' ou 'static'
+        calibration: Janelas (n, window_size) para o modo estático
+        batch_size: Janelas por lote de calibração
+
+    Returns:
+        out_path
+    """
+    try:
+        from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                              quantize_dynamic, quantize_static)
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError as e:
+        raise ImportError("onnxruntime não instalado: pip install onnxruntime onnx") from e
+
+    prepared = out_path + '.prep.onnx'
+    quant_pre_process(fp32_path, prepared, skip_symbolic_shape=True)
+    try:
+        if mode == 'dynamic':
+            quantize_dynamic(prepared, out_path, op_types_to_quantize=['MatMul', 'Conv'],
+                             nodes_to_exclude=_fp32_nodes(prepared),
+                             weight_type=QuantType.QInt8, per_channel=True)
+        elif mode == 'static':
+            if calibration is None:
+                raise ValueError("Modo estático precisa de janelas de calibração")
+
+            class _Reader(CalibrationDataReader):
+                def __init__(self):
+                    self._batches = iter(np.array_split(
+                        calibration, max(1, len(calibration) // batch_size)))
+
+                def get_next(self):
+                    batch = next(self._batches, None)
+                    return None if batch is None else {'ppg': np.ascontiguousarray(batch, dtype=np.float32)}
+
+            quantize_static(prepared, out_path, _Reader(), quant_format=QuantFormat.QDQ,
+                            op_types_to_quantize=['MatMul', 'Conv'],
+                            nodes_to_exclude=_fp32_nodes(prepared),
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                            per_channel=True)
+        else:
+            raise ValueError(f"Modo de quantização desconhecido: {mode}")
+    finally:
+        if os.path.exists(prepared):
+            os.remove(prepared)
+    return out_path
+
+
+def build_quantized_variants(model, out_dir, calibration_dataset, config=None,
+                             n_calibration=512, verbose=True):
+    """
+    Exporta fp32 + as três variantes int8 para `out_dir`.
+
+    Args:
+        model: PPGPeakPerformer treinado
+        calibration_dataset: Dataset de janelas para a calibração estática
+        config: 'config' do checkpoint (padrão: lido do modelo)
+
+    Returns:
+        Dict nome → caminho do arquivo ('fp32_torch', 'fp32_onnx',
+        'torch_dynamic', 'onnx_dynamic', 'onnx_static')
+    """
+    import torch
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = copy.deepcopy(model).eval().cpu()
+    window_size = model.pos_encoding.pe.shape[1]
+    config = config or {
+        'window_size': window_size,
+        'd_model': model.pos_encoding.pe.shape[2],
+        'n_heads': model.transformer[0].attention.n_heads,
+        'n_layers': len(model.transformer),
+        'length_agnostic': model.pos_encoding.extendable,
+    }
+
+    paths = {name: os.path.join(out_dir, f'performer_{name}{ext}') for name, ext in [
+        ('fp32_torch', '.pth'), ('fp32_onnx', '.onnx'), ('torch_dynamic', '.pth'),
+        ('onnx_dynamic', '.onnx'), ('onnx_static', '.onnx'),
+    ]}
+    torch.save({'model_state_dict': model.state_dict(), 'config': config}, paths['fp32_torch'])
+    export_onnx(model, paths['fp32_onnx'], window_size=window_size, verbose=verbose)
+    save_quantized_checkpoint(quantize_dynamic_torch(model), paths['torch_dynamic'], config)
+    quantize_onnx(paths['fp32_onnx'], paths['onnx_dynamic'], mode='dynamic')
+    calibration = calibration_windows(calibration_dataset, n_calibration)
+    quantize_onnx(paths['fp32_onnx'], paths['onnx_static'], mode='static', calibration=calibration)
+
+    if verbose:
+        for name, path in paths.items():
+            print(f"📦 {name:14s} {os.path.getsize(path) / 1e6:6.2f} MB  {path}")
+    return paths
+
+
+def quantization_report(variants, subjects, fs=125, window_size=500, tolerance_s=0.05,
+                        threshold=0.5, batch_size=64, verbose=True):
+    """
+    F1 por pico, latência e tamanho de cada variante.
+
+    Args:
+        variants: Dict nome → caminho (.pth/.onnx), ex.: `build_quantized_variants`.
+            A primeira entrada é a referência para Δ F1 e speedup.
+        subjects: Sujeitos com 'ppg' e 'peaks' (de preferência fora do treino)
+        tolerance_s: Distância máxima para um pico predito contar como acerto
+
+    Returns:
+        Lista de dicts com 'variant', 'f1', 'precision', 'recall', 'delta_f1',
+        'ms_per_window', 'speedup', 'size_mb'
+    """
+    rows = []
+    for name, path in variants.items():
+        backend = load_backend(path, batch_size=batch_size)
+        beats = [evaluate_peaks(peaks_from_probs(predict_signal(backend, subj['ppg'], window_size),
+                                                 fs, threshold),
+                                subj['peaks'], fs, tolerance_s * 1000)
+                 for subj in subjects]
+        summary = summarize_peak_metrics(beats)
+        speed = benchmark_backends({name: backend}, window_size, batch_sizes=(batch_size,))[0]
+        rows.append({
+            'variant': name, 'f1': summary['f1'], 'precision': summary['ppv'],
+            'recall': summary['sensitivity'],
+            'ms_per_window': speed['ms_per_window'], 'size_mb': os.path.getsize(path) / 1e6,
+        })
+
+    for row in rows:
+        row['delta_f1'] = row['f1'] - rows[0]['f1']
+        row['speedup'] = rows[0]['ms_per_window'] / row['ms_per_window']
+
+    if verbose:
+        print(f"{'variante':14s} {'F1':>6s} {'ΔF1':>7s} {'ms/jan':>7s} {'speedup':>7s} {'MB':>6s}")
+        for r in rows:
+            print(f"{r['variant']:14s} {r['f1']:6.3f} {r['delta_f1']:+7.3f} {r['ms_per_window']:7.2f} "
+                  f"{r['speedup']:6.2f}x {r['size_mb']:6.2f}")
+    return rows
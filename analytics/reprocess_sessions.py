@@ -0,0 +1,473 @@
+"""
+Reprocessamento em lote de todas as sessões gravadas (sem o app de anotação).
+
+Hoje uma sessão só é analisada quando alguém a abre no
+`peak_annotator_app.py`. Aqui as sessões de `hrv_sessions` (sessão inteira
+por linha) e/ou `hrv_batches` (lotes por `session_uuid`, remontados com
+`batch_reassembly` + `signal_conditioning.condition_session`) são:
+
+1. Listadas em páginas por `(created_at, id)` (keyset, só metadados)
+2. Processadas num pool de processos: cada worker busca o waveform da sua
+   sessão, aplica `preprocess_ppg` e detecta os picos com
+   `detect_peaks_auto` ou com o Performer (.onnx/.pth, reamostrado para
+   125 Hz e com os picos levados de volta à taxa original)
+3. Gravadas em Parquet (`<saida>/part-*.parquet`): uma linha por sessão
+   com os picos (lista int32) e as métricas de `hrv.hrv_from_peaks`,
+   calculadas em lote para cada parte
+
+Memória limitada: o processo principal só guarda metadados e no máximo
+`max_in_flight` sessões em processamento (cada worker tem um waveform por
+vez). Retomável: após cada parte, `<saida>/_state.json` guarda o watermark
+(`created_at`, id) da última sessão de um prefixo contíguo já gravado; uma
+nova execução continua dali (partes órfãs de uma execução interrompida são
+descartadas). Sessões com dados chegando há menos de `settle_minutes`
+ficam para a próxima execução, e o watermark nunca passa de uma sessão de
+lotes ainda aberta.
+
+Uso:
+    python reprocess_sessions.py --db-url postgresql://... --output reprocessed/
+    python reprocess_sessions.py --detector performer --model performer_peak_detector.onnx
+    df = load_results('reprocessed/')
+"""
+
+import argparse
+import collections
+import json
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from batch_reassembly import reassemble_sessions
+from hrv import hrv_from_peaks
+from profiling import profiled
+from session_repository import SessionRepository
+from signal_conditioning import condition_session, detect_peaks_auto, preprocess_ppg
+
+SOURCES = ('hrv_sessions', 'hrv_batches')
+DETECTORS = ('auto', 'performer')
+PERFORMER_FS = 125
+STATE_FILE = '_state.json'
+PART_PREFIX = 'part-'
+
+_SELECT_PAGE = {
+    'hrv_sessions': (
+        "SELECT id::text AS id, created_at, sampling_rate_hz FROM hrv_sessions "
+        "WHERE created_at < :cutoff {after} "
+        "ORDER BY created_at, id::text LIMIT :limit"
+    ),
+    'hrv_batches': (
+        "SELECT session_uuid::text AS id, MIN(created_at) AS created_at, "
+        "MAX(sampling_rate_hz) AS sampling_rate_hz FROM hrv_batches "
+        "GROUP BY session_uuid HAVING MIN(created_at) < :cutoff {after} "
+        "ORDER BY MIN(created_at), session_uuid::text LIMIT :limit"
+    ),
+}
+_AFTER = {
+    'hrv_sessions': "AND (created_at, id::text) > (:after_ts, :after_id)",
+    'hrv_batches': "AND (MIN(created_at), session_uuid::text) > (:after_ts, :after_id)",
+}
+# Início da sessão de lotes mais antiga ainda recebendo dados
+_OPEN_BATCHES = text(
+    "SELECT MIN(first_at) FROM (SELECT MIN(created_at) AS first_at, MAX(created_at) AS last_at "
+    "FROM hrv_batches GROUP BY session_uuid) s WHERE last_at >= :cutoff"
+)
+
+
+# ============== LISTAGEM ==============
+
+def source_cutoff(engine, source, settle_minutes=10):
+    """
+    Limite superior de `created_at` das sessões prontas para processar.
+
+    Em `hrv_batches` o limite recua até o início da sessão aberta mais
+    antiga, para o watermark não passar por cima dela.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=settle_minutes)
+    if source == 'hrv_batches':
+        with engine.connect() as conn:
+            first_open = conn.execute(_OPEN_BATCHES, {'cutoff': cutoff}).scalar()
+        if first_open is not None:
+            if first_open.tzinfo is None:
+                first_open = first_open.replace(tzinfo=timezone.utc)
+            cutoff = min(cutoff, first_open)
+    return cutoff
+
+
+def iter_sessions(engine, source, after=None, cutoff=None, page_size=500):
+    """
+    Metadados das sessões em ordem de (created_at, id), em páginas.
+
+    Args:
+        after: Watermark (created_at, id); só sessões depois dele
+        cutoff: Só sessões com created_at anterior (ver `source_cutoff`)
+
+    Yields:
+        (id, created_at, sampling_rate_hz)
+    """
+    cutoff = cutoff or datetime.now(timezone.utc)
+    while True:
+        params = {'cutoff': cutoff, 'limit': page_size}
+        clause = ''
+        if after is not None:
+            clause = _AFTER[source]
+            params.update(after_ts=after[0], after_id=after[1])
+        query = text(_SELECT_PAGE[source].format(after=clause))
+        with engine.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[0], row[1], row[2]
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+# ============== WORKER ==============
+
+_worker = {}
+
+
+def _init_worker(db_url, detector, model_path, channel, window_size, threshold):
+    """Conexão e modelo próprios de cada processo (carregados uma vez)."""
+    backend = None
+    if detector == 'performer':
+        from inference_backends import load_backend
+
+        if model_path.endswith('.onnx'):
+            backend = load_backend(model_path, intra_op_threads=1)
+        else:
+            import torch
+            torch.set_num_threads(1)  # um núcleo por worker, sem disputa entre processos
+            backend = load_backend(model_path)
+    engine = create_engine(db_url)
+    _worker.update({
+        'engine': engine,
+        'repo': SessionRepository(engine, cache_bytes=0),
+        'detector': detector,
+        'backend': backend,
+        'channel': channel,
+        'window_size': window_size,
+        'threshold': threshold,
+    })
+
+
+def load_signal(engine, source, session_id, channel='ir_waveform', nominal_fs=None, repo=None):
+    """
+    Sinal pré-processado (`preprocess_ppg`) de uma sessão.
+
+    Returns:
+        (sinal, fs, amostras inventadas nas lacunas entre lotes)
+    """
+    if source == 'hrv_sessions':
+        repo = repo or SessionRepository(engine, cache_bytes=0)
+        raw = repo.get_waveform(session_id, channel)
+        fs, gap_samples = float(nominal_fs), 0
+    else:
+        sessions = reassemble_sessions(engine, [session_id], channels=(channel,))
+        if not sessions:
+            raise KeyError(f"Sessão não encontrada: {session_id}")
+        session = condition_session(next(iter(sessions.values())))
+        raw, fs = session['signals'][channel], float(session['fs'])
+        gap_samples = int(session['gap_mask'].sum())
+    if len(raw) < 2:
+        raise ValueError(f"Sessão sem amostras suficientes: {session_id}")
+    return preprocess_ppg(raw), fs, gap_samples
+
+
+def detect_peaks(signal, fs, detector='auto', backend=None, window_size=500, threshold=0.5):
+    """Picos (amostras na taxa `fs`) com `detect_peaks_auto` ou com o Performer."""
+    if detector == 'auto':
+        return np.asarray(detect_peaks_auto(signal, fs), dtype=np.int64)
+
+    from inference import predict_signal
+    from peak_evaluation import peaks_from_probs
+    from resampling import resample_rational
+
+    x = resample_rational(signal, fs, PERFORMER_FS) if fs != PERFORMER_FS else signal
+    peaks = peaks_from_probs(predict_signal(backend, x, window_size), PERFORMER_FS, threshold)
+    return np.clip(np.round(peaks * fs / PERFORMER_FS), 0, len(signal) - 1).astype(np.int64)
+
+
+@profiled('reprocess.session')
+def process_session(task):
+    """
+    Processa uma sessão dentro do worker.
+
+    Erros viram uma linha com status 'error' (o watermark segue adiante e a
+    sessão fica registrada na saída).
+    """
+    source, session_id, nominal_fs = task
+    w = _worker
+    t0 = time.perf_counter()
+    row = {'source': source, 'session_id': session_id, 'status': 'ok', 'error': None,
+           'fs': np.nan, 'n_samples': 0, 'gap_samples': 0,
+           'peaks': np.zeros(0, dtype=np.int32)}
+    try:
+        signal, fs, gap_samples = load_signal(w['engine'], source, session_id, w['channel'],
+                                              nominal_fs, w['repo'])
+        peaks = detect_peaks(signal, fs, w['detector'], w['backend'], w['window_size'],
+                             w['threshold'])
+        row.update(fs=fs, n_samples=len(signal), gap_samples=gap_samples,
+                   peaks=peaks.astype(np.int32))
+    except Exception as e:
+        row.update(status='error', error=f'{type(e).__name__}: {e}')
+    row['elapsed_ms'] = (time.perf_counter() - t0) * 1000
+    return row
+
+
+# ============== SAÍDA ==============
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {'watermarks': {}, 'parts': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(out_dir, state):
+    """Grava o estado de forma atômica (a parte já está no disco antes)."""
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def remove_orphan_parts(out_dir, state):
+    """Apaga partes gravadas por uma execução interrompida antes de atualizar o estado."""
+    known = set(state['parts'])
+    orphans = [f for f in os.listdir(out_dir)
+               if f.startswith(PART_PREFIX) and f.endswith('.parquet') and f not in known]
+    for f in orphans:
+        os.remove(os.path.join(out_dir, f))
+    return orphans
+
+
+def results_frame(rows, detector, frequency=True):
+    """Linhas dos workers → DataFrame com os picos e o HRV (em lote) de cada sessão."""
+    df = pd.DataFrame(rows)
+    df['detector'] = detector
+    df['duration_s'] = df['n_samples'] / df['fs']
+    df['n_peaks'] = df['peaks'].map(len)
+    df['processed_at'] = datetime.now(timezone.utc)
+    metrics = hrv_from_peaks(list(df['peaks']), df['fs'].fillna(1.0).to_numpy(),
+                             frequency=frequency)
+    return pd.concat([df.reset_index(drop=True), metrics], axis=1)
+
+
+def write_part(out_dir, df):
+    """Grava uma parte Parquet (escrita atômica) e devolve o nome do arquivo."""
+    name = f"{PART_PREFIX}{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+    path = os.path.join(out_dir, name)
+    df.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return name
+
+
+def load_results(out_dir, columns=None, latest=True):
+    """
+    Resultados gravados (só as partes registradas no estado).
+
+    Args:
+        columns: Colunas a ler (ex.: sem 'peaks' para só as métricas)
+        latest: Mantém só o processamento mais recente de cada sessão
+            (execuções com --full acrescentam novas linhas)
+    """
+    state = load_state(out_dir)
+    if columns is not None:
+        columns = list(dict.fromkeys(['source', 'session_id', 'processed_at', *columns]))
+    parts = [pd.read_parquet(os.path.join(out_dir, p), columns=columns) for p in state['parts']]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(parts, ignore_index=True)
+    if latest:
+        df = (df.sort_values('processed_at', kind='stable')
+                .drop_duplicates(['source', 'session_id'], keep='last')
+                .reset_index(drop=True))
+    return df
+
+
+# ============== PIPELINE ==============
+
+def _parse_watermark(mark):
+    return (datetime.fromisoformat(mark['created_at']), mark['id'])
+
+
+def reprocess_source(engine, pool, out_dir, state, source, detector='auto', page_size=500,
+                     max_in_flight=8, flush_rows=1000, settle_minutes=10, since=None,
+                     full=False, frequency=True, verbose=True):
+    """
+    Reprocessa as sessões de uma tabela a partir do watermark.
+
+    As tarefas são submetidas conforme a listagem avança (no máximo
+    `max_in_flight` rodando). Os resultados são gravados em ordem de
+    `created_at`: a cada `flush_rows` sessões do prefixo já concluído, uma
+    parte Parquet e o novo watermark.
+
+    Returns:
+        Dict com 'sessions', 'errors', 'peaks', 'parts', 'elapsed_s'
+    """
+    mark = state['watermarks'].get(source)
+    after = None
+    if since is not None:
+        after = (since, '')
+    elif mark and not full:
+        after = _parse_watermark(mark)
+
+    cutoff = source_cutoff(engine, source, settle_minutes)
+    tasks = iter_sessions(engine, source, after, cutoff, page_size)
+    pending = collections.deque()  # (metadados, future) na ordem de created_at
+    running = set()
+    done_rows, done_meta = [], []
+    stats = {'sessions': 0, 'errors': 0, 'peaks': 0, 'parts': 0}
+    exhausted = False
+    t0 = time.time()
+
+    def flush():
+        df = results_frame(done_rows, detector, frequency)
+        df.insert(2, 'created_at', [m[1] for m in done_meta])
+        name = write_part(out_dir, df)
+        last_id, last_created_at = done_meta[-1][0], done_meta[-1][1]
+        state['parts'].append(name)
+        state['watermarks'][source] = {'created_at': last_created_at.isoformat(), 'id': last_id}
+        save_state(out_dir, state)
+
+        stats['sessions'] += len(df)
+        stats['errors'] += int((df['status'] != 'ok').sum())
+        stats['peaks'] += int(df['n_peaks'].sum())
+        stats['parts'] += 1
+        done_rows.clear()
+        done_meta.clear()
+        if verbose:
+            rate = stats['sessions'] / max(time.time() - t0, 1e-9)
+            print(f"   {source}: {stats['sessions']} sessões ({stats['errors']} com erro) | "
+                  f"{rate:.1f} sessões/s | até {last_created_at}")
+
+    while True:
+        # Mantém o pool cheio; o total pendente (inclui os já concluídos que
+        # esperam uma sessão mais antiga) também é limitado
+        while not exhausted and len(running) < max_in_flight and len(pending) < 4 * max_in_flight:
+            meta = next(tasks, None)
+            if meta is None:
+                exhausted = True
+                break
+            future = pool.submit(process_session, (source, meta[0], meta[2]))
+            pending.append((meta, future))
+            running.add(future)
+
+        if not pending:
+            break
+        if running:
+            _, running = wait(running, return_when=FIRST_COMPLETED)
+
+        while pending and pending[0][1].done():
+            meta, future = pending.popleft()
+            done_rows.append(future.result())
+            done_meta.append(meta)
+        if len(done_rows) >= flush_rows:
+            flush()
+
+    if done_rows:
+        flush()
+    stats['elapsed_s'] = time.time() - t0
+    return stats
+
+
+def reprocess(db_url, out_dir, sources=SOURCES, detector='auto', model_path=None,
+              channel='ir_waveform', workers=None, page_size=500, max_in_flight=None,
+              flush_rows=1000, settle_minutes=10, since=None, full=False, frequency=True,
+              window_size=500, threshold=0.5, verbose=True):
+    """
+    Reprocessa `sources` num pool de `workers` processos (padrão: todos os núcleos).
+
+    Returns:
+        Dict tabela → estatísticas de `reprocess_source`
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("pyarrow não instalado: pip install pyarrow") from e
+    if detector == 'performer' and not model_path:
+        raise ValueError("O detector 'performer' precisa de um modelo (.onnx ou .pth)")
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    config = {'detector': detector, 'channel': channel}
+    if state.get('config', config) != config:
+        raise ValueError(f"{out_dir} já tem resultados de {state['config']}; use outra saída")
+    state['config'] = config
+    orphans = remove_orphan_parts(out_dir, state)
+    if verbose and orphans:
+        print(f"🧹 {len(orphans)} partes de uma execução interrompida descartadas")
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    engine = create_engine(db_url)
+    results = {}
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=_init_worker,
+                             initargs=(db_url, detector, model_path, channel, window_size,
+                                       threshold)) as pool:
+        for source in sources:
+            if verbose:
+                print(f"🔄 {source}: detector {detector}, {workers} workers...")
+            results[source] = reprocess_source(
+                engine, pool, out_dir, state, source, detector, page_size, max_in_flight,
+                flush_rows, settle_minutes, since, full, frequency, verbose,
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocessa picos e HRV de todas as sessões")
+    parser.add_argument('--db-url', default=os.environ.get('DATABASE_URL'),
+                        help="URL SQLAlchemy do Postgres (padrão: $DATABASE_URL)")
+    parser.add_argument('--source', choices=SOURCES, action='append',
+                        help="Tabela de origem (pode repetir; padrão: todas)")
+    parser.add_argument('--output', default='reprocessed', help="Diretório das partes Parquet")
+    parser.add_argument('--detector', choices=DETECTORS, default='auto')
+    parser.add_argument('--model', help="Modelo do Performer (.onnx ou .pth)")
+    parser.add_argument('--channel', default='ir_waveform')
+    parser.add_argument('--workers', type=int, default=None, help="Processos (padrão: núcleos)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="Sessões em processamento ao mesmo tempo (padrão: 2x workers)")
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--flush-rows', type=int, default=1000, help="Sessões por parte Parquet")
+    parser.add_argument('--settle-minutes', type=float, default=10,
+                        help="Ignora sessões com dados mais novos que isso")
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help="Começa após este created_at (ignora o watermark)")
+    parser.add_argument('--full', action='store_true', help="Reprocessa tudo desde o início")
+    parser.add_argument('--no-frequency', action='store_true', help="Só HRV no domínio do tempo")
+    parser.add_argument('--window-size', type=int, default=500)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if not args.db_url:
+        parser.error("Informe --db-url ou defina DATABASE_URL")
+    if args.detector == 'performer' and not args.model:
+        parser.error("--detector performer requer --model")
+    if args.since is not None and args.since.tzinfo is None:
+        args.since = args.since.replace(tzinfo=timezone.utc)
+
+    results = reprocess(
+        args.db_url, args.output, args.source or SOURCES, args.detector, args.model,
+        args.channel, args.workers, args.page_size, args.max_in_flight, args.flush_rows,
+        args.settle_minutes, args.since, args.full, not args.no_frequency,
+        args.window_size, args.threshold,
+    )
+    for source, stats in results.items():
+        print(f"✅ {source}: {stats['sessions']} sessões, {stats['peaks']} picos, "
+              f"{stats['errors']} erros, {stats['parts']} partes em {stats['elapsed_s']:.0f}s")
+
+
+if __name__ == '__main__':
+    main()
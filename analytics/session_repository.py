@@ -0,0 +1,152 @@
+"""
+Acesso preguiçoso às sessões do Supabase (`hrv_sessions`).
+
+`SELECT * FROM hrv_sessions` traz os três waveforms JSONB (dezenas de
+milhares de inteiros cada) de todas as sessões só para montar o dropdown.
+Aqui a listagem busca apenas colunas de metadados e o waveform de uma sessão
+é buscado sob demanda, decodificado para numpy e guardado em um cache LRU
+limitado por tamanho (bytes).
+
+Se a tabela já tiver as colunas binárias (`<coluna>_bin`, ver
+`database/migration_v10_binary_waveforms.sql`), elas são lidas no lugar do
+JSONB; linhas ainda não migradas caem no JSONB.
+
+Uso:
+    repo = SessionRepository(engine)
+    df_sessions = repo.list_sessions()
+    ir = repo.get_waveform(df_sessions.iloc[0]['id'])
+"""
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from waveform_codec import decode_waveform_bytes
+
+METADATA_COLUMNS = [
+    'id', 'created_at', 'device_id', 'user_name', 'session_index',
+    'timestamp_device_min', 'sampling_rate_hz', 'fc_mean', 'sdnn', 'rmssd',
+    'pnn50', 'rr_valid_count', 'user_age', 'user_gender', 'tags',
+]
+
+WAVEFORM_COLUMNS = ('ir_waveform', 'red_waveform', 'green_waveform')
+BINARY_SUFFIX = '_bin'
+
+
+def decode_waveform(value, dtype=np.int64):
+    """
+    Converte um waveform vindo do banco em array numpy.
+
+    Aceita lista (JSONB já decodificado pelo driver), texto JSON
+    ("[1, 2, ...]", como nos exports), BYTEA do `waveform_codec` ou None.
+    """
+    if value is None:
+        return np.zeros(0, dtype=dtype)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_waveform_bytes(value, dtype=dtype)
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('"'):
+            value = json.loads(value)  # JSON string dentro de JSON
+        return np.fromstring(value.strip('[]'), sep=',', dtype=dtype)
+    return np.asarray(value, dtype=dtype)
+
+
+class SessionRepository:
+    """
+    Repositório de sessões com cache LRU de waveforms decodificados.
+
+    Args:
+        engine: Engine SQLAlchemy
+        cache_bytes: Tamanho máximo do cache de waveforms (bytes)
+        table: Tabela de sessões
+    """
+
+    def __init__(self, engine, cache_bytes=256 * 1024 * 1024, table='hrv_sessions'):
+        self.engine = engine
+        self.cache_bytes = cache_bytes
+        self.table = table
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._binary_columns = None
+
+    def list_sessions(self, columns=None):
+        """Metadados de todas as sessões (sem waveforms), mais recentes primeiro."""
+        columns = columns or METADATA_COLUMNS
+        query = f"SELECT {', '.join(columns)} FROM {self.table} ORDER BY created_at DESC"
+        return pd.read_sql(query, self.engine)
+
+    def get_waveform(self, session_id, column='ir_waveform'):
+        """Waveform de uma sessão como array numpy (somente leitura, em cache)."""
+        if column not in WAVEFORM_COLUMNS:
+            raise ValueError(f"Coluna de waveform inválida: {column}")
+
+        key = (str(session_id), column)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        bin_column = column + BINARY_SUFFIX
+        if bin_column in self.binary_columns:
+            # JSONB só é convertido para texto quando a linha não foi migrada
+            query = text(
+                f"SELECT {bin_column}, "
+                f"CASE WHEN {bin_column} IS NULL THEN {column}::text END "
+                f"FROM {self.table} WHERE id = :id"
+            )
+        else:
+            query = text(f"SELECT NULL, {column}::text FROM {self.table} WHERE id = :id")
+        with self.engine.connect() as conn:
+            row = conn.execute(query, {'id': str(session_id)}).fetchone()
+        if row is None:
+            raise KeyError(f"Sessão não encontrada: {session_id}")
+
+        waveform = decode_waveform(row[0] if row[0] is not None else row[1])
+        waveform.flags.writeable = False
+        self._put(key, waveform)
+        return waveform
+
+    @property
+    def binary_columns(self):
+        """Colunas `<waveform>_bin` existentes na tabela (consultado uma vez)."""
+        if self._binary_columns is None:
+            query = text("SELECT column_name FROM information_schema.columns WHERE table_name = :table")
+            with self.engine.connect() as conn:
+                existing = {r[0] for r in conn.execute(query, {'table': self.table})}
+            self._binary_columns = {c + BINARY_SUFFIX for c in WAVEFORM_COLUMNS} & existing
+        return self._binary_columns
+
+    def _put(self, key, waveform):
+        if waveform.nbytes > self.cache_bytes:
+            return
+        self._cache[key] = waveform
+        self._cache_size += waveform.nbytes
+        while self._cache_size > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= evicted.nbytes
+
+    def invalidate(self, session_id=None):
+        """Remove uma sessão (ou todas) do cache."""
+        if session_id is None:
+            self._cache.clear()
+            self._cache_size = 0
+            return
+        for key in [k for k in self._cache if k[0] == str(session_id)]:
+            self._cache_size -= self._cache.pop(key).nbytes
+
+    @property
+    def cache_info(self):
+        return {
+            'entries': len(self._cache),
+            'bytes': self._cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
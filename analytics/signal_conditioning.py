@@ -0,0 +1,182 @@
+"""
+Condicionamento dos sinais na ingestão (antes de qualquer detector).
+
+1. Wraparound de 16 bits: o firmware v9 envia o valor do ADC truncado em
+   uint16, então quando o nível DC cruza 0/65535 o sinal salta ~65 mil
+   unidades (ex.: `docs/hrv_batches_400hz.json`, 0 → 65512). Um único salto
+   desses faz a normalização min/max achatar a sessão inteira. Aqui os
+   deltas entre amostras são trazidos para [-period/2, period/2) e
+   reacumulados — vetorizado sobre todos os canais de uma vez.
+2. Taxa de amostragem real: `sampling_rate_hz` é a taxa nominal; a taxa
+   efetiva (ex.: ~747 Hz em sessões "800 Hz") sai de `start_millis` /
+   `end_millis` de cada lote. Cada amostra ganha um instante de tempo
+   próprio e a sessão uma taxa efetiva robusta (mediana dos lotes).
+
+Uso (após batch_reassembly):
+    session = condition_session(reassemble_session(batches))
+    ir, fs, t = session['signals']['ir_waveform'], session['fs'], session['time_s']
+"""
+
+import numpy as np
+from scipy.signal import find_peaks
+
+UINT16_PERIOD = 1 << 16
+
+
+def count_wraps(x, period=UINT16_PERIOD, axis=-1):
+    """Número de saltos maiores que meio período (por canal)."""
+    d = np.diff(np.asarray(x, dtype=np.int64), axis=axis)
+    return (np.abs(d) > period // 2).sum(axis=axis)
+
+
+def unwrap_modular(x, period=UINT16_PERIOD, axis=-1):
+    """
+    Desfaz o wraparound de um sinal inteiro módulo `period`.
+
+    Só altera canais cujos valores estão todos em [0, period) — um sinal com
+    valores fora dessa faixa não foi truncado e saltos grandes nele são reais.
+    O resultado é deslocado por múltiplos de `period` para que a mediana
+    fique em [0, period).
+
+    Args:
+        x: Array 1D (um canal) ou N-D (canais empilhados)
+        axis: Eixo do tempo
+
+    Returns:
+        Array int64 do mesmo formato
+    """
+    x = np.asarray(x, dtype=np.int64)
+    if x.shape[axis] < 2:
+        return x.copy()
+
+    half = period // 2
+    d = np.diff(x, axis=axis)
+    wrapped = ((d + half) % period) - half
+    out = np.cumsum(wrapped, axis=axis)
+
+    first = np.take(x, [0], axis=axis)
+    out = np.concatenate([first, first + out], axis=axis)
+
+    # Recentrar: mediana de volta para [0, period)
+    shift = np.floor_divide(np.median(out, axis=axis, keepdims=True), period).astype(np.int64)
+    out -= shift * period
+
+    # Canais com valores fora de [0, period) ficam como estavam
+    in_range = (x.min(axis=axis, keepdims=True) >= 0) & (x.max(axis=axis, keepdims=True) < period)
+    return np.where(in_range, out, x)
+
+
+def batch_sample_times(session, rate_tolerance=0.05):
+    """
+    Instante (s) de cada amostra de uma sessão montada por batch_reassembly.
+
+    Cada lote usa a sua taxa efetiva ancorada em `end_millis`. Lotes cuja
+    taxa foge mais que `rate_tolerance` da mediana (ex.: o lote 0, que inclui
+    o tempo de inicialização do sensor) usam a taxa mediana. Amostras de
+    lacunas recebem tempo interpolado.
+
+    Returns:
+        time_s: Array (n_amostras,)
+        fs: Taxa efetiva da sessão (mediana dos lotes)
+        rates: Taxa usada em cada lote
+    """
+    rates = np.asarray(session['batch_rates'], dtype=np.float64)
+    fs = float(np.nanmedian(rates)) if np.isfinite(rates).any() else float(session['nominal_fs'])
+    outlier = ~np.isfinite(rates) | (np.abs(rates / fs - 1) > rate_tolerance)
+    rates = np.where(outlier, fs, rates)
+
+    copy = np.asarray(session['batch_copy'], dtype=np.int64)
+    skip = np.asarray(session['batch_skip'], dtype=np.int64)
+    offset = np.asarray(session['batch_offsets'], dtype=np.int64)
+    counts = np.asarray(session['batch_sample_counts'], dtype=np.int64)
+    end_s = np.asarray(session['batch_end_millis'], dtype=np.float64) / 1000
+
+    n = len(session['gap_mask'])
+    if copy.sum() == 0:
+        return np.arange(n) / fs, fs, rates
+
+    # Índice do lote e posição dentro do lote para cada amostra copiada
+    batch = np.repeat(np.arange(len(copy)), copy)
+    j = np.arange(copy.sum()) - np.repeat(np.cumsum(copy) - copy, copy)
+    k = skip[batch] + j
+    t_valid = end_s[batch] - (counts[batch] - k) / rates[batch]
+    positions = offset[batch] + j
+
+    time_s = np.interp(np.arange(n), positions, t_valid)
+    # Antes da primeira / depois da última amostra válida: extrapolar na taxa mediana
+    time_s[:positions[0]] = t_valid[0] - (positions[0] - np.arange(positions[0])) / fs
+    tail = np.arange(positions[-1] + 1, n)
+    time_s[tail] = t_valid[-1] + (tail - positions[-1]) / fs
+    return time_s, fs, rates
+
+
+def resample_uniform(values, time_s, fs):
+    """
+    Reamostra (interpolação linear) um ou mais canais para uma grade
+    uniforme em `fs` a partir dos instantes `time_s`.
+
+    Returns:
+        values_uniform (float64, canais no eixo 0 se N-D), grid_s
+    """
+    grid = np.arange(time_s[0], time_s[-1], 1.0 / fs)
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        return np.interp(grid, time_s, values), grid
+    return np.stack([np.interp(grid, time_s, v) for v in values]), grid
+
+
+def condition_session(session, period=UINT16_PERIOD, rate_tolerance=0.05, uniform=False):
+    """
+    Estágio de condicionamento para uma sessão de batch_reassembly.
+
+    Args:
+        session: Saída de reassemble_session
+        period: Período do wraparound (None para não desfazer)
+        uniform: Reamostrar todos os canais para a grade uniforme na taxa
+            efetiva (gap_mask é reamostrado por vizinho mais próximo)
+
+    Returns:
+        Cópia rasa de `session` com 'signals' condicionados, 'fs' efetiva,
+        'time_s', 'batch_rates_used' e 'n_wraps' ({canal: n})
+    """
+    channels = list(session['signals'])
+    stacked = np.stack([session['signals'][c] for c in channels])
+    n_wraps = count_wraps(stacked, period) if period else np.zeros(len(channels), dtype=int)
+    if period:
+        stacked = unwrap_modular(stacked, period)
+
+    time_s, fs, rates = batch_sample_times(session, rate_tolerance)
+    gap_mask = session['gap_mask']
+
+    if uniform:
+        stacked, grid = resample_uniform(stacked, time_s, fs)
+        nearest = np.clip(np.searchsorted(time_s, grid), 0, len(time_s) - 1)
+        gap_mask = gap_mask[nearest]
+        time_s = grid
+
+    out = dict(session)
+    out.update({
+        'signals': {c: stacked[i] for i, c in enumerate(channels)},
+        'gap_mask': gap_mask,
+        'fs': fs,
+        'time_s': time_s,
+        'batch_rates_used': rates,
+        'n_wraps': {c: int(n) for c, n in zip(channels, n_wraps)},
+    })
+    return out
+
+
+def preprocess_ppg(signal):
+    """Desfaz o wraparound de 16 bits, normaliza e inverte o sinal PPG"""
+    signal = unwrap_modular(signal)
+    sig_min = np.min(signal)
+    sig_max = np.max(signal)
+    sig_norm = (signal - sig_min) / (sig_max - sig_min)
+    return 1.0 - sig_norm
+
+
+def detect_peaks_auto(signal, fs, min_hr=40, max_hr=200):
+    """Detecta picos automaticamente"""
+    min_distance = int(fs * 60 / max_hr)
+    peaks, _ = find_peaks(signal, distance=min_distance, height=0.3, prominence=0.1)
+    return peaks.tolist()
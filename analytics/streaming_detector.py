@@ -0,0 +1,346 @@
+"""
+Detector de picos PPG incremental (online) para streams ao vivo.
+
+Consome blocos de amostras de tamanho fixo (ex.: as linhas de 2000 amostras
+de `hrv_batches`) e emite picos e intervalos RR assim que são confirmados,
+sem precisar da sessão inteira em memória.
+
+Pipeline por bloco (vetorizado com NumPy, laço Python só sobre candidatos):
+1. Passa-banda Butterworth 0.5-5 Hz com estado (sosfilt + zi)
+2. Máximos locais do sinal filtrado
+3. Limiar adaptativo (níveis de sinal/ruído estilo Pan-Tompkins)
+4. Período refratário (60/max_hr): um pico só é emitido quando nenhum
+   candidato maior pode mais substituí-lo → latência ≤ refratário
+5. Refinamento da posição no sinal bruto (compensa o atraso de fase do filtro)
+
+Memória por stream: O(1) — estado do filtro + ring buffer de ~2 s (cresce
+até caber um bloco + refratário, para o refinamento alcançar qualquer
+candidato do bloco). A saída não depende do tamanho dos blocos; ver
+`check_chunk_invariance`.
+`MultiStreamDetector` mantém um detector por dispositivo/sessão, para que um
+único worker processe muitos streams concorrentes.
+"""
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+class RingBuffer:
+    """Buffer circular de float64 endereçado por índice absoluto de amostra."""
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity)
+        self.end = 0  # índice absoluto da próxima amostra a ser escrita
+
+    def reserve(self, capacity):
+        """Aumenta a capacidade mantendo as amostras já escritas."""
+        capacity = int(capacity)
+        if capacity <= self.capacity:
+            return
+        start, kept = self.get(self.start, self.end)
+        self.capacity = capacity
+        self._data = np.zeros(capacity)
+        self._data[np.arange(start, self.end) % capacity] = kept
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n_total = len(values)
+        if n_total > self.capacity:
+            values = values[-self.capacity:]
+        n = len(values)
+        pos = (self.end + n_total - n) % self.capacity
+        first = min(n, self.capacity - pos)
+        self._data[pos:pos + first] = values[:first]
+        self._data[:n - first] = values[first:]
+        self.end += n_total
+
+    @property
+    def start(self):
+        return max(0, self.end - self.capacity)
+
+    def get(self, start, end):
+        """Amostras [start, end) (limitadas ao que ainda está no buffer)."""
+        start = max(start, self.start)
+        end = min(end, self.end)
+        if end <= start:
+            return start, np.zeros(0)
+        idx = np.arange(start, end) % self.capacity
+        return start, self._data[idx]
+
+    def max(self, last=None):
+        """Máximo das últimas `last` amostras (padrão: todo o buffer)."""
+        last = self.capacity if last is None else last
+        _, values = self.get(self.end - last, self.end)
+        return float(np.max(values)) if len(values) else 0.0
+
+
+class StreamingPeakDetector:
+    """
+    Detector de picos incremental para um único stream.
+
+    Uso:
+        det = StreamingPeakDetector(fs=800)
+        for chunk in chunks:
+            peaks, rr_ms = det.push(chunk)
+        peaks, rr_ms = det.flush()
+
+    Args:
+        fs: Taxa de amostragem (Hz)
+        invert: Inverte o sinal (o sinal do MAX30102 vem invertido)
+        band: Banda do filtro passa-banda (Hz)
+        max_hr: FC máxima (define o período refratário)
+        min_hr: FC mínima (sem pico por 60/min_hr s → re-aprende o limiar)
+        learn_sec: Duração da fase inicial de aprendizado do limiar
+        history_sec: Tamanho do ring buffer
+        refine_sec: Meia-janela de busca no sinal bruto em torno do pico filtrado
+    """
+
+    def __init__(self, fs, invert=True, band=(0.5, 5.0), min_hr=40, max_hr=200,
+                 learn_sec=2.0, history_sec=2.0, refine_sec=0.1):
+        self.fs = fs
+        self.sign = -1.0 if invert else 1.0
+        self.refractory = int(fs * 60 / max_hr)
+        self.max_rr = int(fs * 60 / min_hr)
+        self.learn_samples = int(learn_sec * fs)
+        self.refine = int(refine_sec * fs)
+
+        nyq = fs / 2
+        self._sos = butter(2, [band[0] / nyq, band[1] / nyq], btype='band', output='sos')
+        self._zi = None
+
+        self.history = int(history_sec * fs)
+        capacity = max(self.history, self.learn_samples, self._margin)
+        self._raw = RingBuffer(capacity)
+        self._filt = RingBuffer(capacity)
+
+        self._tail = np.zeros(0)  # últimas 2 amostras filtradas (contexto do máximo local)
+        self.n_samples = 0
+
+        # Limiar adaptativo
+        self.signal_level = None
+        self.noise_level = 0.0
+        self._learning = []  # candidatos vistos antes do limiar estar inicializado
+
+        # Pico pendente (ainda pode ser substituído por um candidato maior)
+        self._pending = None  # (idx, valor filtrado)
+        self._last_peak = None  # último pico emitido (posição refinada)
+        self._last_idx = None  # último pico emitido (posição no sinal filtrado)
+        self._last_activity = 0
+
+    @property
+    def _margin(self):
+        # Candidato pendente mais antigo que ainda pode ser refinado num push
+        return self.refractory + 2 * self.refine + 2
+
+    @property
+    def threshold(self):
+        if self.signal_level is None:
+            return np.inf
+        return self.noise_level + 0.25 * (self.signal_level - self.noise_level)
+
+    def _filter(self, x):
+        if self._zi is None:
+            self._zi = sosfilt_zi(self._sos) * x[0]
+        y, self._zi = sosfilt(self._sos, x, zi=self._zi)
+        return y
+
+    def _candidates(self, y):
+        """Máximos locais com índice absoluto (a última amostra fica para o próximo bloco)."""
+        seg = np.concatenate([self._tail, y])
+        offset = self.n_samples - len(self._tail)
+        self._tail = seg[-2:]
+        if len(seg) < 3:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        mid = seg[1:-1]
+        is_max = (mid > seg[:-2]) & (mid >= seg[2:])
+        idx = np.flatnonzero(is_max) + 1
+        return idx + offset, seg[idx]
+
+    def _refine(self, idx):
+        """Posição do máximo no sinal bruto em torno do pico filtrado."""
+        start, raw = self._raw.get(idx - self.refine, idx + self.refine + 1)
+        if len(raw) == 0:
+            return idx
+        return start + int(np.argmax(raw))
+
+    def _emit(self, out):
+        idx, value = self._pending
+        self._pending = None
+        self.signal_level = 0.125 * value + 0.875 * self.signal_level
+        peak = self._refine(idx)
+        if self._last_peak is not None and peak <= self._last_peak:
+            return
+        out.append(peak)
+        self._last_peak = peak
+        self._last_idx = idx
+        self._last_activity = idx
+
+    def _process_candidate(self, idx, value, out):
+        if value < self.threshold:
+            self.noise_level = 0.125 * value + 0.875 * self.noise_level
+            return
+
+        if self._pending is not None:
+            p_idx, p_value = self._pending
+            if idx - p_idx < self.refractory:
+                # Dentro do refratário: fica o maior
+                if value > p_value:
+                    self._pending = (idx, value)
+                return
+            self._emit(out)
+
+        if self._last_idx is not None and idx - self._last_idx < self.refractory:
+            return
+        self._pending = (idx, value)
+
+    def _init_threshold(self):
+        self.signal_level = self._filt.max(self.learn_samples)
+        learned = np.array([v for _, v in self._learning]) if self._learning else np.zeros(1)
+        self.noise_level = float(np.median(np.minimum(learned, self.signal_level))) * 0.5
+
+    def push(self, chunk):
+        """
+        Processa um bloco de amostras.
+
+        Returns:
+            peaks: Índices absolutos (desde o início do stream) dos picos confirmados
+            rr_ms: Intervalos RR (ms) correspondentes (NaN para o primeiro pico)
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if len(chunk) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # O limiar é inicializado exatamente em learn_samples, qualquer que
+        # seja o tamanho dos blocos
+        split = self.learn_samples - self.n_samples
+        if self.signal_level is None and 0 < split < len(chunk):
+            peaks_a, rr_a = self.push(chunk[:split])
+            peaks_b, rr_b = self.push(chunk[split:])
+            return np.concatenate([peaks_a, peaks_b]), np.concatenate([rr_a, rr_b])
+
+        x = self.sign * chunk
+        prev_peak = self._last_peak
+        # Candidatos do bloco inteiro (e o pendente do anterior) precisam do
+        # sinal bruto à volta deles até serem emitidos
+        self._raw.reserve(len(x) + self._margin)
+        self._filt.reserve(len(x) + self._margin)
+        y = self._filter(x)
+        self._raw.extend(x)
+        self._filt.extend(y)
+        cand_idx, cand_val = self._candidates(y)
+        self.n_samples += len(x)
+
+        out = []
+        if self.signal_level is None:
+            self._learning.extend(zip(cand_idx.tolist(), cand_val.tolist()))
+            if self.n_samples < self.learn_samples:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            self._init_threshold()
+            cand_idx = [i for i, _ in self._learning]
+            cand_val = [v for _, v in self._learning]
+            self._learning = []
+
+        for idx, value in zip(cand_idx, cand_val):
+            self._process_candidate(int(idx), float(value), out)
+
+        # Pendente confirmado: nenhum candidato dentro do refratário pode mais chegar
+        if self._pending is not None and self.n_samples - 1 - self._pending[0] >= self.refractory:
+            self._emit(out)
+
+        # Sem picos por muito tempo: re-aprender o nível de sinal pelo ring buffer
+        if self.n_samples - self._last_activity > 2 * self.max_rr:
+            self.signal_level = self._filt.max(self.history)
+            self.noise_level = 0.0
+            self._last_activity = self.n_samples
+
+        return self._with_rr(out, prev_peak)
+
+    def flush(self):
+        """Emite o pico pendente (fim do stream)."""
+        prev_peak = self._last_peak
+        out = []
+        if self._pending is not None:
+            self._emit(out)
+        return self._with_rr(out, prev_peak)
+
+    def _with_rr(self, out, prev_peak):
+        peaks = np.asarray(out, dtype=np.int64)
+        if len(peaks) == 0:
+            return peaks, np.zeros(0)
+        prev = np.concatenate([[prev_peak if prev_peak is not None else -1], peaks[:-1]])
+        rr_ms = np.where(prev >= 0, (peaks - prev) / self.fs * 1000, np.nan)
+        return peaks, rr_ms
+
+
+class MultiStreamDetector:
+    """
+    Um StreamingPeakDetector por stream (dispositivo/sessão).
+
+    Uso:
+        multi = MultiStreamDetector()
+        peaks, rr_ms = multi.push('device-A', chunk, fs=800)
+    """
+
+    def __init__(self, **detector_kwargs):
+        self.detector_kwargs = detector_kwargs
+        self.streams = {}
+
+    def push(self, stream_id, chunk, fs):
+        det = self.streams.get(stream_id)
+        if det is None:
+            det = StreamingPeakDetector(fs, **self.detector_kwargs)
+            self.streams[stream_id] = det
+        return det.push(chunk)
+
+    def close(self, stream_id):
+        """Finaliza e descarta um stream, retornando os picos pendentes."""
+        det = self.streams.pop(stream_id, None)
+        if det is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return det.flush()
+
+    def __len__(self):
+        return len(self.streams)
+
+
+def detect_peaks_stream(signal, fs, chunk_size=2000, **kwargs):
+    """
+    Roda o detector incremental sobre um sinal completo (para comparação
+    com `detect_peaks_auto`).
+
+    Returns:
+        peaks, rr_ms: Arrays com todos os picos e intervalos RR
+    """
+    det = StreamingPeakDetector(fs, **kwargs)
+    peaks, rrs = [], []
+    for start in range(0, len(signal), chunk_size):
+        p, rr = det.push(signal[start:start + chunk_size])
+        peaks.append(p)
+        rrs.append(rr)
+    p, rr = det.flush()
+    peaks.append(p)
+    rrs.append(rr)
+    return np.concatenate(peaks), np.concatenate(rrs)
+
+
+def check_chunk_invariance(signal, fs, chunk_sizes=(1, 500, 1500, 2000, 48000), **kwargs):
+    """
+    Confere que `detect_peaks_stream` dá os mesmos picos para vários tamanhos
+    de bloco (o primeiro é a referência).
+
+    Returns:
+        Dict tamanho do bloco → maior deslocamento (amostras) em relação à
+        referência (None se o número de picos difere)
+    """
+    reference = None
+    result = {}
+    for size in chunk_sizes:
+        peaks, _ = detect_peaks_stream(signal, fs, chunk_size=size, **kwargs)
+        if reference is None:
+            reference = peaks
+        if len(peaks) != len(reference):
+            result[size] = None
+        else:
+            result[size] = int(np.max(np.abs(peaks - reference))) if len(peaks) else 0
+    return result
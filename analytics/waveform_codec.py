@@ -0,0 +1,196 @@
+"""
+Codificação binária compacta de waveforms (coluna BYTEA).
+
+Nos JSONB de `hrv_sessions` / `hrv_batches` cada amostra ocupa ~7 bytes de
+texto ("58437, ") e a decodificação passa por parsing de JSON. Aqui o sinal
+é guardado como deltas entre amostras consecutivas, em um de dois formatos:
+
+- INT16: deltas como int16 little-endian (2 bytes/amostra). Decodificar é
+  `np.frombuffer` + `np.cumsum`.
+- VARINT: deltas em zigzag + varint (LEB128). Deltas pequenos (o caso comum
+  de PPG a 400/800 Hz) ocupam 1 byte; saltos grandes (ex.: wraparound do
+  uint16) cabem em até 10 bytes.
+
+`encode_waveform(..., codec='auto')` escolhe o menor dos dois. Codificação e
+decodificação são vetorizadas com NumPy (sem laço por amostra).
+
+Formato (little-endian):
+    magic  b'WF'   2 bytes
+    versão uint8   (FORMAT_VERSION)
+    codec  uint8   (CODEC_INT16 | CODEC_VARINT)
+    n      uint32  número de amostras
+    first  int64   primeira amostra
+    payload        n - 1 deltas
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b'WF'
+FORMAT_VERSION = 1
+CODEC_INT16 = 1
+CODEC_VARINT = 2
+
+_HEADER = struct.Struct('<2sBBIq')
+HEADER_SIZE = _HEADER.size
+
+_INT16_MIN, _INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+def zigzag_encode(values):
+    """int64 → uint64 (0, -1, 1, -2, ... → 0, 1, 2, 3, ...)"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values):
+    """uint64 → int64 (inverso de zigzag_encode)"""
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+
+def varint_sizes(values):
+    """Número de bytes de cada valor uint64 em varint (1 a 10)."""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+    return sizes
+
+
+def varint_encode(values):
+    """Codifica um array uint64 em varint (LEB128)."""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = varint_sizes(values)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+
+    # Um passe por posição de byte (no máximo 10), não por valor
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        mask = sizes > k
+        group = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[mask] > k + 1).astype(np.uint8) << 7
+        out[offsets[mask] + k] = group.astype(np.uint8) | more
+    return out.tobytes()
+
+
+def varint_decode(buf, count=None):
+    """
+    Decodifica varints (LEB128) em um array uint64.
+
+    Raises:
+        ValueError: Se o buffer terminar no meio de um varint ou o número de
+            valores não bater com `count`
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if len(data) == 0:
+        values = np.zeros(0, dtype=np.uint64)
+    elif not np.any(data & 0x80):
+        # Todos os varints têm 1 byte (caso comum de PPG)
+        values = data.astype(np.uint64)
+    else:
+        if data[-1] & 0x80:
+            raise ValueError("Varint truncado no fim do buffer")
+        is_last = data < 0x80
+        ends = np.flatnonzero(is_last)
+        starts = np.concatenate([[0], ends[:-1] + 1])
+
+        # Posição de cada byte dentro do seu varint
+        value_idx = np.concatenate([[0], np.cumsum(is_last)[:-1]])
+        pos = np.arange(len(data)) - starts[value_idx]
+        if pos.max() >= 10:
+            raise ValueError("Varint maior que 64 bits")
+
+        parts = (data & 0x7F).astype(np.uint64) << (7 * pos).astype(np.uint64)
+        values = np.bitwise_or.reduceat(parts, starts)
+
+    if count is not None and len(values) != count:
+        raise ValueError(f"Esperados {count} valores, encontrados {len(values)}")
+    return values
+
+
+def encode_waveform(values, codec='auto'):
+    """
+    Codifica um waveform inteiro em bytes (para coluna BYTEA).
+
+    Args:
+        values: Amostras inteiras (lista ou array)
+        codec: 'auto' (menor tamanho), 'int16' ou 'varint'
+
+    Returns:
+        bytes
+    """
+    values = np.asarray(values)
+    if values.size and not np.issubdtype(values.dtype, np.integer):
+        if not np.all(values == np.round(values)):
+            raise ValueError("Waveform com valores não inteiros")
+    values = values.astype(np.int64).ravel()
+
+    n = len(values)
+    first = int(values[0]) if n else 0
+    deltas = np.diff(values)
+
+    fits_int16 = len(deltas) == 0 or (deltas.min() >= _INT16_MIN and deltas.max() <= _INT16_MAX)
+    if codec == 'auto':
+        zz = zigzag_encode(deltas)
+        varint_size = int(varint_sizes(zz).sum())
+        codec = 'int16' if fits_int16 and 2 * len(deltas) <= varint_size else 'varint'
+
+    if codec == 'int16':
+        if not fits_int16:
+            raise ValueError("Deltas não cabem em int16; use codec='varint'")
+        payload = deltas.astype('<i2').tobytes()
+        codec_id = CODEC_INT16
+    elif codec == 'varint':
+        payload = varint_encode(zigzag_encode(deltas))
+        codec_id = CODEC_VARINT
+    else:
+        raise ValueError(f"Codec desconhecido: {codec}")
+
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, codec_id, n, first) + payload
+
+
+def decode_waveform_bytes(buf, dtype=np.int64):
+    """
+    Decodifica bytes gerados por `encode_waveform`.
+
+    Aceita bytes, bytearray, memoryview (psycopg2 devolve BYTEA como
+    memoryview) ou texto hex do Postgres ('\\x5746...').
+    """
+    if isinstance(buf, str):
+        buf = bytes.fromhex(buf[2:] if buf.startswith('\\x') else buf)
+    buf = memoryview(buf)
+    if len(buf) < HEADER_SIZE:
+        raise ValueError("Buffer menor que o cabeçalho do waveform")
+
+    magic, version, codec_id, n, first = _HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("Buffer não é um waveform codificado (magic inválido)")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Versão de formato não suportada: {version}")
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+
+    payload = buf[HEADER_SIZE:]
+    if codec_id == CODEC_INT16:
+        deltas = np.frombuffer(payload, dtype='<i2')
+        if len(deltas) != n - 1:
+            raise ValueError(f"Esperados {n - 1} deltas, encontrados {len(deltas)}")
+    elif codec_id == CODEC_VARINT:
+        deltas = zigzag_decode(varint_decode(payload, count=n - 1))
+    else:
+        raise ValueError(f"Codec desconhecido: {codec_id}")
+
+    out = np.empty(n, dtype=np.int64)
+    out[0] = first
+    np.cumsum(deltas, dtype=np.int64, out=out[1:])
+    out[1:] += first
+    return out.astype(dtype, copy=False)
+
+
+def is_encoded_waveform(value):
+    """True se `value` (bytes/memoryview) começa com o cabeçalho do codec."""
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return False
+    return bytes(value[:2]) == MAGIC
@@ -0,0 +1,158 @@
+"""
+Construção vetorizada de janelas PPG para o treino do Performer.
+
+As janelas são views com stride sobre o sinal original (sem cópia), a
+normalização Z-score é feita em lote para todas as janelas e o filtro
+"tem pelo menos um pico" é uma única máscara calculada com soma cumulativa.
+
+As janelas de cada sujeito são calculadas uma única vez e ficam em cache
+(por id do sujeito), de modo que os 53 folds do LOSO reaproveitam o mesmo
+resultado em vez de re-janelar tudo a cada fold.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from profiling import profiled
+
+
+def window_starts(n_samples, window_size, stride):
+    """
+    Índices de início das janelas.
+
+    Mantém a convenção original: range(0, n_samples - window_size, stride).
+    """
+    if n_samples <= window_size:
+        return np.empty(0, dtype=np.int64)
+    return np.arange(0, n_samples - window_size, stride, dtype=np.int64)
+
+
+def strided_windows(signal, window_size, stride):
+    """
+    Retorna uma view (n_janelas, window_size) do sinal, sem copiar dados.
+    """
+    signal = np.asarray(signal)
+    n_windows = len(window_starts(len(signal), window_size, stride))
+    if n_windows == 0:
+        return np.empty((0, window_size), dtype=signal.dtype)
+    return sliding_window_view(signal, window_size)[::stride][:n_windows]
+
+
+def zscore_windows(windows, eps=1e-8, dtype=np.float32):
+    """
+    Z-score por janela, em lote.
+
+    Args:
+        windows: Array (n_janelas, window_size)
+
+    Returns:
+        Array normalizado no dtype pedido
+    """
+    out = np.array(windows, dtype=np.float64)
+    if out.size == 0:
+        return out.astype(dtype)
+    mean = out.mean(axis=1, keepdims=True)
+    std = out.std(axis=1, keepdims=True) + eps
+    out -= mean
+    out /= std
+    return out.astype(dtype, copy=False)
+
+
+def peak_window_mask(labels, window_size, stride):
+    """
+    Máscara das janelas que contêm pelo menos uma amostra de pico.
+
+    Usa soma cumulativa: a soma de cada janela custa O(1).
+    """
+    labels = np.asarray(labels)
+    starts = window_starts(len(labels), window_size, stride)
+    csum = np.concatenate([[0.0], np.cumsum(labels, dtype=np.float64)])
+    return (csum[starts + window_size] - csum[starts]) > 0
+
+
+@profiled('window')
+def create_windows(ppg, labels, window_size, stride):
+    """
+    Cria janelas de PPG com labels correspondentes.
+
+    Versão vetorizada: views com stride + normalização em lote. Apenas janelas
+    com pelo menos 1 pico são mantidas.
+
+    Returns:
+        X: (n, window_size) float32, Z-score por janela
+        y: (n, window_size) float32, labels binários
+    """
+    mask = peak_window_mask(labels, window_size, stride)
+
+    X = zscore_windows(strided_windows(ppg, window_size, stride)[mask])
+    y = strided_windows(labels, window_size, stride)[mask].astype(np.float32)
+
+    return X, y
+
+
+class WindowCache:
+    """
+    Cache de janelas por sujeito.
+
+    A chave é (id do sujeito, window_size, stride). Se o array de labels do
+    sujeito for substituído (ex.: re-rotulagem), a entrada é recalculada.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, subject, window_size, stride):
+        key = (subject['id'], window_size, stride)
+        entry = self._entries.get(key)
+
+        if entry is None or entry['ppg'] is not subject['ppg'] or entry['labels'] is not subject['labels']:
+            X, y = create_windows(subject['ppg'], subject['labels'], window_size, stride)
+            entry = {'ppg': subject['ppg'], 'labels': subject['labels'], 'X': X, 'y': y}
+            self._entries[key] = entry
+
+        return entry['X'], entry['y']
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Cache compartilhado pelo notebook
+window_cache = WindowCache()
+
+
+def prepare_dataset_loso(subjects, test_subject_id, window_size, stride, cache=None):
+    """
+    Prepara dataset para validação Leave-One-Subject-Out.
+
+    Args:
+        subjects: Lista de todos os sujeitos
+        test_subject_id: ID do sujeito para teste
+        cache: WindowCache (padrão: cache global do módulo)
+
+    Returns:
+        X_train, y_train, X_test, y_test
+    """
+    cache = window_cache if cache is None else cache
+
+    X_train, y_train = [], []
+    X_test, y_test = [], []
+
+    for subj in subjects:
+        X_subj, y_subj = cache.get(subj, window_size, stride)
+
+        if subj['id'] == test_subject_id:
+            X_test.append(X_subj)
+            y_test.append(y_subj)
+        else:
+            X_train.append(X_subj)
+            y_train.append(y_subj)
+
+    X_train = np.concatenate(X_train, axis=0)
+    y_train = np.concatenate(y_train, axis=0)
+    X_test = np.concatenate(X_test, axis=0) if X_test else np.array([])
+    y_test = np.concatenate(y_test, axis=0) if y_test else np.array([])
+
+    return X_train, y_train, X_test, y_test
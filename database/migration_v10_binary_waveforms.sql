@@ -0,0 +1,50 @@
+-- ============================================
+-- MIGRAÇÃO v10 - WAVEFORMS BINÁRIOS (BYTEA)
+-- ============================================
+--
+-- Adiciona colunas BYTEA ao lado dos JSONB existentes. O formato é o de
+-- analytics/waveform_codec.py (deltas int16 ou zigzag+varint, ~1 byte por
+-- amostra contra ~7 bytes de texto JSON).
+--
+-- Passos:
+-- 1. Rodar este script (não altera dados existentes)
+-- 2. Preencher as colunas novas:
+--      python analytics/migrate_waveforms.py --db-url postgresql://...
+--    (idempotente: só processa linhas com *_bin NULL; pode ser interrompido
+--    e rodado de novo)
+-- 3. Leitores (SessionRepository) já preferem *_bin e caem no JSONB quando
+--    a linha ainda não foi migrada
+-- 4. Depois de validar, opcionalmente liberar o espaço dos JSONB (passo
+--    comentado no fim)
+
+ALTER TABLE hrv_sessions
+    ADD COLUMN IF NOT EXISTS ir_waveform_bin BYTEA,
+    ADD COLUMN IF NOT EXISTS red_waveform_bin BYTEA,
+    ADD COLUMN IF NOT EXISTS green_waveform_bin BYTEA;
+
+ALTER TABLE hrv_batches
+    ADD COLUMN IF NOT EXISTS ir_waveform_bin BYTEA,
+    ADD COLUMN IF NOT EXISTS red_waveform_bin BYTEA;
+
+-- Dados já comprimidos: evitar que o TOAST tente comprimir de novo
+ALTER TABLE hrv_sessions
+    ALTER COLUMN ir_waveform_bin SET STORAGE EXTERNAL,
+    ALTER COLUMN red_waveform_bin SET STORAGE EXTERNAL,
+    ALTER COLUMN green_waveform_bin SET STORAGE EXTERNAL;
+
+ALTER TABLE hrv_batches
+    ALTER COLUMN ir_waveform_bin SET STORAGE EXTERNAL,
+    ALTER COLUMN red_waveform_bin SET STORAGE EXTERNAL;
+
+COMMENT ON COLUMN hrv_sessions.ir_waveform_bin IS 'IR waveform encoded by analytics/waveform_codec.py (delta int16 or zigzag varint).';
+COMMENT ON COLUMN hrv_batches.ir_waveform_bin IS 'IR waveform encoded by analytics/waveform_codec.py (delta int16 or zigzag varint).';
+
+-- ============================================
+-- (Opcional) Após validar a migração
+-- ============================================
+-- UPDATE hrv_sessions SET ir_waveform = NULL, red_waveform = NULL, green_waveform = NULL
+--     WHERE ir_waveform_bin IS NOT NULL;
+-- UPDATE hrv_batches SET ir_waveform = NULL, red_waveform = NULL
+--     WHERE ir_waveform_bin IS NOT NULL;
+-- VACUUM FULL hrv_sessions;
+-- VACUUM FULL hrv_batches;
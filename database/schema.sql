@@ -36,7 +36,12 @@ CREATE TABLE IF NOT EXISTS hrv_sessions (
     -- Arrays of Integers.
     ir_waveform JSONB,
     red_waveform JSONB,
-    green_waveform JSONB
+    green_waveform JSONB,
+
+    -- Waveforms binários (analytics/waveform_codec.py), ver migration_v10
+    ir_waveform_bin BYTEA,
+    red_waveform_bin BYTEA,
+    green_waveform_bin BYTEA
 );
 
 -- Index for faster querying by date
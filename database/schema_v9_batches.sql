@@ -30,7 +30,11 @@ CREATE TABLE IF NOT EXISTS hrv_batches (
     
     -- Raw Data (tamanho controlado: ~2000 amostras = ~14KB)
     ir_waveform JSONB,
-    red_waveform JSONB
+    red_waveform JSONB,
+
+    -- Waveforms binários (analytics/waveform_codec.py), ver migration_v10
+    ir_waveform_bin BYTEA,
+    red_waveform_bin BYTEA
 );
 
 -- Índices para consultas eficientes